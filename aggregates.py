@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import ARTIFACT_PATH, load_columns, load_derived, read_stored, write_stored
+
+
+# the aggregate cube, a set of cuboids holding the row count (and sums) of every observed
+# combination of INCIDENT_YEAR x TIME_OF_DAY x the columns the charts group by.
+# name -> (group by columns, summed columns). Every cuboid is grouped by INCIDENT_YEAR
+# first so single years can be recomputed and swapped in by the incremental ingest.
+CUBE_KEYS = ['INCIDENT_YEAR', 'TIME_OF_DAY']
+AGGREGATE_SPECS = {
+    'size': (CUBE_KEYS + ['SIZE'], []),
+    'airport': (CUBE_KEYS + ['AIRPORT', 'DAMAGE_LEVEL'], ['COST_REPAIRS']),
+    'operator': (CUBE_KEYS + ['OPERATOR'], ['COST_REPAIRS']),
+    'phase_of_flight': (CUBE_KEYS + ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL'], []),
+    'precipitation_and_sky': (CUBE_KEYS + ['PRECIPITATION', 'SKY', 'WARNED', 'DAMAGE_LEVEL'], []),
+    # the count of every distinct SPEED value, an exact distribution which can be merged
+    # over any years, the box plots are computed from it
+    'speed_by_type_eng': (CUBE_KEYS + ['TYPE_ENG', 'SPEED'], []),
+    'speed_by_num_engs': (CUBE_KEYS + ['NUM_ENGS', 'SPEED'], []),
+    'speed_by_precipitation': (CUBE_KEYS + ['NUM_ENGS', 'PRECIPITATION', 'SPEED'], []),
+    'speed_by_damage_level': (CUBE_KEYS + ['TYPE_ENG', 'DAMAGE_LEVEL', 'SPEED'], []),
+    'speed_by_warned': (CUBE_KEYS + ['WARNED', 'SPEED'], []),
+}
+
+# besides the counts and sums every cell keeps the position of its first row, so rankings
+# can break ties by first occurrence like Counter.most_common does on the rows
+CELL_AGGREGATIONS = {'counts': 'sum', 'first_row': 'min'}
+
+
+def compute_aggregate(df, group_columns, sum_columns):
+    # row counts (and sums) for every observed combination, missing values are a group too.
+    # The index of df is taken as the row position.
+    keys = {}
+    for col in group_columns:
+        if col == 'INCIDENT_YEAR' and pd.api.types.is_datetime64_any_dtype(df[col]):
+            # the typed dataset keeps the year as a date, the aggregates as the plain year
+            keys[col] = df[col].dt.year
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            # grouped on the codes, groupby ignores dropna=False for categorical keys
+            keys[col] = df[col].cat.codes
+        else:
+            keys[col] = df[col]
+    keys = pd.DataFrame(keys, index=df.index)
+    values = df[sum_columns].assign(first_row=np.asarray(df.index, dtype=np.int64))
+    grouped = values.groupby([keys[col] for col in group_columns], dropna=False, sort=True)
+    result = grouped.size().to_frame('counts')
+    result['first_row'] = grouped['first_row'].min()
+    for col in sum_columns:
+        result[col] = grouped[col].sum()
+    result = result.reset_index()
+    for col in group_columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            result[col] = pd.Categorical.from_codes(result[col], dtype=df[col].dtype)
+        elif col in keys and keys[col].dtype != result[col].dtype:
+            # the group index has no float32, numeric keys get the dtype of the column back
+            result[col] = result[col].astype(keys[col].dtype)
+    return sort_aggregate(result, group_columns)
+
+
+def sort_aggregate(aggregate, group_columns):
+    # one row order for the aggregates however they were put together
+    return aggregate.sort_values(group_columns, na_position='last', ignore_index=True)
+
+
+def compute_aggregates(df, specs=AGGREGATE_SPECS):
+    return {
+        name: compute_aggregate(df, group_columns, sum_columns)
+        for name, (group_columns, sum_columns) in specs.items()
+    }
+
+
+def replace_years(stored_aggregates, recomputed_aggregates, years):
+    # swaps the rows of the given years for the recomputed ones, every other year is kept.
+    # The kept rows get the dtypes of the recomputed ones (the categories of the new
+    # artifact), categoricals of different categories would be concatenated as objects
+    combined = {}
+    for name, (group_columns, _) in AGGREGATE_SPECS.items():
+        stored, recomputed = stored_aggregates[name], recomputed_aggregates[name]
+        kept = stored[~stored['INCIDENT_YEAR'].isin(years)].astype(recomputed.dtypes.to_dict())
+        combined[name] = sort_aggregate(pd.concat([kept, recomputed], ignore_index=True), group_columns)
+    return combined
+
+
+# querying the cube, the cells of the selected years and times of day are summed up
+
+def select_cells(cuboid, year_range=None, times_of_day=None):
+    # year_range is inclusive like the slider, times_of_day behaves like isin (never NaN)
+    mask = np.ones(len(cuboid), dtype=bool)
+    if year_range is not None:
+        mask &= ((cuboid['INCIDENT_YEAR'] >= year_range[0]) & (cuboid['INCIDENT_YEAR'] <= year_range[1])).to_numpy()
+    if times_of_day is not None:
+        mask &= cuboid['TIME_OF_DAY'].isin(times_of_day).to_numpy()
+    return cuboid[mask]
+
+
+def cube_cells(year_range=None, times_of_day=None, path=ARTIFACT_PATH):
+    # the selected cells of every cuboid of the cube
+    return {
+        name: select_cells(cuboid, year_range, times_of_day)
+        for name, cuboid in load_cube(path).items()
+    }
+
+
+def rollup(cells, by, sum_columns=(), dropna=True):
+    '''
+    Counts (and sums) of the cells grouped by the given columns, in the order groupby
+    gives them for the rows. With dropna the groups with a missing key are left out
+    like groupby does by default, otherwise they are kept like Counter does.
+    '''
+    aggregations = dict(CELL_AGGREGATIONS, **{col: 'sum' for col in sum_columns})
+    if not by:
+        return cells[list(aggregations)].agg(aggregations).to_frame().T
+    keys = [
+        cells[col].cat.codes.rename(col) if isinstance(cells[col].dtype, pd.CategoricalDtype) else cells[col]
+        for col in by
+    ]
+    result = cells[list(aggregations)].groupby(keys, dropna=False, sort=True).agg(aggregations).reset_index()
+    for col in by:
+        if isinstance(cells[col].dtype, pd.CategoricalDtype):
+            result[col] = pd.Categorical.from_codes(result[col], dtype=cells[col].dtype)
+    if dropna:
+        result = result.dropna(subset=list(by)).reset_index(drop=True)
+    else:
+        # the missing group goes last like the other sort orders of the aggregates
+        result = sort_aggregate(result, list(by))
+    return result
+
+
+def strikes_per_year(cells):
+    # counts per year like df.groupby('INCIDENT_YEAR')['INCIDENT_YEAR'].agg('count')
+    return year_to_datetime(rollup(cells, ['INCIDENT_YEAR'])[['INCIDENT_YEAR', 'counts']])
+
+
+def damage_level_per_year(cells, levels):
+    # one column per damage level (output column -> level) with the counts of every
+    # selected year, years without any of the levels get 0
+    counts = rollup(cells, ['INCIDENT_YEAR', 'DAMAGE_LEVEL'])
+    result = rollup(cells, ['INCIDENT_YEAR'])[['INCIDENT_YEAR']]
+    for name, level in levels.items():
+        per_year = counts[counts['DAMAGE_LEVEL'] == level].set_index('INCIDENT_YEAR')['counts']
+        result[name] = per_year.reindex(result['INCIDENT_YEAR'], fill_value=0).to_numpy()
+    return year_to_datetime(result)
+
+
+def sum_per_group(cells, by, sum_column, name):
+    # sum of sum_column per observed value of by, like
+    # df.groupby(by, observed=True).agg(name=(sum_column, 'sum')).reset_index()
+    result = rollup(cells, [by], [sum_column])
+    if isinstance(result[by].dtype, pd.CategoricalDtype):
+        # with observed=True pandas gives the categories in order of first appearance
+        result = result.sort_values('first_row', ignore_index=True)
+    result = result[[by, sum_column]].rename(columns={sum_column: name})
+    return year_to_datetime(result) if by == 'INCIDENT_YEAR' else result
+
+
+def year_to_datetime(aggregate):
+    # the charts keep the year as a date, like the INCIDENT_YEAR column of the dataset
+    return aggregate.assign(INCIDENT_YEAR=pd.to_datetime(aggregate['INCIDENT_YEAR'].astype(str), format='%Y'))
+
+
+def cube_columns(specs=AGGREGATE_SPECS):
+    columns = []
+    for group_columns, sum_columns in specs.values():
+        columns += [c for c in group_columns + sum_columns if c not in columns]
+    return columns
+
+
+def write_cube(aggregates, path=ARTIFACT_PATH):
+    # every cuboid next to the artifact at path, see data_loader.write_stored
+    for name, aggregate in aggregates.items():
+        write_stored(aggregate, name, path)
+
+
+def read_cube(path=ARTIFACT_PATH):
+    # the cube etl.py stored for the current version of the artifact, None when a cuboid
+    # is missing, stale or has other columns than its spec
+    cube = {}
+    for name, (group_columns, sum_columns) in AGGREGATE_SPECS.items():
+        stored = read_stored(name, path)
+        if stored is None:
+            return None
+        cuboid = stored[0].to_pandas()
+        if list(cuboid.columns) != group_columns + list(CELL_AGGREGATIONS) + sum_columns:
+            return None
+        cube[name] = cuboid
+    return cube
+
+
+def compute_cube(path=ARTIFACT_PATH):
+    return compute_aggregates(load_columns(cube_columns(), path)[0])
+
+
+def build_cube(path=ARTIFACT_PATH):
+    # the stored cube, computed from the rows of the artifact only when there is none
+    cube = read_cube(path)
+    return compute_cube(path) if cube is None else cube
+
+
+def load_cube(path=ARTIFACT_PATH):
+    # the cube of the artifact, read once per artifact version and shared by every session
+    return load_derived('cube', build_cube, path)
@@ -0,0 +1,130 @@
+'''
+The numbers of the dashboard as json over http, for the tools which can not scrape
+streamlit. Every analysis of query.py (each gives the numbers of a chart) is served at
+/api/<analysis> and takes the filters of the dashboard:
+    /api/top_airports_by_cost?year_from=2000&year_to=2010&time_of_day=Day&time_of_day=Night
+Without year_from and year_to every year is used, without time_of_day every time of day.
+
+The bodies are memoized in the filter state cache of the application, and the ETag and
+Last-Modified headers are tied to the version of the artifact, so a client (or a proxy)
+revalidating a response gets a 304 without any query being run.
+
+    python api.py --port 8050
+    flask --app api run
+'''
+import argparse
+import datetime
+import hashlib
+import json
+import os
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.http import is_resource_modified
+
+from data_loader import ARTIFACT_PATH, file_fingerprint
+from query import ANALYSES, BACKENDS, QUERY_BACKEND, run_analysis
+from state_cache import dataset_version, filter_state, memoize
+
+
+# seconds a client or proxy may reuse a response without revalidating it, the
+# environment variable of the same name overrides it
+API_MAX_AGE = int(os.environ.get('API_MAX_AGE', 0))
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def request_filters(args):
+    # the year range (inclusive) and the times of day of the query string, None when absent
+    years = [args.get('year_from'), args.get('year_to')]
+    if years == [None, None]:
+        year_range = None
+    elif None in years:
+        raise BadRequest('year_from and year_to go together')
+    else:
+        try:
+            year_range = tuple(int(year) for year in years)
+        except ValueError:
+            raise BadRequest('year_from and year_to must be integers, got {!r} and {!r}'.format(*years))
+        if year_range[0] > year_range[1]:
+            raise BadRequest('year_from must not be after year_to')
+    times_of_day = args.getlist('time_of_day') or None
+    return year_range, times_of_day
+
+
+def analysis_json(name, year_range, times_of_day, backend, path):
+    result = run_analysis(name, year_range, times_of_day, backend, path)
+    split = result.to_dict(orient='split')
+    body = {
+        'analysis': name,
+        'year_range': None if year_range is None else list(year_range),
+        'times_of_day': times_of_day,
+        'columns': split['columns'],
+        'data': split['data'],
+    }
+    return json.dumps(body, separators=(',', ':'))
+
+
+def validators(name, state, path):
+    # the etag of an analysis (and its definition) and filter state for the current
+    # version of the artifact
+    version = dataset_version(path)
+    etag = hashlib.sha1(json.dumps([name, ANALYSES[name], version, state]).encode()).hexdigest()
+    mtime = file_fingerprint(path)['mtime_ns'] // 10 ** 9
+    return etag, datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+    return response
+
+
+def create_app(path=ARTIFACT_PATH, backend=QUERY_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError('backend must be one of {}, got {!r}'.format(BACKENDS, backend))
+    app = Flask(__name__)
+
+    @app.errorhandler(BadRequest)
+    def bad_request(error):
+        return jsonify(error=str(error)), 400
+
+    @app.route('/api/')
+    def index():
+        version = dict(dataset_version(path))
+        return jsonify(analyses=sorted(ANALYSES), dataset_version=version, backend=backend)
+
+    @app.route('/api/<name>')
+    def analysis(name):
+        if name not in ANALYSES:
+            return jsonify(error='unknown analysis {!r}'.format(name), analyses=sorted(ANALYSES)), 404
+        year_range, times_of_day = request_filters(request.args)
+        state = filter_state(year_range, times_of_day)
+        etag, last_modified = validators(name, state, path)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return with_validators(Response(status=304), etag, last_modified)
+        # the times of day in the order of the state, so equal filters give equal bodies
+        times_of_day = None if times_of_day is None else list(dict(state)['times_of_day'])
+        body = memoize(
+            ('api', name), state, lambda: analysis_json(name, year_range, times_of_day, backend, path), path
+        )
+        return with_validators(Response(body, mimetype='application/json'), etag, last_modified)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The analyses of the dashboard as a json api.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH)
+    parser.add_argument('--backend', default=QUERY_BACKEND)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    args = parser.parse_args()
+    create_app(args.artifact, args.backend).run(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
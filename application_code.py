@@ -1,25 +1,63 @@
-import streamlit as st
-import altair as alt
-import pandas as pd
-import seaborn as sns
-import numpy as np
-import matplotlib.pyplot as plt
-from utilities import preprocess_text_fields, remapping_function
-from utilities import altair_jointplot_speed_and_height, get_correlation_graph
-from collections import Counter
+import json
+from instrumentation import DEBUG_PANEL, new_run, instrument, timed_stage, finish_run, run_table
+
+# timings and memory of every stage of this run, logged and summed into the metrics. The
+# imports are the first stage, they only take time on the first run of the process
+run = new_run()
+with timed_stage(run, 'imports'):
+    import streamlit as st
+    import altair as alt
+    import pandas as pd
+    import numpy as np
+    from utilities import (
+        altair_jointplot_speed_and_height, altair_boxplot_from_stats, correlation_heatmap,
+        altair_missingness_heatmap, altair_strikes_per_year,
+    )
+    from data_loader import load_columns, sample_rows
+    from aggregates import (
+        load_cube, cube_cells, strikes_per_year, sum_per_group,
+    )
+    from chart_data import (
+        COUNT_Y, chart_counts, chart_box_stats, top_airport_cells, top_airport_counts, top_cost, damage_level_trends,
+    )
+    from missingness import load_missingness, null_rate_per_year_table, co_missing_table
+    from correlation import load_correlation_statistics, correlation_matrix
+    from ranking import load_ranking_indexes, top_k
+    from bitmap_index import load_bitmap_index, filter_bitmap, not_null_bitmap, bitmap_rows, bitmap_count
+    from state_cache import FILTER_CACHE, CHART_CACHE, filter_state, memoize, chart_spec, cache_stats
+    from defaults import (
+        DEFAULT_YEAR_RANGE, TIMES_OF_DAY, DEFAULT_TIMES_OF_DAY, SPEED_COLUMNS, CORRELATION_OPTIONS, DEFAULT_CORRELATION_COLUMNS,
+    )
+    from warmup import DEFAULT_CHARTS, start_warm_up, warm_up_ready, wait_for_warm_up
+run['state'] = filter_state()
 st.set_page_config(layout="wide")
 
+
+def show_chart(name, state, build, use_container_width=False):
+    # build() only runs (data and altair) when the json of the chart is not in the chart cache
+    def draw():
+        spec = chart_spec(name, state, build)
+        st.vega_lite_chart(json.loads(spec), use_container_width=use_container_width)
+        return spec
+    instrument(run, name, draw, state)
+
+
+def lazy_tabs(key, names, views, state=None):
+    # st.tabs runs the body of every tab on each rerun, here only the view of the picked
+    # tab runs, so a rerun costs what is on the screen whatever the number of tabs
+    picked = st.radio(key, names, horizontal=True, label_visibility='collapsed', key=key)
+    instrument(run, '{}: {}'.format(key, picked), views[names.index(picked)], state)
+
+
 # Title and subtitle
 st.write("""
 # Aircraft Wildlife Strikes Data
 #### Analyzing the hidden aspects of the wildlife strikes data actively maintained by FAA
 """)
 
-try:
-    df = pd.read_csv('data/main_data.csv')
-    print('df loading successful')
-except:
-    print('Something went wrong in loading data.')
+# the data and the default view are prepared on a background thread once per process,
+# the first visitor gets the page with a loading state instead of a blank one
+start_warm_up()
 
 # add introduction about the data 
 st.write("""
@@ -31,20 +69,18 @@ has received from airlines, airports, pilots, and other sources.
 - The dataset can be found at [FAA Wildlife strikes Data](https://wildlife.faa.gov/home).
 """)
 
-# ADD SEPARATOR
+if not warm_up_ready():
+    with st.spinner('Preparing the data, this only happens when the server starts ...'):
+        wait_for_warm_up()
 
-# some required preprocessing
-df = preprocess_text_fields(df)
-df = remapping_function(df)
-columns_to_remove = [
-    'NR_FATALITIES', 'NR_INJURIES', 'EFFECT_OTHER',  'LOCATION', 
-    'ENG_1_POS', 'ENG_2_POS', 'ENG_3_POS', 'ENG_4_POS', 'LATITUDE', 'LONGITUDE', 
-    # 'STR_RAD', 'DAM_RAD', 'STR_WINDSHLD', 'DAM_WINDSHLD', 'STR_NOSE', 'DAM_NOSE', 'STR_ENG1', 'DAM_ENG1', 'STR_ENG2', 
-    # 'DAM_ENG2', 'STR_ENG3', 'DAM_ENG3', 'STR_ENG4', 'DAM_ENG4', 'STR_PROP', 'DAM_PROP', 'STR_WING_ROT', 'DAM_WING_ROT', 
-    # 'STR_FUSE', 'DAM_FUSE', 'STR_LG', 'DAM_LG', 'STR_TAIL', 'DAM_TAIL', 'STR_LGHTS', 'DAM_LGHTS', 'STR_OTHER', 'DAM_OTHER',
-]
-df = df[[c for c in list(df.columns) if c not in columns_to_remove]]
-df['INCIDENT_YEAR'] = pd.to_datetime(df["INCIDENT_YEAR"], format='%Y')
+try:
+    # counts per year, time of day and chart dimensions, the charts below sum its cells
+    cube = instrument(run, 'load cube', load_cube)
+except Exception as e:
+    st.error('Something went wrong in loading the data: {}'.format(e))
+    st.stop()
+
+# ADD SEPARATOR
 
 # showing of data and graphs and df.head
 #   adding 4 tabs with total, small, medium and high damage and df.head
@@ -53,63 +89,40 @@ st.write(
     ##### Introduction Graphs and Dataframe
     '''
 )
-int_tab_1, int_tab_2, int_tab_3, int_tab_4, int_tab_5 = st.tabs(
-    [
-        'Total Strikes', 'Strikes with Small Birds',
-        'Strikes with Medium or Large Birds',
-        'Dataframe',
-        'Initial Preprocessing Steps'
-    ]
-)
-with int_tab_1:
+int_tab_names = [
+    'Total Strikes', 'Strikes with Small Birds',
+    'Strikes with Medium or Large Birds',
+    'Dataframe',
+    'Initial Preprocessing Steps'
+]
+def int_tab_1():
     st.write('##### Total number of Wildlife Strikes through the years')
-    temp_df = df.groupby(
-        'INCIDENT_YEAR'
-    )['INCIDENT_YEAR'].agg('count').to_frame('counts').reset_index()
-    # plotting
-    chart_1 = alt.Chart(temp_df).mark_line().encode(
-        alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
-        # x='INCIDENT_YEAR',
-        alt.Y('counts'),
-    )
-    st.altair_chart(chart_1, use_container_width=True)
+    # built by the warm up before the first session asks for it
+    show_chart('chart_1', filter_state(), DEFAULT_CHARTS['chart_1'], use_container_width=True)
 
-with int_tab_2:
+def int_tab_2():
     st.write('##### Total number of Strikes with small species through the years')
-    temp_df = df[df.SIZE == 'Small'].groupby(
-        'INCIDENT_YEAR'
-    )['INCIDENT_YEAR'].agg('count').to_frame('counts').reset_index()
-    # plotting
-    chart_2 = alt.Chart(temp_df).mark_line().encode(
-        alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
-        # x='INCIDENT_YEAR',
-        alt.Y('counts'),
-    )
-    st.altair_chart(chart_2, use_container_width=True)
+    def chart_2():
+        return altair_strikes_per_year(strikes_per_year(cube['size'][cube['size'].SIZE == 'Small']))
+    show_chart('chart_2', filter_state(), chart_2, use_container_width=True)
 
-with int_tab_3:
+def int_tab_3():
     st.write('##### Total number of Strikes with medium and large species throughthe years')
-    temp_df = df[df.SIZE.isin(['Medium', 'Large'])].groupby(
-        'INCIDENT_YEAR'
-    )['INCIDENT_YEAR'].agg('count').to_frame('counts').reset_index()
-    # plotting
-    chart_3 = alt.Chart(temp_df).mark_line().encode(
-        alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
-        # x='INCIDENT_YEAR',
-        alt.Y('counts'),
-    )
-    st.altair_chart(chart_3, use_container_width=True)
+    def chart_3():
+        return altair_strikes_per_year(strikes_per_year(cube['size'][cube['size'].SIZE.isin(['Medium', 'Large'])]))
+    show_chart('chart_3', filter_state(), chart_3, use_container_width=True)
 
-with int_tab_4:
+def int_tab_4():
     st.header('Dataset Display')
     num_rows_to_see = st.number_input(
         'Insert a number of rows you want to see:',
         min_value=1, max_value=100, value= 10
     )
-    temp_df = df.sample(num_rows_to_see)
+    # only the sampled rows are read from the artifact
+    temp_df = sample_rows(num_rows_to_see)
     st.dataframe(temp_df)
 
-with int_tab_5:
+def int_tab_5():
     st.header('Initial Preprocessing Steps :')
     st.write(
         '''
@@ -120,18 +133,29 @@ with int_tab_5:
         4) Normalizing null values all across the dataframe as 'None' has a different meaning in some of the columns.
         '''
     )
+lazy_tabs('int_tab', int_tab_names, [int_tab_1, int_tab_2, int_tab_3, int_tab_4, int_tab_5])
 
-# show the missing value heatmap 
+# show the missing values, summarized over all the rows once per dataset version
 st.write(
     '''
-    #### HeatMap for assessing missingness type.
-    Info : Since data is too big showing map on randomly sampled 50k subset.
+    #### Missing values for assessing missingness type.
     '''
 )
-m_df = df.sample(50000)
-missing_value_heatmap = plt.figure(figsize=(20,20))
-sns.heatmap(m_df.isna().transpose(), cmap="viridis")
-st.pyplot(missing_value_heatmap)
+miss_tab_names = ['Missing values per column', 'Missing values through the years', 'Columns missing together']
+def miss_tab_1():
+    show_chart('chart_null_rates', filter_state(), DEFAULT_CHARTS['chart_null_rates'], use_container_width=True)
+def miss_tab_2():
+    def chart_missing_per_year():
+        return altair_missingness_heatmap(
+            null_rate_per_year_table(load_missingness()), 'INCIDENT_YEAR', 'column', 'null_rate'
+        )
+    show_chart('chart_missing_per_year', filter_state(), chart_missing_per_year, use_container_width=True)
+def miss_tab_3():
+    # share of the rows missing either of the two columns which miss both
+    def chart_co_missing():
+        return altair_missingness_heatmap(co_missing_table(load_missingness()), 'column2', 'column', 'jaccard')
+    show_chart('chart_co_missing', filter_state(), chart_co_missing, use_container_width=True)
+lazy_tabs('miss_tab', miss_tab_names, [miss_tab_1, miss_tab_2, miss_tab_3])
 # and mention the missing type 
 st.write(
     '''
@@ -155,15 +179,18 @@ st.write(
 )
 year_range_values = st.slider(
     '',
-    1990, 2022, (2000, 2010), label_visibility='hidden'
+    1990, 2022, DEFAULT_YEAR_RANGE, label_visibility='hidden'
 )
 # ADD SEPARATOR
 
-df = df[
-    (df['INCIDENT_YEAR'] >= pd.to_datetime(year_range_values[0], format='%Y')) & 
-    (df['INCIDENT_YEAR'] <= pd.to_datetime(year_range_values[1], format='%Y'))
-]
-print('dataframe shape after subsetting for year is : {}'.format(df.shape))
+# filters are ANDs of the bitmaps of the index, the rows are never masked or copied
+# the selections and tables below are kept per filter state in a process wide LRU
+# cache, going back to a previous year range or time of day set recomputes nothing
+bitmaps = instrument(run, 'load bitmap index', load_bitmap_index)
+selection = instrument(run, 'year selection', lambda: memoize(
+    'year_selection', filter_state(year_range_values), lambda: filter_bitmap(bitmaps, year_range_values)
+), filter_state(year_range_values))
+print('number of rows after subsetting for year is : {}'.format(bitmap_count(selection)))
 
 
 # asking the user about the time of day he/she is in interested in
@@ -174,13 +201,29 @@ st.write(
 )
 options_time_of_day = st.multiselect(
     '',
-    ['Day', 'Night', 'Dusk', 'Dawn'],
-    ['Day', 'Night', 'Dusk', 'Dawn']
+    TIMES_OF_DAY,
+    DEFAULT_TIMES_OF_DAY
 )
 # ADD SEPARATOR
 
-df = df[df['TIME_OF_DAY'].isin(options_time_of_day)]
-print('dataframe shape after subsetting for time of day is : {}'.format(df.shape))
+state = filter_state(year_range_values, options_time_of_day)
+run['state'] = state
+year_selection = selection
+selection = instrument(run, 'selection', lambda: memoize(
+    'selection', state, lambda: year_selection & filter_bitmap(bitmaps, times_of_day=options_time_of_day)
+))
+print('number of rows after subsetting for time of day is : {}'.format(bitmap_count(selection)))
+# the cells of the cube for the same years and times of day
+cells = instrument(run, 'cells', lambda: memoize('cells', state, lambda: cube_cells(year_range_values, options_time_of_day)))
+
+
+def select_rows(complete):
+    # positions of the selected rows without a missing value in complete
+    return memoize(
+        ('rows', tuple(complete)), state,
+        lambda: bitmap_rows(bitmaps, selection & not_null_bitmap(bitmaps, complete))
+    )
+
 
 
 st.write(
@@ -201,129 +244,138 @@ if analysis_1 == 'Airport':
         #### Airport Analysis of 100 Airports with most Strikes
         '''
     )
-    air_tab_1, air_tab_2, air_tab_3, air_tab_4, air_tab_5, air_tab_6, air_tab_7 = st.tabs(
-        [
-            'Number of Strikes during the period selected:', 
-            'Number of Strikes with distinction in Damage Level',
-            'Number of Strikes with Minor or Substantial Damage',
-            'Damage Level Trends', 'Greatest Cost of Repairs for Airports',
-            'Greatest Cost of Repairs for Operators',
-            'Cost Incurred due to Strikes over the years'
-        ]
-    )
-
-    # selecting 100 most count airports
-    hundred_most_ws_airports = [
-        i[0] for i in Counter(df[df.AIRPORT != 'UNKNOWN'].AIRPORT.to_list()).most_common(100)
+    air_tab_names = [
+        'Number of Strikes during the period selected:', 
+        'Number of Strikes with distinction in Damage Level',
+        'Number of Strikes with Minor or Substantial Damage',
+        'Damage Level Trends', 'Greatest Cost of Repairs for Airports',
+        'Greatest Cost of Repairs for Operators',
+        'Cost Incurred due to Strikes over the years'
     ]
-    with air_tab_1:
-        st.write('#### Number of Strikes at top 100 Airports')
-        chart_5 = alt.Chart(df[df.AIRPORT.isin(hundred_most_ws_airports)]).mark_bar(size=10).encode(
-            x='AIRPORT:N',
-            y='count()',
-            # column='DAMAGE_LEVEL:N',
-        ).properties(
-            width=1500,
-            height=500
-        )
-        st.altair_chart(chart_5, use_container_width=True)
 
+    analysis_state = filter_state(year_range_values, options_time_of_day, analysis=analysis_1)
+    ranking = load_ranking_indexes()
 
-    with air_tab_2:
-        st.write('#### Number of Strikes at top 100 Airports with Damage Level')
-        chart_6 = alt.Chart(df[df.AIRPORT.isin(hundred_most_ws_airports)]).mark_bar(size=10).encode(
-            x='AIRPORT:N',
-            y='count()',
-            color='DAMAGE_LEVEL:N',
-        ).properties(
-            width=1500,
-            height=500
-        )
-        st.altair_chart(chart_6, use_container_width=True)
-
+    def top_airports():
+        # selecting 100 most count airports
+        return memoize('top_airports', analysis_state, lambda: top_airport_cells(
+            cells['airport'], top_k(ranking['AIRPORT'], year_range_values, options_time_of_day)
+        ))
 
-    with air_tab_3:
-        temp_df = df[df.DAMAGE_LEVEL.isin(['Substantial', 'Destroyed'])]
-        hundred_most_ws_airports = [
-            i[0] for i in Counter(temp_df[temp_df.AIRPORT != 'UNKNOWN'].AIRPORT.to_list()).most_common(100)
-        ]
+    def air_tab_1():
+        st.write('#### Number of Strikes at top 100 Airports')
+        def chart_5():
+            temp_df = memoize('chart_5', analysis_state, lambda: top_airport_counts(
+                cells, ranking, year_range_values, options_time_of_day
+            ))
+            return alt.Chart(temp_df).mark_bar(size=10).encode(
+                x='AIRPORT:N',
+                y=COUNT_Y,
+                # column='DAMAGE_LEVEL:N',
+            ).properties(
+                width=1500,
+                height=500
+            )
+        show_chart('chart_5', analysis_state, chart_5, use_container_width=True)
+
+
+    def air_tab_2():
+        st.write('#### Number of Strikes at top 100 Airports with Damage Level')
+        def chart_6():
+            temp_df = memoize('chart_6', analysis_state, lambda: chart_counts('chart_6', top_airports()))
+            return alt.Chart(temp_df).mark_bar(size=10).encode(
+                x='AIRPORT:N',
+                y=COUNT_Y,
+                color='DAMAGE_LEVEL:N',
+            ).properties(
+                width=1500,
+                height=500
+            )
+        show_chart('chart_6', analysis_state, chart_6, use_container_width=True)
+
+
+    def air_tab_3():
+        damage_levels = ['Substantial', 'Destroyed']
         st.write('#### Number of Strikes at top 100 Airports with Damage Level Substantial or Destroyed')
-        chart_7 = alt.Chart(temp_df[temp_df.AIRPORT.isin(hundred_most_ws_airports)]).mark_bar(size=10).encode(
-            x='AIRPORT:N',
-            y='count()',
-            color='DAMAGE_LEVEL:N',
-        ).properties(
-            width=1500,
-            height=500
-        )
-        st.altair_chart(chart_7, use_container_width=True)
-
-    with air_tab_4:
+        def chart_7():
+            temp_df = memoize('chart_7', analysis_state, lambda: chart_counts('chart_7', top_airport_cells(
+                cells['airport'],
+                top_k(ranking['AIRPORT'], year_range_values, options_time_of_day, damage_levels),
+                damage_levels
+            )))
+            return alt.Chart(temp_df).mark_bar(size=10).encode(
+                x='AIRPORT:N',
+                y=COUNT_Y,
+                color='DAMAGE_LEVEL:N',
+            ).properties(
+                width=1500,
+                height=500
+            )
+        show_chart('chart_7', analysis_state, chart_7, use_container_width=True)
+
+    def air_tab_4():
         st.write(
             '''
             ##### Damage level through the years.
             '''
         )
-        temp_df = df[['INCIDENT_YEAR', 'DAMAGE_LEVEL']].groupby('INCIDENT_YEAR').agg(
-            no_damage=('DAMAGE_LEVEL', lambda x: Counter(x)['No_Damage']),
-            minor_damage=('DAMAGE_LEVEL', lambda x: Counter(x)['Minor']),
-            substantial_damage=('DAMAGE_LEVEL', lambda x: Counter(x)['Substantial']),
-            destroyed=('DAMAGE_LEVEL', lambda x: Counter(x)['Destroyed'])
-        ).reset_index()
-        temp_df = temp_df.melt(id_vars=['INCIDENT_YEAR'], value_vars=['no_damage', 'minor_damage', 'substantial_damage', 'destroyed'])
-        chart_8 = alt.Chart(temp_df).mark_line().encode(
-            alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
-            y='value:Q',
-            color='variable:N'
-        )
-        st.altair_chart(chart_8, use_container_width=True)
-
-    with air_tab_5:
+        def chart_8():
+            temp_df = memoize('chart_8', analysis_state, lambda: damage_level_trends(cells['airport']))
+            return alt.Chart(temp_df).mark_line().encode(
+                alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
+                y='value:Q',
+                color='variable:N'
+            )
+        show_chart('chart_8', analysis_state, chart_8, use_container_width=True)
+
+    def air_tab_5():
         st.write(
             '''
             ##### Airports with greatest Cost of Repairs
             '''
         )
-        temp_df = df.groupby('AIRPORT').agg(
-            Cost_of_Repairs=('COST_REPAIRS', 'sum')
-        ).reset_index()
-        temp_df = temp_df.sort_values(by='Cost_of_Repairs', ascending=False)
-        chart_8_1 = alt.Chart(temp_df.iloc[:100, :]).mark_bar(size=10).encode(
-            x='AIRPORT',
-            y='Cost_of_Repairs',
-        ).interactive()
-        st.altair_chart(chart_8_1, use_container_width=True)
-
-    with air_tab_6:
+        def chart_8_1():
+            temp_df = memoize('chart_8_1', analysis_state, lambda: top_cost(
+                ranking['AIRPORT'], year_range_values, options_time_of_day
+            ))
+            return alt.Chart(temp_df).mark_bar(size=10).encode(
+                x='AIRPORT',
+                y='Cost_of_Repairs',
+            ).interactive()
+        show_chart('chart_8_1', analysis_state, chart_8_1, use_container_width=True)
+
+    def air_tab_6():
         st.write(
             '''
             ##### Airline with greatest Cost of Repairs
             '''
         )
-        temp_df = df.groupby('OPERATOR').agg(
-            Cost_of_Repairs=('COST_REPAIRS', 'sum')
-        ).reset_index()
-        temp_df = temp_df.sort_values(by='Cost_of_Repairs', ascending=False)
-        chart_8_2 = alt.Chart(temp_df.iloc[:100, :]).mark_bar(size=10).encode(
-            x='OPERATOR',
-            y='Cost_of_Repairs',
-        ).interactive()
-        st.altair_chart(chart_8_2, use_container_width=True)
-
-    with air_tab_7:
+        def chart_8_2():
+            temp_df = memoize('chart_8_2', analysis_state, lambda: top_cost(
+                ranking['OPERATOR'], year_range_values, options_time_of_day
+            ))
+            return alt.Chart(temp_df).mark_bar(size=10).encode(
+                x='OPERATOR',
+                y='Cost_of_Repairs',
+            ).interactive()
+        show_chart('chart_8_2', analysis_state, chart_8_2, use_container_width=True)
+
+    def air_tab_7():
         st.write(
             '''
             ##### Cost of Repairs through the years
             '''
         )
-        temp_df = df.groupby('INCIDENT_YEAR').agg(
-            Cost_of_Repairs=('COST_REPAIRS', 'sum')
-        ).reset_index()
-        chart_8_3 = alt.Chart(temp_df).mark_line().encode(
-            alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
-            y='Cost_of_Repairs:Q',
-        ).interactive()
-        st.altair_chart(chart_8_3, use_container_width=True)
+        def chart_8_3():
+            temp_df = memoize('chart_8_3', analysis_state, lambda: sum_per_group(
+                cells['airport'], 'INCIDENT_YEAR', 'COST_REPAIRS', 'Cost_of_Repairs'
+            ))
+            return alt.Chart(temp_df).mark_line().encode(
+                alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
+                y='Cost_of_Repairs:Q',
+            ).interactive()
+        show_chart('chart_8_3', analysis_state, chart_8_3, use_container_width=True)
+    lazy_tabs('air_tab', air_tab_names, [air_tab_1, air_tab_2, air_tab_3, air_tab_4, air_tab_5, air_tab_6, air_tab_7], analysis_state)
 elif analysis_1 == 'Phase of Flight':
     st.write(
         '''
@@ -331,47 +383,50 @@ elif analysis_1 == 'Phase of Flight':
         '''
     )
     # phase of flight with with number of birds and damage level analysis
-    ph_tab_1, ph_tab_2, ph_tab_3 = st.tabs(
-        [
-            'PHASE_OF_FLIGHT Counts', 
-            'Phase of Flight with Number of birds struck',
-            'Phase of flight with number of birds struct and damage level',
-        ]
-    )
-    temp_df = df.dropna(subset=['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL'])
-    with ph_tab_1:
+    ph_tab_names = [
+        'PHASE_OF_FLIGHT Counts', 
+        'Phase of Flight with Number of birds struck',
+        'Phase of flight with number of birds struct and damage level',
+    ]
+    analysis_state = filter_state(year_range_values, options_time_of_day, analysis=analysis_1)
+    temp_df = cells['phase_of_flight']
+    def ph_tab_1():
         st.write('#### Phase of Flight')
-        chart_9 = alt.Chart(temp_df).mark_bar().encode(
-            x='PHASE_OF_FLIGHT:N',
-            y='count()',
-        ).properties(
-            width=1500,
-            height=500
-        ).interactive()
-        st.altair_chart(chart_9, use_container_width=True)
-
-    with ph_tab_2:
+        def chart_9():
+            return alt.Chart(memoize('chart_9', analysis_state, lambda: chart_counts('chart_9', temp_df))).mark_bar().encode(
+                x='PHASE_OF_FLIGHT:N',
+                y=COUNT_Y,
+            ).properties(
+                width=1500,
+                height=500
+            ).interactive()
+        show_chart('chart_9', analysis_state, chart_9, use_container_width=True)
+
+    def ph_tab_2():
         st.write('#### Phase of Flight with Number of birds struck')
-        chart_10 = alt.Chart(temp_df).mark_bar().encode(
-            x='PHASE_OF_FLIGHT:N',
-            y='count()',
-            color='NUM_STRUCK'
-        ).properties(
-            width=1500,
-            height=500
-        ).interactive()
-        st.altair_chart(chart_10, use_container_width=True)
-
-
-    with ph_tab_3:
+        def chart_10():
+            return alt.Chart(memoize('chart_10', analysis_state, lambda: chart_counts('chart_10', temp_df))).mark_bar().encode(
+                x='PHASE_OF_FLIGHT:N',
+                y=COUNT_Y,
+                color='NUM_STRUCK'
+            ).properties(
+                width=1500,
+                height=500
+            ).interactive()
+        show_chart('chart_10', analysis_state, chart_10, use_container_width=True)
+
+
+    def ph_tab_3():
         st.write('#### Phase of Flight with Num of Birds and Damage Level')
-        chart_11 = alt.Chart(temp_df).mark_bar().encode(
-            x='PHASE_OF_FLIGHT:N',
-            y='count()',
-            color='NUM_STRUCK',
-            column='DAMAGE_LEVEL'
-        ).interactive()
-        st.altair_chart(chart_11)
+        def chart_11():
+            return alt.Chart(memoize('chart_11', analysis_state, lambda: chart_counts('chart_11', temp_df))).mark_bar().encode(
+                x='PHASE_OF_FLIGHT:N',
+                y=COUNT_Y,
+                color='NUM_STRUCK',
+                column='DAMAGE_LEVEL'
+            ).interactive()
+        show_chart('chart_11', analysis_state, chart_11, use_container_width=False)
+    lazy_tabs('ph_tab', ph_tab_names, [ph_tab_1, ph_tab_2, ph_tab_3], analysis_state)
 
     st.write(
         '''
@@ -402,40 +457,41 @@ if analysis_2 == "Precipitation and Sky":
         #### Precipitation and Sky Analysis
         '''
     )
-    ps_tab_1, ps_tab_2 = st.tabs(
-        [
-            'Precipitation with Damage Level and Warning status',
-            'Sky with Damage Level and Warning status'
+    analysis_state = filter_state(year_range_values, options_time_of_day, analysis=analysis_2)
+    df = cells['precipitation_and_sky']
+    ps_tab_names = [
+        'Precipitation with Damage Level and Warning status',
+        'Sky with Damage Level and Warning status'
 
-        ]
-    )
-    with ps_tab_1:
+    ]
+    def ps_tab_1():
         st.write('##### Precipitaton with Damage Level and Warning Status')
-        temp_df = df.dropna(subset=['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL'])
-        chart_12 = alt.Chart(temp_df).mark_bar().encode(
-            x='PRECIPITATION:N',
-            y='count()',
-            color='WARNED',
-            column='DAMAGE_LEVEL'
-        ).properties(
-            width=300,
-            height=500
-        ).interactive()
-        st.altair_chart(chart_12, use_container_width=False)
-
-    with ps_tab_2:
+        def chart_12():
+            return alt.Chart(memoize('chart_12', analysis_state, lambda: chart_counts('chart_12', df))).mark_bar().encode(
+                x='PRECIPITATION:N',
+                y=COUNT_Y,
+                color='WARNED',
+                column='DAMAGE_LEVEL'
+            ).properties(
+                width=300,
+                height=500
+            ).interactive()
+        show_chart('chart_12', analysis_state, chart_12, use_container_width=False)
+
+    def ps_tab_2():
         st.write('#### Sky with Damage Level and Warning Status')
-        temp_df = df.dropna(subset=['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL'])
-        chart_13 = alt.Chart(temp_df).mark_bar().encode(
-            x='SKY:N',
-            y='count()',
-            color='WARNED',
-            column='DAMAGE_LEVEL'
-        ).properties(
-            width=300,
-            height=500
-        ).interactive()
-        st.altair_chart(chart_13, use_container_width=False)
+        def chart_13():
+            return alt.Chart(memoize('chart_13', analysis_state, lambda: chart_counts('chart_13', df))).mark_bar().encode(
+                x='SKY:N',
+                y=COUNT_Y,
+                color='WARNED',
+                column='DAMAGE_LEVEL'
+            ).properties(
+                width=300,
+                height=500
+            ).interactive()
+        show_chart('chart_13', analysis_state, chart_13, use_container_width=False)
+    lazy_tabs('ps_tab', ps_tab_names, [ps_tab_1, ps_tab_2], analysis_state)
 elif analysis_2 == "Speed":
     # Speed Analysis
     st.write(
@@ -443,80 +499,77 @@ elif analysis_2 == "Speed":
         #### SPEED Analysis
         '''
     )
-    sp_tab_1, sp_tab_2, sp_tab_3, sp_tab_4, sp_tab_5 = st.tabs(
-        [
-            'Speed and Type Of Engine', 'Speed and Number of Engines',
-            'Speed with Type of Engine and Precipitation',
-            'Speed with Damage Level and Type of Engines',
-            'Speed with Warning Status'
-        ]
-    )
+    analysis_state = filter_state(year_range_values, options_time_of_day, analysis=analysis_2)
+    sp_tab_names = [
+        'Speed and Type Of Engine', 'Speed and Number of Engines',
+        'Speed with Type of Engine and Precipitation',
+        'Speed with Damage Level and Type of Engines',
+        'Speed with Warning Status'
+    ]
 
-    with sp_tab_1:
+    def sp_tab_1():
         st.write('#### Speed and Type of Engine')
-        temp_df = df.dropna(subset=['SPEED', 'TYPE_ENG'])
-        chart_14 = alt.Chart(temp_df).mark_boxplot().encode(
-            alt.Y("SPEED:Q"),
-            x='TYPE_ENG:N'
-        ).interactive()
-        st.altair_chart(chart_14, use_container_width=True)
+        def chart_14():
+            temp_df = memoize('chart_14', analysis_state, lambda: chart_box_stats('chart_14', cells['speed_by_type_eng']))
+            return altair_boxplot_from_stats(temp_df, 'TYPE_ENG', 'SPEED')
+        show_chart('chart_14', analysis_state, chart_14, use_container_width=True)
 
 
-    with sp_tab_2:
+    def sp_tab_2():
         st.write('#### Speed and Number of Engine')
-        temp_df = df.dropna(subset=['SPEED', 'NUM_ENGS'])
-        chart_14_1 = alt.Chart(temp_df).mark_boxplot().encode(
-            alt.Y("SPEED:Q"),
-            x='NUM_ENGS:N'
-        ).interactive()
-        st.altair_chart(chart_14_1, use_container_width=True)
-
-    with sp_tab_3:
+        def chart_14_1():
+            temp_df = memoize('chart_14_1', analysis_state, lambda: chart_box_stats('chart_14_1', cells['speed_by_num_engs']))
+            return altair_boxplot_from_stats(temp_df, 'NUM_ENGS', 'SPEED')
+        show_chart('chart_14_1', analysis_state, chart_14_1, use_container_width=True)
+
+    def sp_tab_3():
         st.write('#### Speed with Precipitation and Number of Engines')
-        temp_df = df.dropna(subset=['PRECIPITATION', 'NUM_ENGS', 'SPEED'])
-        chart_15 = alt.Chart(temp_df).mark_boxplot().encode(
-            alt.Y("SPEED:Q"),
-            x='PRECIPITATION:N',
-            column='NUM_ENGS'
-        ).interactive()
-        st.altair_chart(chart_15, use_container_width=False)
+        def chart_15():
+            temp_df = memoize('chart_15', analysis_state, lambda: chart_box_stats('chart_15', cells['speed_by_precipitation']))
+            return altair_boxplot_from_stats(temp_df, 'PRECIPITATION', 'SPEED', column='NUM_ENGS:Q')
+        show_chart('chart_15', analysis_state, chart_15, use_container_width=False)
 
 
-    with sp_tab_4:
+    def sp_tab_4():
         st.write('#### Speed with Damage Level and Type of Engines')
-        temp_df = df.dropna(subset=['SPEED', 'TYPE_ENG', 'DAMAGE_LEVEL'])
-        chart_16 = alt.Chart(temp_df).mark_boxplot().encode(
-            alt.Y("SPEED:Q"),
-            x='DAMAGE_LEVEL:N',
-            column='TYPE_ENG'
-        ).interactive()
-        st.altair_chart(chart_16, use_container_width=False)
-
-    with sp_tab_5:
-        st.write('#### Speed with Warning Status')
-        temp_df = df.dropna(subset=['SPEED', 'WARNED'])
-        chart_17 = alt.Chart(temp_df).mark_boxplot().encode(
-            alt.Y("SPEED:Q"),
-            x='WARNED:N',
-        ).interactive()
-        st.altair_chart(chart_17, use_container_width=True)
+        def chart_16():
+            temp_df = memoize('chart_16', analysis_state, lambda: chart_box_stats('chart_16', cells['speed_by_damage_level']))
+            return altair_boxplot_from_stats(temp_df, 'DAMAGE_LEVEL', 'SPEED', column='TYPE_ENG:N')
+        show_chart('chart_16', analysis_state, chart_16, use_container_width=False)
 
+    def sp_tab_5():
+        st.write('#### Speed with Warning Status')
+        def chart_17():
+            temp_df = memoize('chart_17', analysis_state, lambda: chart_box_stats('chart_17', cells['speed_by_warned']))
+            return altair_boxplot_from_stats(temp_df, 'WARNED', 'SPEED')
+        show_chart('chart_17', analysis_state, chart_17, use_container_width=True)
+    lazy_tabs('sp_tab', sp_tab_names, [sp_tab_1, sp_tab_2, sp_tab_3, sp_tab_4, sp_tab_5], analysis_state)
+
+    # every row as a point freezes the browser for wide year ranges
+    jointplot_mode = st.radio(
+        'Jointplot', ('Sampled points', 'Density', 'All points'), horizontal=True
+    )
+    jointplot_mode = {'Sampled points': 'sample', 'Density': 'density', 'All points': 'points'}[jointplot_mode]
+    jointplot_state = filter_state(year_range_values, options_time_of_day, analysis=analysis_2, jointplot=jointplot_mode)
     col1, col2 = st.columns(2)
     with col1:
         st.write(
             '''#### Speed and Height Jointplot with Damage Level'''
         )
-        temp_df = df.dropna(subset=['SPEED', 'HEIGHT', 'DAMAGE_LEVEL'])
-        chart_18 = altair_jointplot_speed_and_height(temp_df, 'DAMAGE_LEVEL', opacity=0.6)
-        st.altair_chart(chart_18, use_container_width=True)
+        def chart_18():
+            # the shared read only columns, the jointplots get the positions of their rows
+            rows = select_rows(['SPEED', 'HEIGHT', 'DAMAGE_LEVEL'])
+            return altair_jointplot_speed_and_height(load_columns(SPEED_COLUMNS)[0], 'DAMAGE_LEVEL', opacity=0.6, mode=jointplot_mode, rows=rows)
+        show_chart('chart_18', jointplot_state, chart_18, use_container_width=True)
 
     with col2:
         st.write(
             '''#### Speed and Height Jointplot with Warning Status'''
         )
-        temp_df = df.dropna(subset=['SPEED', 'HEIGHT', 'WARNED'])
-        chart_19 = altair_jointplot_speed_and_height(temp_df, 'WARNED', opacity=0.8)
-        st.altair_chart(chart_19, use_container_width=True)
+        def chart_19():
+            rows = select_rows(['SPEED', 'HEIGHT', 'WARNED'])
+            return altair_jointplot_speed_and_height(load_columns(SPEED_COLUMNS)[0], 'WARNED', opacity=0.8, mode=jointplot_mode, rows=rows)
+        show_chart('chart_19', jointplot_state, chart_19, use_container_width=True)
 else:
     st.write('You did not select anything')
 
@@ -540,20 +593,26 @@ if analysis_3 == 'Yes':
     )
     options_for_correlation = st.multiselect(
         '',
-        [
-            'DAM_ENG1', 'DAM_ENG2', 'DAM_ENG3', 'DAM_ENG4', 'DAM_FUSE', 'DAM_LG', 'DAM_LGHTS', 
-            'DAM_NOSE', 'DAM_OTHER', 'DAM_PROP', 'DAM_RAD', 'DAM_TAIL', 'DAM_WINDSHLD', 'DAM_WING_ROT', 
-            'STR_ENG1', 'STR_ENG2', 'STR_ENG3', 'STR_ENG4', 'STR_FUSE', 'STR_LG', 'STR_LGHTS', 'STR_NOSE',
-             'STR_OTHER', 'STR_PROP', 'STR_RAD', 'STR_TAIL', 'STR_WINDSHLD', 'STR_WING_ROT'
-        ],
-        [
-            'DAM_ENG1', 'DAM_ENG2', 'DAM_FUSE', 'DAM_LG', 'DAM_LGHTS', 
-            'DAM_NOSE', 'DAM_PROP', 'DAM_RAD', 'DAM_TAIL', 'DAM_WINDSHLD',
-            'STR_ENG1', 'STR_ENG2', 'STR_FUSE', 'STR_LG', 'STR_LGHTS', 'STR_NOSE',
-            'STR_PROP', 'STR_RAD', 'STR_TAIL', 'STR_WINDSHLD'
-        ]
+        CORRELATION_OPTIONS,
+        DEFAULT_CORRELATION_COLUMNS
     )
-    chart_20 = get_correlation_graph(df, options_for_correlation)
-    st.altair_chart(chart_20, use_container_width=False)
+    correlation_state = filter_state(year_range_values, options_time_of_day, columns=tuple(options_for_correlation))
+    def chart_20():
+        # combined from the statistics of the selected years and times of day, no row is read
+        corr = memoize('chart_20', correlation_state, lambda: correlation_matrix(
+            load_correlation_statistics(), options_for_correlation, year_range_values, options_time_of_day
+        ))
+        return correlation_heatmap(corr)
+    show_chart('chart_20', correlation_state, chart_20, use_container_width=False)
 else:
     st.write('Ohkay. As you wish.')
+
+finish_run(run, {'filter': cache_stats(FILTER_CACHE), 'chart': cache_stats(CHART_CACHE)})
+
+# the stages of this run in the sidebar, with DEBUG_PANEL=1 or ?debug=1 in the url
+if DEBUG_PANEL or st.experimental_get_query_params().get('debug') == ['1']:
+    with st.sidebar:
+        st.write('#### Stages of this run')
+        st.dataframe(run_table(run))
+        st.write('Filter cache', cache_stats(FILTER_CACHE))
+        st.write('Chart cache', cache_stats(CHART_CACHE))
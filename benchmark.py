@@ -0,0 +1,290 @@
+'''
+Wall time and peak memory of every stage of the pipeline, from reading the csv to the
+json of each chart of the application. Every stage is timed on its own (best of
+--repeat runs), its peak memory is the peak of the python and numpy allocations
+(tracemalloc) of one more run. The results are saved as json, a run can be compared
+with a previous one and the stages slower or bigger than --threshold are flagged.
+
+    python benchmark.py --source data/main_data.csv --output benchmarks/main.json
+    python benchmark.py --synthetic 10 --baseline benchmarks/x10.json --output benchmarks/x10_new.json
+    python benchmark.py --compare benchmarks/x10.json benchmarks/x10_new.json --threshold 0.1
+
+The exit status is 1 when a regression is flagged.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregates import compute_cube, damage_level_per_year, select_cells, strikes_per_year, sum_per_group
+from bitmap_index import build_bitmap_indexes, bitmap_rows, filter_bitmap, mask_and_copy, not_null_bitmap
+from chart_data import (
+    BOX_CHARTS, COUNT_CHARTS, COUNT_Y, TOP_AIRPORT_CHARTS, chart_box_stats, chart_counts, count_chart,
+    top_airport_cells,
+)
+from correlation import compute_correlation_statistics, correlation_matrix
+from defaults import DEFAULT_CORRELATION_COLUMNS, DEFAULT_TIMES_OF_DAY, DEFAULT_YEAR_RANGE, SPEED_COLUMNS
+from data_loader import DATA_PATH, clear_column_cache, finalize_dataset, load_columns, write_artifact
+from missingness import compute_missingness, missingness_summary
+from ranking import RANKING_SPECS, build_ranking_index, cost_per_entity, top_k
+from state_cache import chart_json
+from synthetic_data import REAL_ROWS, synthetic_path, write_synthetic
+from utilities import (
+    altair_boxplot_from_stats, altair_jointplot_speed_and_height, correlation_heatmap, get_correlation_graph,
+    preprocess_text_fields, remapping_function,
+)
+
+
+# a stage is flagged when it is slower (or its peak memory bigger) than the baseline by
+# more than the threshold, and by more than these absolute amounts so noise is not flagged
+DEFAULT_THRESHOLD = 0.2
+MIN_SECONDS = 0.005
+MIN_PEAK_BYTES = 1024 ** 2
+
+
+
+def measure(results, stage, function, repeat=3):
+    '''
+    Best wall time of repeat calls of function and peak memory of one more call, stored
+    in results[stage]. Returns what function returned. Allocations made by arrow outside
+    of numpy are not seen by tracemalloc.
+    '''
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        seconds.append(time.perf_counter() - start)
+    del value
+    tracemalloc.start()
+    try:
+        value = function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results[stage] = {'seconds': min(seconds), 'peak_bytes': peak_bytes}
+    print('{:<40} {:>10.4f}s {:>10.1f}MB'.format(stage, min(seconds), peak_bytes / 1024 ** 2))
+    return value
+
+
+def cold_load_columns(columns, path):
+    # the columns as the first session of a fresh process reads them
+    clear_column_cache()
+    return load_columns(columns, path)[0]
+
+
+def line_chart(data, y):
+    return alt.Chart(data).mark_line().encode(alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')), alt.Y(y))
+
+
+def bar_chart(data, x, y):
+    return alt.Chart(data).mark_bar(size=10).encode(x=x, y=y).interactive()
+
+
+def chart_stages(context):
+    '''
+    chart -> (data, chart) of the charts of the application, data() prepares the table
+    of the chart from the context and chart(table) draws it like the application does.
+    '''
+    cells, ranking = context['cells'], context['ranking']
+    year_range, times_of_day = context['year_range'], context['times_of_day']
+    levels = {'no_damage': 'No_Damage', 'minor_damage': 'Minor', 'substantial_damage': 'Substantial', 'destroyed': 'Destroyed'}
+    stages = {
+        'chart_1': (lambda: strikes_per_year(context['cube']['size']), lambda data: line_chart(data, 'counts')),
+        'chart_8': (
+            lambda: damage_level_per_year(cells['airport'], levels).melt(id_vars=['INCIDENT_YEAR'], value_vars=list(levels)),
+            lambda data: alt.Chart(data).mark_line().encode(
+                alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')), y='value:Q', color='variable:N'
+            ),
+        ),
+        'chart_8_1': (
+            lambda: cost_per_entity(ranking['AIRPORT'], year_range, times_of_day).sort_values(by='Cost_of_Repairs', ascending=False),
+            lambda data: bar_chart(data.iloc[:100, :], 'AIRPORT', 'Cost_of_Repairs'),
+        ),
+        'chart_8_3': (
+            lambda: sum_per_group(cells['airport'], 'INCIDENT_YEAR', 'COST_REPAIRS', 'Cost_of_Repairs'),
+            lambda data: line_chart(data, 'Cost_of_Repairs:Q'),
+        ),
+    }
+
+    def count_data(name):
+        cuboid = COUNT_CHARTS[name][0]
+        if name not in TOP_AIRPORT_CHARTS:
+            return lambda: chart_counts(name, cells[cuboid])
+        damage_levels = TOP_AIRPORT_CHARTS[name]
+        return lambda: chart_counts(name, top_airport_cells(
+            cells[cuboid], top_k(ranking['AIRPORT'], year_range, times_of_day, damage_levels), damage_levels
+        ))
+
+    for name in COUNT_CHARTS:
+        stages[name] = (count_data(name), lambda data, name=name: count_chart(data, name, COUNT_Y))
+    for name, (cuboid, by, value) in BOX_CHARTS.items():
+        column = '{}:{}'.format(by[0], 'Q' if by[0] == 'NUM_ENGS' else 'N') if len(by) > 1 else None
+        stages[name] = (
+            lambda name=name, cuboid=cuboid: chart_box_stats(name, cells[cuboid]),
+            lambda data, x=by[-1], value=value, column=column: altair_boxplot_from_stats(data, x, value, column=column),
+        )
+    for name, color, opacity in [('chart_18', 'DAMAGE_LEVEL', 0.6), ('chart_19', 'WARNED', 0.8)]:
+        stages[name] = (
+            lambda color=color: bitmap_rows(
+                context['bitmaps'], context['selection'] & not_null_bitmap(context['bitmaps'], ['SPEED', 'HEIGHT', color])
+            ),
+            lambda rows, color=color, opacity=opacity: altair_jointplot_speed_and_height(
+                context['speed'], color, opacity=opacity, mode='sample', rows=rows
+            ),
+        )
+    stages['chart_20'] = (
+        lambda: correlation_matrix(context['correlation'], DEFAULT_CORRELATION_COLUMNS, year_range, times_of_day),
+        correlation_heatmap,
+    )
+    return stages
+
+
+def run_benchmark(source, workdir, repeat=3, year_range=DEFAULT_YEAR_RANGE, times_of_day=DEFAULT_TIMES_OF_DAY):
+    '''
+    Times every stage on the csv source, the artifact and the derived values are
+    written to and read from workdir. Returns the meta data and the stages of the run.
+    '''
+    results = {}
+    path = os.path.join(workdir, 'benchmark.feather')
+
+    # from the csv to the artifact
+    raw = measure(results, 'load csv', lambda: pd.read_csv(source, low_memory=False), repeat)
+    text = measure(results, 'preprocess text fields', lambda: preprocess_text_fields(raw), repeat)
+    remapped = measure(results, 'remap', lambda: remapping_function(text), repeat)
+    df = measure(results, 'schema', lambda: finalize_dataset(remapped), repeat)
+    rows = len(df)
+    del raw, text, remapped
+    measure(results, 'write artifact', lambda: write_artifact(df, path), repeat)
+    del df
+
+    # what the application derives from the artifact
+    measure(results, 'load columns', lambda: cold_load_columns(None, path), repeat)
+    cube = measure(results, 'build cube', lambda: compute_cube(path), repeat)
+    bitmaps = measure(results, 'build bitmap index', lambda: build_bitmap_indexes(path), repeat)
+    measure(results, 'build missingness', lambda: missingness_summary(compute_missingness(path)), repeat)
+    ranking = measure(results, 'build ranking', lambda: {
+        entity: build_ranking_index(cube[cuboid], entity, split) for entity, (cuboid, split) in RANKING_SPECS.items()
+    }, repeat)
+    correlation = measure(results, 'build correlation', lambda: compute_correlation_statistics(path), repeat)
+
+    # the filters of the default view
+    columns = load_columns(['INCIDENT_YEAR', 'TIME_OF_DAY'] + SPEED_COLUMNS[:3], path)[0]
+    measure(results, 'filter mask and copy', lambda: mask_and_copy(columns, year_range, times_of_day, SPEED_COLUMNS[:3]), repeat)
+    selection = measure(results, 'filter bitmaps', lambda: filter_bitmap(bitmaps, year_range, times_of_day), repeat)
+    cells = measure(results, 'filter cube cells', lambda: {
+        name: select_cells(cuboid, year_range, times_of_day) for name, cuboid in cube.items()
+    }, repeat)
+
+    # every chart, its table and then its json
+    context = {
+        'cube': cube, 'cells': cells, 'ranking': ranking, 'bitmaps': bitmaps, 'selection': selection,
+        'correlation': correlation, 'speed': load_columns(SPEED_COLUMNS, path)[0],
+        'year_range': year_range, 'times_of_day': times_of_day,
+    }
+    for name, (data, chart) in chart_stages(context).items():
+        table = measure(results, '{} data'.format(name), data, repeat)
+        measure(results, '{} json'.format(name), lambda: chart_json(chart(table)), repeat)
+    # the correlation heatmap as it used to be computed, from the filtered rows
+    flags = load_columns(DEFAULT_CORRELATION_COLUMNS, path)[0]
+    flag_rows = flags.iloc[bitmap_rows(bitmaps, selection)]
+    measure(results, 'get_correlation_graph', lambda: chart_json(get_correlation_graph(flag_rows, DEFAULT_CORRELATION_COLUMNS)), repeat)
+
+    meta = {
+        'source': os.path.abspath(source),
+        'rows': rows,
+        'repeat': repeat,
+        'year_range': list(year_range),
+        'times_of_day': list(times_of_day),
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'versions': {'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pa.__version__, 'altair': alt.__version__},
+    }
+    return {'meta': meta, 'stages': results}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, min_seconds=MIN_SECONDS, min_peak_bytes=MIN_PEAK_BYTES):
+    '''
+    Change of the wall time and of the peak memory of every stage of both runs, a stage
+    is flagged as a regression when either grew by more than threshold (0.2 is 20%).
+    '''
+    report = {}
+    for stage, now in current['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            continue
+        row = {}
+        regression = False
+        for metric, minimum in [('seconds', min_seconds), ('peak_bytes', min_peak_bytes)]:
+            row['baseline_' + metric] = before[metric]
+            row['current_' + metric] = now[metric]
+            row[metric + '_change'] = now[metric] / before[metric] - 1 if before[metric] else np.nan
+            regression |= now[metric] > before[metric] * (1 + threshold) and now[metric] - before[metric] > minimum
+        row['regression'] = regression
+        report[stage] = row
+    return pd.DataFrame(report).T
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def print_comparison(report):
+    columns = ['baseline_seconds', 'current_seconds', 'seconds_change', 'peak_bytes_change', 'regression']
+    print(report[columns].to_string(float_format='{:.4f}'.format))
+    regressions = list(report.index[report['regression'].astype(bool)])
+    print('{} regression(s){}'.format(len(regressions), ': ' + ', '.join(regressions) if regressions else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wall time and peak memory of every stage of the pipeline.')
+    parser.add_argument('--source', default=DATA_PATH, help='csv export to run on')
+    parser.add_argument('--synthetic', type=int, help='run on a synthetic export of this many times the real rows')
+    parser.add_argument('--workdir', default='data/benchmark', help='where the artifacts and synthetic exports go')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--years', type=int, nargs=2, default=list(DEFAULT_YEAR_RANGE))
+    parser.add_argument('--time-of-day', nargs='*', default=DEFAULT_TIMES_OF_DAY)
+    parser.add_argument('--output', help='json file the results are saved to')
+    parser.add_argument('--baseline', help='json of a previous run to compare with')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='only compare two saved runs')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = (read_results(path) for path in args.compare)
+    else:
+        source = args.source
+        if args.synthetic:
+            source = synthetic_path(args.workdir, args.synthetic)
+            if not os.path.exists(source):
+                write_synthetic(source, REAL_ROWS * args.synthetic)
+        current = run_benchmark(source, args.workdir, args.repeat, tuple(args.years), args.time_of_day)
+        if args.output:
+            print('results saved to {}'.format(write_results(current, args.output)))
+        if not args.baseline:
+            return
+        baseline = read_results(args.baseline)
+    if print_comparison(compare(baseline, current, args.threshold)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
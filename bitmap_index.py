@@ -0,0 +1,185 @@
+'''
+Bitmap index of the rows of the artifact. Every value of the low cardinality columns
+and the non null rows of the frequently filtered columns get a packed bitmap (one bit
+per row), filters are bitwise ANDs and ORs of them and the selected rows come back as
+an array of row positions, no frame is masked or copied.
+
+Filtering with masks and copies and with the bitmaps (default filter state):
+    python bitmap_index.py
+    python bitmap_index.py --years 1990 2022 --time-of-day Day Night --repeat 20
+'''
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import ARTIFACT_PATH, load_columns, load_derived, read_artifact_schema
+from defaults import DEFAULT_TIMES_OF_DAY, DEFAULT_YEAR_RANGE
+from missingness import popcount
+
+
+# columns with one bitmap per value (the year for INCIDENT_YEAR)
+VALUE_COLUMNS = [
+    'INCIDENT_YEAR', 'TIME_OF_DAY', 'SIZE', 'DAMAGE_LEVEL', 'WARNED', 'PRECIPITATION',
+    'TYPE_ENG', 'NUM_ENGS', 'NUM_STRUCK',
+]
+# columns with a bitmap of their non null rows
+NOT_NULL_COLUMNS = [
+    'SPEED', 'HEIGHT', 'DAMAGE_LEVEL', 'WARNED', 'PHASE_OF_FLIGHT', 'NUM_STRUCK',
+    'PRECIPITATION', 'SKY', 'TYPE_ENG', 'NUM_ENGS',
+]
+
+
+def pack(mask):
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+
+def value_bitmaps(series):
+    # the distinct non null values of series (sorted) and one bitmap per value, stacked
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.dt.year
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, values = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, values = pd.factorize(series, sort=True)
+    bitmaps = np.stack([pack(codes == i) for i in range(len(values))]) if len(values) else np.zeros((0, 0), np.uint8)
+    return {'values': pd.Index(values), 'bitmaps': bitmaps}
+
+
+def build_bitmap_index(df, value_columns=VALUE_COLUMNS, not_null_columns=NOT_NULL_COLUMNS):
+    return {
+        'rows': len(df),
+        'values': {col: value_bitmaps(df[col]) for col in value_columns},
+        'not_null': {col: pack(df[col].notna().to_numpy()) for col in not_null_columns},
+    }
+
+
+def build_bitmap_indexes(path=ARTIFACT_PATH):
+    names = read_artifact_schema(path).names
+    value_columns = [col for col in VALUE_COLUMNS if col in names]
+    not_null_columns = [col for col in NOT_NULL_COLUMNS if col in names]
+    df, _ = load_columns(sorted(set(value_columns + not_null_columns), key=names.index), path)
+    return build_bitmap_index(df, value_columns, not_null_columns)
+
+
+def load_bitmap_index(path=ARTIFACT_PATH):
+    # built once per artifact version and shared by every session
+    return load_derived('bitmaps', build_bitmap_indexes, path)
+
+
+def all_rows(index):
+    # every row set, the padding bits of the last byte stay 0
+    return pack(np.ones(index['rows'], dtype=bool))
+
+
+def combine_or(index, bitmaps):
+    if len(bitmaps) == 0:
+        return np.zeros((index['rows'] + 7) // 8, dtype=np.uint8)
+    return np.bitwise_or.reduce(bitmaps, axis=0)
+
+
+def isin_bitmap(index, column, values):
+    # rows whose value of column is one of values, like series.isin(values)
+    entry = index['values'][column]
+    return combine_or(index, entry['bitmaps'][np.flatnonzero(entry['values'].isin(list(values)))])
+
+
+def range_bitmap(index, column, low, high):
+    # rows whose value of column is between low and high, both included
+    entry = index['values'][column]
+    values = entry['values']
+    return combine_or(index, entry['bitmaps'][np.flatnonzero((values >= low) & (values <= high))])
+
+
+def not_null_bitmap(index, columns):
+    # rows without a missing value in any of the columns, like dropna(subset=columns)
+    bitmap = all_rows(index)
+    for col in columns:
+        bitmap &= index['not_null'][col]
+    return bitmap
+
+
+def filter_bitmap(index, year_range=None, times_of_day=None):
+    # the rows of the selected years (inclusive) and times of day, like aggregates.select_cells
+    bitmap = all_rows(index)
+    if year_range is not None:
+        bitmap &= range_bitmap(index, 'INCIDENT_YEAR', year_range[0], year_range[1])
+    if times_of_day is not None:
+        bitmap &= isin_bitmap(index, 'TIME_OF_DAY', times_of_day)
+    return bitmap
+
+
+def bitmap_rows(index, bitmap):
+    # positions of the set rows, in row order
+    return np.flatnonzero(np.unpackbits(bitmap, count=index['rows']))
+
+
+def bitmap_count(bitmap):
+    return int(popcount(bitmap))
+
+
+def mask_and_copy(df, year_range, times_of_day, subset=None):
+    # the filtering the application used to do, a boolean mask per filter and a copy per step
+    df = df[
+        (df['INCIDENT_YEAR'] >= pd.to_datetime(year_range[0], format='%Y'))
+        & (df['INCIDENT_YEAR'] <= pd.to_datetime(year_range[1], format='%Y'))
+    ]
+    df = df[df['TIME_OF_DAY'].isin(times_of_day)]
+    if subset:
+        df = df.dropna(subset=subset)
+    return df
+
+
+def with_bitmaps(index, year_range, times_of_day, subset=None):
+    bitmap = filter_bitmap(index, year_range, times_of_day)
+    if subset:
+        bitmap &= not_null_bitmap(index, subset)
+    return bitmap_rows(index, bitmap)
+
+
+def best_seconds(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def benchmark(year_range=DEFAULT_YEAR_RANGE, times_of_day=tuple(DEFAULT_TIMES_OF_DAY), repeat=10, path=ARTIFACT_PATH):
+    '''
+    Best time of repeat runs of the filters of the application with masks and copies and
+    with the bitmap index, both give the same rows. The index is built before timing.
+    '''
+    index = load_bitmap_index(path)
+    cases = {
+        'year and time of day': [],
+        'speed x height x damage level': ['SPEED', 'HEIGHT', 'DAMAGE_LEVEL'],
+        'speed x height x warned': ['SPEED', 'HEIGHT', 'WARNED'],
+    }
+    report = {}
+    for name, subset in cases.items():
+        df, _ = load_columns(['INCIDENT_YEAR', 'TIME_OF_DAY'] + subset, path)
+        mask_seconds, rows = best_seconds(lambda: mask_and_copy(df, year_range, list(times_of_day), subset), repeat)
+        bitmap_seconds, positions = best_seconds(lambda: with_bitmaps(index, year_range, list(times_of_day), subset), repeat)
+        if not np.array_equal(df.index.get_indexer(rows.index), positions):
+            raise AssertionError('bitmap rows differ from the masked rows for {}'.format(name))
+        report[name] = {'rows': len(positions), 'mask_and_copy_ms': mask_seconds * 1e3, 'bitmap_ms': bitmap_seconds * 1e3}
+    report = pd.DataFrame(report).T.astype({'rows': np.int64})
+    report['speedup'] = (report['mask_and_copy_ms'] / report['bitmap_ms']).round(1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filtering with masks and copies and with the bitmap index.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH)
+    parser.add_argument('--years', type=int, nargs=2, default=list(DEFAULT_YEAR_RANGE))
+    parser.add_argument('--time-of-day', nargs='*', default=DEFAULT_TIMES_OF_DAY)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    print(benchmark(tuple(args.years), args.time_of_day, args.repeat, args.artifact).round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+'''
+Data of the count() bar charts. Instead of the filtered rows, the charts get one row
+per group with its count, summed by the y encoding, so the encodings stay the same.
+
+Payload of the charts before and after (default filter state of the application):
+    python chart_data.py
+    python chart_data.py --years 1990 2022 --time-of-day Day Night
+'''
+import argparse
+from collections import Counter
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from aggregates import AGGREGATE_SPECS, damage_level_per_year, load_cube, rollup, select_cells
+from data_loader import ARTIFACT_PATH, load_columns
+from defaults import DEFAULT_TIMES_OF_DAY, DEFAULT_YEAR_RANGE
+from ranking import cost_per_entity, load_ranking_indexes, top_k
+from state_cache import chart_json
+
+
+# count() as an aggregation of the precomputed counts, same axis title as count()
+COUNT_Y = alt.Y('sum(counts):Q', title='Count of Records')
+
+# chart -> (cuboid of the cube, encoded columns, columns whose missing rows the chart drops)
+COUNT_CHARTS = {
+    'chart_5': ('airport', ['AIRPORT'], []),
+    'chart_6': ('airport', ['AIRPORT', 'DAMAGE_LEVEL'], []),
+    'chart_7': ('airport', ['AIRPORT', 'DAMAGE_LEVEL'], []),
+    'chart_9': ('phase_of_flight', ['PHASE_OF_FLIGHT'], ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL']),
+    'chart_10': ('phase_of_flight', ['PHASE_OF_FLIGHT', 'NUM_STRUCK'], ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL']),
+    'chart_11': (
+        'phase_of_flight', ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL'], ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL']
+    ),
+    'chart_12': ('precipitation_and_sky', ['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL'], ['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL']),
+    'chart_13': ('precipitation_and_sky', ['SKY', 'WARNED', 'DAMAGE_LEVEL'], ['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL']),
+}
+
+# box plot chart -> (cuboid of the cube, grouped columns (facet first), value column)
+BOX_CHARTS = {
+    'chart_14': ('speed_by_type_eng', ['TYPE_ENG'], 'SPEED'),
+    'chart_14_1': ('speed_by_num_engs', ['NUM_ENGS'], 'SPEED'),
+    'chart_15': ('speed_by_precipitation', ['NUM_ENGS', 'PRECIPITATION'], 'SPEED'),
+    'chart_16': ('speed_by_damage_level', ['TYPE_ENG', 'DAMAGE_LEVEL'], 'SPEED'),
+    'chart_17': ('speed_by_warned', ['WARNED'], 'SPEED'),
+}
+
+# whiskers reach the furthest values within extent * IQR of the box, like mark_boxplot
+BOXPLOT_EXTENT = 1.5
+
+# rows the airport charts are restricted to, chart -> damage levels the ranking is done on
+TOP_AIRPORT_CHARTS = {'chart_5': None, 'chart_6': None, 'chart_7': ['Substantial', 'Destroyed']}
+
+
+def count_table(cells, by, complete=()):
+    # counts per combination of the encoded columns, missing values included like
+    # vega-lite groups them, rows with a missing value in complete are left out
+    if complete:
+        cells = cells.dropna(subset=list(complete))
+    return rollup(cells, list(by), dropna=False)[list(by) + ['counts']]
+
+
+def chart_counts(name, cells):
+    # the table chart name is drawn from, cells are the selected cells of its cuboid
+    _, by, complete = COUNT_CHARTS[name]
+    return count_table(cells, by, complete)
+
+
+def top_airport_cells(cells, airports, damage_levels=None):
+    # cells of the given airports (ranking.top_k), only of the given damage levels
+    if damage_levels is not None:
+        cells = cells[cells['DAMAGE_LEVEL'].isin(damage_levels)]
+    return cells[cells['AIRPORT'].isin(airports)]
+
+
+def top_airport_counts(cells, ranking, year_range, times_of_day):
+    # chart_5 in the order of the ranking, matched on the codes so the missing airport is too
+    airports = top_k(ranking['AIRPORT'], year_range, times_of_day)
+    counts = chart_counts('chart_5', top_airport_cells(cells['airport'], airports))
+    ranks = {code: rank for rank, code in enumerate(pd.Categorical(airports, dtype=counts['AIRPORT'].dtype).codes)}
+    return counts.iloc[np.argsort(counts['AIRPORT'].cat.codes.map(ranks).to_numpy(), kind='stable')]
+
+
+def top_cost(index, year_range, times_of_day):
+    # chart_8_1 and chart_8_2, the 100 entities (ranking index) with the greatest cost of repairs
+    table = cost_per_entity(index, year_range, times_of_day)
+    return table.sort_values(by='Cost_of_Repairs', ascending=False, kind='stable').iloc[:100]
+
+
+# chart_8, line -> damage level
+DAMAGE_LEVEL_LINES = {
+    'no_damage': 'No_Damage', 'minor_damage': 'Minor', 'substantial_damage': 'Substantial', 'destroyed': 'Destroyed',
+}
+
+
+def damage_level_trends(cells):
+    # chart_8, the strikes of every damage level per year in long form (variable, value)
+    table = damage_level_per_year(cells, DAMAGE_LEVEL_LINES)
+    return table.melt(id_vars=['INCIDENT_YEAR'], value_vars=list(DAMAGE_LEVEL_LINES))
+
+
+def sorted_quantile(values, cumulative, q):
+    # quantile q of the sorted distinct values with the given cumulative counts, interpolated
+    # between the two closest rows like vega (d3 quantileSorted) does
+    position = (cumulative[-1] - 1) * q
+    low = int(np.floor(position))
+    value_low = values[np.searchsorted(cumulative, low, side='right')]
+    value_high = values[np.searchsorted(cumulative, min(low + 1, cumulative[-1] - 1), side='right')]
+    return value_low + (value_high - value_low) * (position - low)
+
+
+def box_stats(cells, by, value, extent=BOXPLOT_EXTENT):
+    '''
+    Box plot statistics of value per combination of the by columns, rows with a missing
+    by or value left out. Returns the summary (quartiles and whiskers) with one row per
+    group and the outliers with one row per outlying row.
+    '''
+    # sorted by the groups and then the value, so every group is a run of sorted values
+    counts = rollup(cells, list(by) + [value])
+    group_ids = counts.groupby(list(by), sort=False, observed=True).ngroup().to_numpy()
+    starts = np.flatnonzero(np.diff(group_ids, prepend=-1))
+    summaries, outliers = [], []
+    for start, end in zip(starts, list(starts[1:]) + [len(counts)]):
+        group = counts.iloc[start:end]
+        values = group[value].to_numpy(dtype=np.float64)
+        frequencies = group['counts'].to_numpy()
+        cumulative = np.cumsum(frequencies)
+        lower_box, mid_box, upper_box = (sorted_quantile(values, cumulative, q) for q in (0.25, 0.5, 0.75))
+        iqr = upper_box - lower_box
+        inside = (values >= lower_box - extent * iqr) & (values <= upper_box + extent * iqr)
+        row = group.iloc[0][list(by)].to_dict()
+        summaries.append(dict(
+            row, lower_whisker=values[inside].min(), lower_box=lower_box, mid_box=mid_box,
+            upper_box=upper_box, upper_whisker=values[inside].max(), count=cumulative[-1],
+        ))
+        outlying = pd.DataFrame({value: np.repeat(values[~inside], frequencies[~inside])})
+        outliers.append(outlying.assign(**row))
+    columns = list(by) + ['lower_whisker', 'lower_box', 'mid_box', 'upper_box', 'upper_whisker', 'count']
+    summary = pd.DataFrame(summaries, columns=columns)
+    outliers = pd.concat(outliers, ignore_index=True) if outliers else pd.DataFrame(columns=list(by) + [value])
+    for col in by:
+        # back to the dtype of the cells so the encodings infer the same types
+        summary[col] = summary[col].astype(counts[col].dtype)
+        outliers[col] = outliers[col].astype(counts[col].dtype)
+    return summary, outliers[list(by) + [value]]
+
+
+def chart_box_stats(name, cells):
+    # summary and outlier rows of box plot chart name in one table, the layers of the
+    # chart skip the rows without their fields
+    _, by, value = BOX_CHARTS[name]
+    summary, outliers = box_stats(cells, by, value)
+    return pd.concat([summary, outliers], ignore_index=True)
+
+
+def count_chart(data, name, y):
+    # bar chart with the encodings of chart name, for measuring the payload
+    _, by, _ = COUNT_CHARTS[name]
+    encodings = dict(zip(['x', 'color', 'column'], by), y=y)
+    encodings['x'] = '{}:N'.format(encodings['x'])
+    return alt.Chart(data).mark_bar().encode(**encodings)
+
+
+def payload_bytes(chart):
+    # size of the spec (with the inlined data) the browser receives
+    return len(chart_json(chart).encode())
+
+
+def measure_payloads(year_range=DEFAULT_YEAR_RANGE, times_of_day=tuple(DEFAULT_TIMES_OF_DAY), path=ARTIFACT_PATH):
+    '''
+    Rows and bytes of every count() chart when it is given the filtered rows (the
+    columns of its cuboid) and when it is given the counts.
+    '''
+    cube = load_cube(path)
+    rows = load_columns(None, path)[0]
+    selection = (
+        (rows['INCIDENT_YEAR'].dt.year >= year_range[0]) & (rows['INCIDENT_YEAR'].dt.year <= year_range[1])
+        & rows['TIME_OF_DAY'].isin(times_of_day)
+    )
+    report = {}
+    for name, (cuboid, by, complete) in COUNT_CHARTS.items():
+        group_columns, sum_columns = AGGREGATE_SPECS[cuboid]
+        before = rows.loc[selection, group_columns + sum_columns].reset_index(drop=True)
+        cells = select_cells(cube[cuboid], year_range, list(times_of_day))
+        if name in TOP_AIRPORT_CHARTS:
+            # the rows the application used to give these charts
+            levels = TOP_AIRPORT_CHARTS[name]
+            if levels is not None:
+                before = before[before['DAMAGE_LEVEL'].isin(levels)]
+            top = [i[0] for i in Counter(before[before.AIRPORT != 'UNKNOWN'].AIRPORT.to_list()).most_common(100)]
+            before = before[before['AIRPORT'].isin(top)]
+            airports = top_k(load_ranking_indexes(path)['AIRPORT'], year_range, list(times_of_day), levels)
+            cells = top_airport_cells(cells, airports, levels)
+        if complete:
+            before = before.dropna(subset=complete)
+        after = chart_counts(name, cells)
+        report[name] = {
+            'rows_before': len(before),
+            'bytes_before': payload_bytes(count_chart(before, name, 'count()')),
+            'rows_after': len(after),
+            'bytes_after': payload_bytes(count_chart(after, name, COUNT_Y)),
+        }
+    report = pd.DataFrame(report).T
+    report['reduction'] = (report['bytes_before'] / report['bytes_after']).round(1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Payload of the count() charts with rows and with counts.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH)
+    parser.add_argument('--years', type=int, nargs=2, default=list(DEFAULT_YEAR_RANGE))
+    parser.add_argument('--time-of-day', nargs='*', default=DEFAULT_TIMES_OF_DAY)
+    args = parser.parse_args()
+    print(measure_payloads(tuple(args.years), args.time_of_day, args.artifact).to_string())
+
+
+if __name__ == '__main__':
+    main()
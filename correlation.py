@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregates import CUBE_KEYS, select_cells
+from data_loader import ARTIFACT_PATH, load_columns, load_derived, read_artifact_schema, read_stored, write_stored
+from utilities import BOOLEAN_COLUMNS
+
+
+# Pearson correlation of the flag columns from sufficient statistics. For every
+# INCIDENT_YEAR x TIME_OF_DAY cell and every pair of columns (x, y) it keeps, over the
+# rows where both are present, the row count, the sum and the sum of squares of x and
+# the sum of x * y. These are sums, so any set of cells is combined by adding them up.
+
+
+def cell_statistics(values, present):
+    # values with 0 where missing, present the 0/1 mask, both rows x columns
+    return {
+        'counts': present.T @ present,
+        'sums': values.T @ present,
+        'squares': (values * values).T @ present,
+        'products': values.T @ values,
+    }
+
+
+def cell_ids(keys):
+    # position of the CUBE_KEYS cell of every row among the sorted cells
+    # grouped on the codes, groupby ignores dropna=False for categorical keys
+    codes = [keys[col].cat.codes if isinstance(keys[col].dtype, pd.CategoricalDtype) else keys[col] for col in CUBE_KEYS]
+    return pd.DataFrame(dict(zip(CUBE_KEYS, codes))).groupby(CUBE_KEYS, dropna=False, sort=True).ngroup().to_numpy()
+
+
+def correlation_statistics(df, columns):
+    '''
+    Statistics of every observed cell of CUBE_KEYS. Returns the cells (CUBE_KEYS columns,
+    the year as an int) and a dict of arrays shaped cells x columns x columns.
+    '''
+    years = df['INCIDENT_YEAR'].dt.year if pd.api.types.is_datetime64_any_dtype(df['INCIDENT_YEAR']) else df['INCIDENT_YEAR']
+    keys = pd.DataFrame({'INCIDENT_YEAR': years, 'TIME_OF_DAY': df['TIME_OF_DAY']})
+    ids = cell_ids(keys)
+    order = np.argsort(ids, kind='stable')
+    starts = np.flatnonzero(np.diff(ids[order], prepend=-1))
+
+    values = np.column_stack([df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in columns])
+    present = ~np.isnan(values)
+    values = np.where(present, values, 0.0)
+    present = present.astype(np.float64)
+
+    statistics = {name: [] for name in ('counts', 'sums', 'squares', 'products')}
+    for start, end in zip(starts, list(starts[1:]) + [len(order)]):
+        rows = order[start:end]
+        for name, matrix in cell_statistics(values[rows], present[rows]).items():
+            statistics[name].append(matrix)
+    cells = keys.iloc[order[starts]].reset_index(drop=True)
+    shape = (0, len(columns), len(columns))
+    return cells, {name: np.stack(matrices) if matrices else np.zeros(shape) for name, matrices in statistics.items()}
+
+
+def sum_cells(cells, statistics):
+    '''
+    The statistics of the rows of cells which are the same cell added up, in the order
+    of correlation_statistics. Puts together the statistics of several sets of rows.
+    '''
+    ids = cell_ids(cells)
+    first = np.unique(ids, return_index=True)[1]
+    summed = {}
+    for name, matrices in statistics.items():
+        summed[name] = np.zeros((len(first),) + matrices.shape[1:])
+        np.add.at(summed[name], ids, matrices)
+    return cells.iloc[first].reset_index(drop=True), summed
+
+
+def replace_statistics_years(engine, recomputed, years, dtype):
+    '''
+    The statistics of engine with the cells of the given years swapped for the ones of
+    recomputed (statistics of the same columns), TIME_OF_DAY of the cells cast to dtype.
+    '''
+    kept = ~engine['cells']['INCIDENT_YEAR'].isin(years).to_numpy()
+    cells = pd.concat([
+        engine['cells'][kept].astype({'TIME_OF_DAY': dtype}), recomputed['cells'].astype({'TIME_OF_DAY': dtype})
+    ], ignore_index=True)
+    statistics = {
+        name: np.concatenate([matrices[kept], recomputed['statistics'][name]])
+        for name, matrices in engine['statistics'].items()
+    }
+    cells, statistics = sum_cells(cells, statistics)
+    return {'columns': engine['columns'], 'cells': cells, 'statistics': statistics}
+
+
+def combine_statistics(statistics, positions):
+    return {name: matrices[positions].sum(axis=0) for name, matrices in statistics.items()}
+
+
+def pearson_from_statistics(combined):
+    # pairwise complete Pearson correlation, NaN where a column does not vary
+    n = combined['counts']
+    sums = combined['sums']
+    covariance = n * combined['products'] - sums * sums.T
+    variance = n * combined['squares'] - sums ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        divisor = np.sqrt(variance * variance.T)
+        return np.where(divisor > 0, covariance / divisor, np.nan)
+
+
+def correlation_columns(path=ARTIFACT_PATH):
+    # the numeric flag columns of the artifact (WARNED is a Yes/No category)
+    schema = read_artifact_schema(path)
+    return [
+        col for col in BOOLEAN_COLUMNS
+        if col in schema.names and (pa.types.is_integer(schema.field(col).type) or pa.types.is_floating(schema.field(col).type))
+    ]
+
+
+def frame_correlation_columns(df):
+    # the numeric flag columns of a frame, the same as correlation_columns of its artifact
+    return [col for col in BOOLEAN_COLUMNS if col in df.columns and df[col].dtype.kind in 'iuf']
+
+
+def compute_correlation_statistics(path=ARTIFACT_PATH):
+    columns = correlation_columns(path)
+    df, _ = load_columns(CUBE_KEYS + columns, path)
+    cells, statistics = correlation_statistics(df, columns)
+    return {'columns': columns, 'cells': cells, 'statistics': statistics}
+
+
+def write_correlation_statistics(engine, path=ARTIFACT_PATH):
+    # the cells and one fixed size list (the flattened matrix) per cell and statistic
+    size = len(engine['columns']) ** 2
+    table = pa.Table.from_pandas(engine['cells'], preserve_index=False)
+    for name, matrices in engine['statistics'].items():
+        flat = pa.array(np.ascontiguousarray(matrices, dtype=np.float64).reshape(-1))
+        table = table.append_column(name, pa.FixedSizeListArray.from_arrays(flat, size))
+    return write_stored(table, 'correlation', path, {'columns': engine['columns']})
+
+
+def read_correlation_statistics(path=ARTIFACT_PATH):
+    # the statistics etl.py stored for the current version of the artifact, None when there are none
+    stored = read_stored('correlation', path)
+    if stored is None:
+        return None
+    table, metadata = stored
+    columns = metadata['columns']
+    statistics = {
+        name: table.column(name).combine_chunks().flatten().to_numpy().reshape(-1, len(columns), len(columns))
+        for name in ('counts', 'sums', 'squares', 'products')
+    }
+    return {'columns': columns, 'cells': table.select(CUBE_KEYS).to_pandas(), 'statistics': statistics}
+
+
+def build_correlation_statistics(path=ARTIFACT_PATH):
+    # the stored statistics, computed from the rows of the artifact only when there are none
+    engine = read_correlation_statistics(path)
+    return compute_correlation_statistics(path) if engine is None else engine
+
+
+def load_correlation_statistics(path=ARTIFACT_PATH):
+    # read once per artifact version and shared by every session
+    return load_derived('correlation', build_correlation_statistics, path)
+
+
+def correlation_matrix(engine, columns, year_range=None, times_of_day=None):
+    '''
+    Same as df[columns].corr() for the rows of the selected years and times of day
+    (like aggregates.select_cells), from the statistics of load_correlation_statistics.
+    '''
+    cells = select_cells(engine['cells'], year_range, times_of_day)
+    combined = combine_statistics(engine['statistics'], cells.index.to_numpy())
+    positions = [engine['columns'].index(col) for col in columns]
+    corr = pearson_from_statistics(combined)[np.ix_(positions, positions)]
+    return pd.DataFrame(corr, index=list(columns), columns=list(columns))
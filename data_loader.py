@@ -0,0 +1,433 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from schema import apply_schema
+from utilities import preprocess_text_fields, remapping_function
+
+try:
+    import fcntl
+except ImportError:
+    # windows, see host_lock
+    fcntl = None
+
+
+DATA_PATH = 'data/main_data.csv'
+# preprocessed and typed copy of DATA_PATH, uncompressed feather (arrow ipc) so it can be memory mapped
+ARTIFACT_PATH = 'data/main_data.feather'
+
+# read the columns from a copy of the artifact laid out the way pandas holds them, so
+# every process of the host maps the same pages instead of converting its own copy
+SHARED_DATASET = os.environ.get('SHARED_DATASET', '0') == '1'
+
+# columns which are not used by any of the analyses in the application
+COLUMNS_TO_REMOVE = [
+    'NR_FATALITIES', 'NR_INJURIES', 'EFFECT_OTHER',  'LOCATION',
+    'ENG_1_POS', 'ENG_2_POS', 'ENG_3_POS', 'ENG_4_POS', 'LATITUDE', 'LONGITUDE',
+]
+
+
+# the preprocessed frames are kept per source path for the lifetime of the process
+# so every streamlit session (and every rerun) shares the same frame.
+# callers must treat the returned frame as read only and derive new frames from it.
+_DATASET_CACHE = {}
+_DATASET_CACHE_LOCK = threading.Lock()
+
+# columns read from the artifact, kept per artifact path and fingerprint
+_COLUMN_CACHE = {}
+_COLUMN_CACHE_LOCK = threading.Lock()
+
+# values derived from the artifact (aggregates, summaries), kept per name and artifact
+# path and rebuilt when the artifact changes. Reentrant, a build may load other values
+_DERIVED_CACHE = {}
+_DERIVED_CACHE_LOCK = threading.RLock()
+
+
+def file_fingerprint(path, use_hash=False):
+    # mtime and size are cheap and catch a replaced export, the hash catches
+    # in place rewrites which keep the same size and mtime
+    stat = os.stat(path)
+    fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if use_hash:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        fingerprint['sha1'] = sha.hexdigest()
+    return fingerprint
+
+
+def preprocess_raw(df, unknown_policy='keep', unknown_report=None):
+    # the row wise part of the preprocessing, it can be run on any subset of the rows
+    df = preprocess_text_fields(df)
+    return remapping_function(df, unknown_policy=unknown_policy, unknown_report=unknown_report)
+
+
+def prepare_columns(df):
+    # drops the unused columns and parses the year
+    df = df[[c for c in list(df.columns) if c not in COLUMNS_TO_REMOVE]].copy()
+    df['INCIDENT_YEAR'] = pd.to_datetime(df['INCIDENT_YEAR'], format='%Y')
+    return df
+
+
+def finalize_dataset(df):
+    # sets the dtypes, has to see all the rows so the categories are the same whichever
+    # way the rows were preprocessed
+    return apply_schema(prepare_columns(df))
+
+
+def build_dataset(path=DATA_PATH):
+    # all the preprocessing which used to happen at the top of application_code.py
+    return finalize_dataset(preprocess_raw(pd.read_csv(path)))
+
+
+def load_dataset(path=DATA_PATH, use_hash=False):
+    '''
+    Returns the preprocessed dataset and a dict describing how it was obtained
+    (cache_hit, build_seconds, fingerprint). The frame is only rebuilt when the
+    fingerprint of the source file changes.
+    '''
+    key = os.path.abspath(path)
+    fingerprint = file_fingerprint(path, use_hash=use_hash)
+    with _DATASET_CACHE_LOCK:
+        entry = _DATASET_CACHE.get(key)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            load_info = dict(entry['load_info'], cache_hit=True)
+            return entry['df'], load_info
+
+        start = time.perf_counter()
+        df = build_dataset(path)
+        load_info = {
+            'source': key,
+            'cache_hit': False,
+            'build_seconds': time.perf_counter() - start,
+            'fingerprint': fingerprint,
+        }
+        _DATASET_CACHE[key] = {'df': df, 'fingerprint': fingerprint, 'load_info': load_info}
+    return df, load_info
+
+
+def clear_dataset_cache():
+    with _DATASET_CACHE_LOCK:
+        _DATASET_CACHE.clear()
+
+
+def clear_column_cache():
+    with _COLUMN_CACHE_LOCK:
+        _COLUMN_CACHE.clear()
+
+
+def artifact_metadata(metadata, source_fingerprint=None):
+    # the fingerprint of the csv the artifact was built from goes into the schema
+    # metadata so a stale artifact can be detected without reading the data, and an id
+    # of this version of the artifact which the stored aggregates refer to
+    metadata = dict(metadata or {})
+    metadata[b'source_fingerprint'] = json.dumps(source_fingerprint).encode()
+    metadata[b'artifact_id'] = uuid.uuid4().hex.encode()
+    return metadata
+
+
+def write_artifact(df, path=ARTIFACT_PATH, source_fingerprint=None):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(artifact_metadata(table.schema.metadata, source_fingerprint))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # written next to the target and renamed so readers never see a half written file
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_artifact_schema(path=ARTIFACT_PATH):
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).schema
+
+
+def artifact_source_fingerprint(path=ARTIFACT_PATH):
+    metadata = read_artifact_schema(path).metadata or {}
+    if b'source_fingerprint' not in metadata:
+        return None
+    return json.loads(metadata[b'source_fingerprint'])
+
+
+def artifact_id(path=ARTIFACT_PATH):
+    # None for an artifact written before the ids, nothing stored refers to it
+    metadata = read_artifact_schema(path).metadata or {}
+    return metadata[b'artifact_id'].decode() if b'artifact_id' in metadata else None
+
+
+def ensure_artifact(source=DATA_PATH, path=ARTIFACT_PATH, use_hash=False):
+    '''
+    Builds the artifact from the csv when it is missing or was built from a different
+    version of the csv. Without a csv an existing artifact is used as it is.
+    '''
+    if not os.path.exists(source):
+        if os.path.exists(path):
+            return path
+        raise FileNotFoundError('neither {} nor {} exist'.format(source, path))
+    fingerprint = file_fingerprint(source, use_hash=use_hash)
+    if os.path.exists(path) and artifact_source_fingerprint(path) == fingerprint:
+        return path
+    df, _ = load_dataset(source, use_hash=use_hash)
+    return write_artifact(df, path, source_fingerprint=fingerprint)
+
+
+@contextmanager
+def host_lock(lock_path):
+    '''
+    Exclusive lock of the processes of the host on lock_path, held for the body of the with
+    statement. Without fcntl (windows) nothing is locked: the copies written under it are
+    renamed into place whole, at worst two processes write the same copy.
+    '''
+    with open(lock_path, 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def shared_path(path=ARTIFACT_PATH):
+    return '{}.shared.arrow'.format(os.path.splitext(path)[0])
+
+
+# version of the layout of the shared copy, a copy of another layout is rewritten
+SHARED_LAYOUT = 2
+# suffix of the column holding the missing values of a nullable (masked) column
+MASK_SUFFIX = '.mask'
+
+
+def viewable(values):
+    # numpy bools become bit packed arrow booleans, their bytes are kept as uint8 instead
+    return pa.array(values.view(np.uint8) if values.dtype == bool else values)
+
+
+def shared_column(series):
+    '''
+    Arrow arrays pandas can view without a copy (categories as codes with -1 for the
+    missing values, NaN instead of nulls, the values and the mask of nullable columns)
+    by name, and the field metadata to rebuild the dtype.
+    '''
+    name = series.name
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        metadata = {
+            b'categories': json.dumps(series.cat.categories.tolist()).encode(),
+            b'ordered': json.dumps(bool(series.cat.ordered)).encode(),
+        }
+        return {name: pa.array(series.cat.codes.to_numpy())}, metadata
+    if pd.api.types.is_extension_array_dtype(series.dtype) and series.dtype.kind in 'iufb':
+        # nullable Int8, boolean, ...: the values with 0 for the missing ones and the mask
+        values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+        mask = series.isna().to_numpy()
+        return {name: viewable(values), name + MASK_SUFFIX: viewable(mask)}, {b'dtype': series.dtype.name.encode()}
+    values = series.to_numpy()
+    # object columns keep their nulls and are copied when read
+    return {name: pa.array(values, from_pandas=values.dtype == object)}, {}
+
+
+def write_shared(path=ARTIFACT_PATH):
+    '''
+    Writes the columns of the artifact in the layout of shared_column to shared_path(path),
+    an uncompressed arrow ipc file with a single record batch. The fingerprint of the
+    artifact goes into the schema metadata so a stale copy is detected.
+    '''
+    fingerprint = file_fingerprint(path)
+    df = feather.read_table(path, memory_map=True).to_pandas()
+    fields, arrays = [], []
+    for col in df.columns:
+        columns, metadata = shared_column(df[col])
+        for name, array in columns.items():
+            fields.append(pa.field(name, array.type, metadata=(metadata or None) if name == col else None))
+            arrays.append(array)
+    schema = pa.schema(fields, metadata={
+        b'artifact_fingerprint': json.dumps(fingerprint).encode(),
+        b'layout': json.dumps(SHARED_LAYOUT).encode(),
+    })
+    target = shared_path(path)
+    tmp_path = '{}.tmp-{}'.format(target, os.getpid())
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+    os.replace(tmp_path, target)
+    return target
+
+
+def shared_is_current(path=ARTIFACT_PATH):
+    target = shared_path(path)
+    if not os.path.exists(target):
+        return False
+    metadata = read_artifact_schema(target).metadata or {}
+    return (
+        json.loads(metadata.get(b'layout', b'null')) == SHARED_LAYOUT
+        and json.loads(metadata.get(b'artifact_fingerprint', b'null')) == file_fingerprint(path)
+    )
+
+
+def ensure_shared(path=ARTIFACT_PATH):
+    # (re)writes the shared copy when it is missing or older than the artifact, once per
+    # host: the other processes wait on the lock and then map what the first one wrote
+    if not shared_is_current(path):
+        with host_lock('{}.lock'.format(shared_path(path))):
+            if not shared_is_current(path):
+                write_shared(path)
+    return shared_path(path)
+
+
+def read_shared_columns(columns, path=ARTIFACT_PATH):
+    # the columns as series viewing the memory mapped pages of the shared copy
+    # read_all of a memory mapped file references the pages, nothing is read or allocated
+    table = pa.ipc.open_file(pa.memory_map(ensure_shared(path), 'r')).read_all()
+
+    def column_values(name):
+        chunked = table.column(name)
+        return chunked.chunk(0).to_numpy(zero_copy_only=False) if chunked.num_chunks == 1 else chunked.to_numpy()
+
+    series = {}
+    for col in columns:
+        values = column_values(col)
+        metadata = table.schema.field(col).metadata or {}
+        if b'dtype' in metadata:
+            dtype = pd.api.types.pandas_dtype(metadata[b'dtype'].decode())
+            values = dtype.construct_array_type()(
+                values.view(dtype.numpy_dtype), column_values(col + MASK_SUFFIX).view(bool), copy=False
+            )
+        elif b'categories' in metadata:
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(
+                json.loads(metadata[b'categories']), ordered=json.loads(metadata[b'ordered'])
+            ))
+        series[col] = pd.Series(values, name=col, copy=False)
+    return series
+
+
+def load_columns(columns=None, path=ARTIFACT_PATH):
+    '''
+    Returns only the requested columns (all of them when None) of the artifact and a
+    load_info dict like load_dataset. The file is memory mapped and every column is
+    converted to pandas once per artifact version, the frames for a given column
+    list are shared too. Callers must treat them as read only. With SHARED_DATASET the
+    columns are views of the shared copy (ensure_shared) instead of conversions.
+    '''
+    key = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    if columns is None:
+        columns = read_artifact_schema(path).names
+    columns = list(columns)
+
+    with _COLUMN_CACHE_LOCK:
+        entry = _COLUMN_CACHE.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = {'fingerprint': fingerprint, 'columns': {}, 'frames': {}}
+            _COLUMN_CACHE[key] = entry
+        missing = [c for c in columns if c not in entry['columns']]
+
+        start = time.perf_counter()
+        if missing and SHARED_DATASET:
+            entry['columns'].update(read_shared_columns(missing, path))
+        elif missing:
+            table = feather.read_table(path, columns=missing, memory_map=True)
+            frame = table.to_pandas()
+            for col in missing:
+                entry['columns'][col] = frame[col]
+        load_info = {
+            'source': key,
+            'cache_hit': not missing,
+            'columns_read': missing,
+            'build_seconds': time.perf_counter() - start,
+            'fingerprint': fingerprint,
+        }
+        df = entry['frames'].get(tuple(columns))
+        if df is None:
+            # without copy=False the columns of the same dtype are copied into one block
+            df = pd.DataFrame({col: entry['columns'][col] for col in columns}, copy=False)
+            entry['frames'][tuple(columns)] = df
+    return df, load_info
+
+
+def load_rows(positions, columns=None, path=ARTIFACT_PATH):
+    '''
+    The rows at the given positions of the artifact, indexed by their positions like the
+    frames of load_columns. Only these rows are converted to pandas, the rest of the
+    memory mapped file is not read.
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.take(positions).to_pandas().set_index(pd.Index(positions))
+    # read_table gives the columns in the order of the file
+    return df if columns is None else df[list(columns)]
+
+
+def sample_rows(n, columns=None, path=ARTIFACT_PATH, seed=None):
+    # n random rows (all of them when there are fewer) like df.sample(n) on the whole artifact
+    num_rows = feather.read_table(path, columns=[], memory_map=True).num_rows
+    positions = np.random.default_rng(seed).choice(num_rows, size=min(n, num_rows), replace=False)
+    return load_rows(positions, columns, path)
+
+
+# Tables derived from the artifact (aggregates, summaries) which etl.py writes next to it,
+# so the app processes read them instead of computing them from the rows. Every table
+# keeps the id of the artifact it was computed from, the table of another version of the
+# artifact is stale.
+
+def aggregates_dir(path=ARTIFACT_PATH):
+    return os.path.join(os.path.dirname(path) or '.', 'aggregates')
+
+
+def stored_path(name, path=ARTIFACT_PATH):
+    return os.path.join(aggregates_dir(path), '{}.feather'.format(name))
+
+
+def write_stored(table, name, path=ARTIFACT_PATH, metadata=None):
+    '''
+    Writes table (a frame or an arrow table) as name next to the artifact at path, with
+    the id of the artifact and the given metadata (str -> json value) in its schema.
+    '''
+    if isinstance(table, pd.DataFrame):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[b'artifact_id'] = json.dumps(artifact_id(path)).encode()
+    for key, value in (metadata or {}).items():
+        schema_metadata[key.encode()] = json.dumps(value).encode()
+    target = stored_path(name, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = '{}.tmp-{}'.format(target, os.getpid())
+    feather.write_feather(table.replace_schema_metadata(schema_metadata), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, target)
+    return target
+
+
+def read_stored(name, path=ARTIFACT_PATH):
+    '''
+    The arrow table stored as name for the current version of the artifact at path and its
+    metadata (str -> json value), None when it is missing or was computed from another version.
+    '''
+    target = stored_path(name, path)
+    if not os.path.exists(target):
+        return None
+    table = feather.read_table(target, memory_map=True)
+    metadata = {key.decode(): value for key, value in (table.schema.metadata or {}).items() if key != b'pandas'}
+    metadata = {key: json.loads(value) for key, value in metadata.items()}
+    current = artifact_id(path)
+    if current is None or metadata.get('artifact_id') != current:
+        return None
+    return table, metadata
+
+
+def load_derived(name, build, path=ARTIFACT_PATH):
+    '''
+    Returns build(path), computed once per version of the artifact and shared by every
+    session. Callers must treat the result as read only.
+    '''
+    key = (name, os.path.abspath(path))
+    fingerprint = file_fingerprint(path)
+    with _DERIVED_CACHE_LOCK:
+        entry = _DERIVED_CACHE.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = {'fingerprint': fingerprint, 'value': build(path)}
+            _DERIVED_CACHE[key] = entry
+    return entry['value']
@@ -0,0 +1,24 @@
+# Filters and selections the application starts from. The warm-up prepares the first
+# view with them and the benchmarks and comparisons run on them, so they are only
+# defined here.
+
+DEFAULT_YEAR_RANGE = (2000, 2010)
+TIMES_OF_DAY = ['Day', 'Night', 'Dusk', 'Dawn']
+DEFAULT_TIMES_OF_DAY = list(TIMES_OF_DAY)
+
+# columns of the speed and height jointplots
+SPEED_COLUMNS = ['SPEED', 'HEIGHT', 'DAMAGE_LEVEL', 'WARNED']
+
+# flag columns the correlation heatmap can show, and those selected at first
+CORRELATION_OPTIONS = [
+    'DAM_ENG1', 'DAM_ENG2', 'DAM_ENG3', 'DAM_ENG4', 'DAM_FUSE', 'DAM_LG', 'DAM_LGHTS',
+    'DAM_NOSE', 'DAM_OTHER', 'DAM_PROP', 'DAM_RAD', 'DAM_TAIL', 'DAM_WINDSHLD', 'DAM_WING_ROT',
+    'STR_ENG1', 'STR_ENG2', 'STR_ENG3', 'STR_ENG4', 'STR_FUSE', 'STR_LG', 'STR_LGHTS', 'STR_NOSE',
+    'STR_OTHER', 'STR_PROP', 'STR_RAD', 'STR_TAIL', 'STR_WINDSHLD', 'STR_WING_ROT',
+]
+DEFAULT_CORRELATION_COLUMNS = [
+    'DAM_ENG1', 'DAM_ENG2', 'DAM_FUSE', 'DAM_LG', 'DAM_LGHTS',
+    'DAM_NOSE', 'DAM_PROP', 'DAM_RAD', 'DAM_TAIL', 'DAM_WINDSHLD',
+    'STR_ENG1', 'STR_ENG2', 'STR_FUSE', 'STR_LG', 'STR_LGHTS', 'STR_NOSE',
+    'STR_PROP', 'STR_RAD', 'STR_TAIL', 'STR_WINDSHLD',
+]
@@ -0,0 +1,489 @@
+'''
+Builds everything the dashboard reads from the raw FAA export, to be run at deploy time:
+
+    python etl.py --source data/main_data.csv --workers 4
+
+Writes the typed artifact (data/main_data.feather), the precomputed aggregates
+(data/aggregates/*.feather), a hash per record (data/record_hashes.feather) and a
+validation report (data/validation_report.json, with the memory of every column before
+and after the schema).
+
+With --incremental only the records of a new export which are new or changed (by
+INDX_NR and record hash) are preprocessed and merged into the stored artifacts.
+
+With --chunksize the export is streamed in chunks of that many rows, so the peak
+memory depends on the chunk size and not on the size of the export.
+
+With --shared the copy of the artifact the app processes map with SHARED_DATASET=1
+(data/main_data.shared.arrow) is written too, otherwise the first process writes it.
+'''
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from aggregates import (
+    AGGREGATE_SPECS, CELL_AGGREGATIONS, compute_aggregates, read_cube, replace_years, sort_aggregate, write_cube,
+)
+from correlation import (
+    correlation_statistics, frame_correlation_columns, read_correlation_statistics, replace_statistics_years,
+    sum_cells, write_correlation_statistics,
+)
+from data_loader import (
+    ARTIFACT_PATH, DATA_PATH, artifact_metadata, file_fingerprint, finalize_dataset, prepare_columns,
+    preprocess_raw, write_artifact, write_shared,
+)
+from missingness import add_statistics, missingness_statistics, write_missingness
+from schema import SCHEMA, apply_schema, cast_columns, collect_stats, memory_report, merge_stats, resolve_dtypes
+from utilities import REMAPPING_REGISTRY, TEXT_FIELDS_TO_STRIP
+
+
+DEFAULT_CHUNKSIZE = 50000
+
+
+def default_output_paths(artifact=ARTIFACT_PATH):
+    # the aggregates go to data_loader.aggregates_dir(artifact)
+    output_dir = os.path.dirname(artifact) or '.'
+    return {
+        'record_hashes': os.path.join(output_dir, 'record_hashes.feather'),
+        'report': os.path.join(output_dir, 'validation_report.json'),
+    }
+
+
+def process_partition(partition):
+    # runs in a worker process on the rows of one INCIDENT_YEAR
+    unknown_report = {}
+    df = preprocess_raw(partition, unknown_report=unknown_report)
+    return df, unknown_report
+
+
+def preprocess_partitions(raw, workers=None):
+    # one task per year, the rows are put back in file order afterwards
+    workers = workers or os.cpu_count() or 1
+    groups = list(raw.groupby('INCIDENT_YEAR', dropna=False, sort=True))
+    if workers == 1 or len(groups) <= 1:
+        results = [process_partition(partition) for _, partition in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_partition, [partition for _, partition in groups]))
+    df = pd.concat([result[0] for result in results]).sort_index()
+    partitions = [(year, len(partition)) for year, partition in groups]
+    return df, partitions, merge_unknown_reports([result[1] for result in results])
+
+
+def export_record_hashes(source, keys):
+    # hash of the raw text of every record, independent of the dtypes pandas infers for
+    # a particular export, so the same record always gets the same hash
+    text = pd.read_csv(source, dtype=str, keep_default_na=False)
+    return pd.DataFrame({
+        'INDX_NR': keys,
+        'ROW_HASH': pd.util.hash_pandas_object(text, index=False).to_numpy(),
+    })
+
+
+def merge_unknown_reports(reports):
+    merged = {}
+    for report in reports:
+        for col, counts in report.items():
+            for label, count in counts.items():
+                merged.setdefault(col, {})
+                merged[col][label] = merged[col].get(label, 0) + count
+    return merged
+
+
+def validation_report(raw, df, partitions, unknown_labels, timings, memory=None):
+    # memory is a schema.memory_report of the frame before and after the schema was applied
+    null_rates = df.isna().mean().round(6)
+    report = {
+        'rows_raw': int(len(raw)),
+        'rows_output': int(len(df)),
+        'rows_per_partition': {str(year): int(rows) for year, rows in partitions},
+        'duplicate_indx_nr': int(raw['INDX_NR'].duplicated().sum()) if 'INDX_NR' in raw else None,
+        'schema_columns_missing': sorted(c for c in SCHEMA if c not in raw.columns),
+        'unknown_columns': sorted(c for c in raw.columns if c not in SCHEMA),
+        'unknown_labels': unknown_labels,
+        'null_rates': {col: float(rate) for col, rate in null_rates.items()},
+        'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
+        'timings_seconds': timings,
+    }
+    if memory is not None:
+        report['memory_bytes'] = memory.to_dict(orient='index')
+    return report
+
+
+def compute_correlation(df):
+    # correlation.compute_correlation_statistics of the rows in memory
+    columns = frame_correlation_columns(df)
+    cells, statistics = correlation_statistics(df, columns)
+    return {'columns': columns, 'cells': cells, 'statistics': statistics}
+
+
+def write_derived(df, artifact):
+    # the aggregates and summaries the application reads, df are the rows of the artifact
+    write_cube(compute_aggregates(df), artifact)
+    write_correlation_statistics(compute_correlation(df), artifact)
+    write_missingness(missingness_statistics(df), artifact)
+
+
+def write_report(report, report_path):
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, default=lambda x: x.item() if isinstance(x, np.generic) else str(x))
+
+
+def run_etl(source=DATA_PATH, artifact=ARTIFACT_PATH, workers=None):
+    paths = default_output_paths(artifact)
+    timings = {}
+
+    start = time.perf_counter()
+    fingerprint = file_fingerprint(source)
+    raw = pd.read_csv(source)
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df, partitions, unknown_labels = preprocess_partitions(raw, workers)
+    timings['preprocess'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # finalize_dataset in two steps, to report the memory the schema saves
+    prepared = prepare_columns(df)
+    df = apply_schema(prepared)
+    memory = memory_report(prepared, df)
+    del prepared
+    write_artifact(df, artifact, source_fingerprint=fingerprint)
+    timings['write_artifact'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_derived(df, artifact)
+    timings['aggregates'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    feather.write_feather(export_record_hashes(source, raw['INDX_NR'].to_numpy()), paths['record_hashes'])
+    timings['record_hashes'] = time.perf_counter() - start
+
+    report = validation_report(raw, df, partitions, unknown_labels, timings, memory)
+    write_report(report, paths['report'])
+    return report
+
+
+def run_incremental(source=DATA_PATH, artifact=ARTIFACT_PATH, workers=None):
+    '''
+    Merges a new export into the stored artifacts. Records are matched on INDX_NR, the
+    new ones and the ones whose hash changed are preprocessed and replace/extend the
+    stored rows, and only the aggregates of the years they touch are recomputed.
+    Falls back to a full run when there is nothing stored yet.
+    '''
+    paths = default_output_paths(artifact)
+    if not all(os.path.exists(p) for p in [artifact, paths['record_hashes']]):
+        report = run_etl(source, artifact, workers)
+        report['ingest'] = {'mode': 'full', 'inserted': report['rows_output'], 'updated': 0, 'unchanged': 0}
+        write_report(report, paths['report'])
+        return report
+    timings = {}
+
+    start = time.perf_counter()
+    fingerprint = file_fingerprint(source)
+    raw = pd.read_csv(source)
+    if raw['INDX_NR'].duplicated().any():
+        raise ValueError('INDX_NR is not unique in {}, records can not be matched'.format(source))
+    keys = raw['INDX_NR'].to_numpy()
+    hashes = export_record_hashes(source, keys)
+    stored_hashes = feather.read_feather(paths['record_hashes'])
+    timings['read'] = time.perf_counter() - start
+
+    # position of every record of the export in the stored hashes, -1 for new records
+    start = time.perf_counter()
+    stored_positions = pd.Index(stored_hashes['INDX_NR']).get_indexer(keys)
+    is_new = stored_positions < 0
+    stored_row_hash = stored_hashes['ROW_HASH'].to_numpy()[np.where(is_new, 0, stored_positions)]
+    is_changed = ~is_new & (stored_row_hash != hashes['ROW_HASH'].to_numpy())
+    timings['diff'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stored = feather.read_feather(artifact)
+    # the aggregates of the stored artifact, None when they are missing or stale
+    stored_cube, stored_correlation = read_cube(artifact), read_correlation_statistics(artifact)
+    to_process = raw[is_new | is_changed]
+    if len(to_process):
+        processed, partitions, unknown_labels = preprocess_partitions(to_process, workers)
+        processed = finalize_dataset(processed).reset_index(drop=True)
+    else:
+        processed, partitions, unknown_labels = stored.iloc[:0], [], {}
+    timings['preprocess'] = time.perf_counter() - start
+
+    # changed records take the place of their stored version, new ones are appended
+    start = time.perf_counter()
+    processed_is_new = is_new[is_new | is_changed]
+    artifact_positions = pd.Index(stored['INDX_NR']).get_indexer(processed['INDX_NR'])
+    order = np.arange(len(stored))
+    order[artifact_positions[~processed_is_new]] = len(stored) + np.flatnonzero(~processed_is_new)
+    order = np.concatenate([order, len(stored) + np.flatnonzero(processed_is_new)])
+    df = apply_schema(pd.concat([stored, processed], ignore_index=True).take(order).reset_index(drop=True))
+    write_artifact(df, artifact, source_fingerprint=fingerprint)
+    timings['write_artifact'] = time.perf_counter() - start
+
+    # years of the new rows and the years the changed rows had before
+    start = time.perf_counter()
+    years = pd.concat([
+        processed['INCIDENT_YEAR'], stored['INCIDENT_YEAR'].take(artifact_positions[~processed_is_new])
+    ]).dt.year.unique()
+    recomputed_rows = df[df['INCIDENT_YEAR'].dt.year.isin(years)]
+    recomputed_correlation = compute_correlation(recomputed_rows)
+    if stored_cube is None or stored_correlation is None or stored_correlation['columns'] != recomputed_correlation['columns']:
+        write_derived(df, artifact)
+    else:
+        write_cube(replace_years(stored_cube, compute_aggregates(recomputed_rows), years), artifact)
+        write_correlation_statistics(replace_statistics_years(
+            stored_correlation, recomputed_correlation, years, df['TIME_OF_DAY'].dtype
+        ), artifact)
+        # the rows missing two columns together are not kept per year
+        write_missingness(missingness_statistics(df), artifact)
+    timings['aggregates'] = time.perf_counter() - start
+
+    stored_hashes = stored_hashes.set_index('INDX_NR')['ROW_HASH']
+    stored_hashes = pd.concat([
+        stored_hashes[~stored_hashes.index.isin(keys)], hashes.set_index('INDX_NR')['ROW_HASH']
+    ])
+    feather.write_feather(stored_hashes.rename_axis('INDX_NR').reset_index(), paths['record_hashes'])
+
+    report = validation_report(raw, df, partitions, unknown_labels, timings)
+    report['ingest'] = {
+        'mode': 'incremental',
+        'inserted': int(is_new.sum()),
+        'updated': int(is_changed.sum()),
+        'unchanged': int((~is_new & ~is_changed).sum()),
+        'not_in_export': int(len(stored) - (~is_new).sum()),
+        'years_recomputed': sorted(int(year) for year in years if year == year),
+    }
+    write_report(report, paths['report'])
+    return report
+
+
+# streaming mode, three generator driven passes over the data:
+#   1) scan the csv in chunks to fix the dtype of every column for all the chunks
+#   2) preprocess every chunk, stage it on disk (plain arrow types) and collect the column
+#      statistics, aggregates and record hashes
+#   3) read the staged chunks back one at a time, cast them to the dtypes decided from the
+#      statistics of all the rows and write them to the artifact
+
+def combine_read_dtypes(first, second):
+    # the dtype pandas would infer for both sets of rows read together
+    if first == second:
+        return first
+    if first.kind in 'iuf' and second.kind in 'iuf':
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def scan_csv_dtypes(source, chunksize):
+    dtypes = None
+    for chunk in pd.read_csv(source, chunksize=chunksize):
+        chunk_dtypes = chunk.dtypes.to_dict()
+        if dtypes is None:
+            dtypes = chunk_dtypes
+        else:
+            dtypes = {col: combine_read_dtypes(dtypes[col], chunk_dtypes[col]) for col in dtypes}
+    return dtypes
+
+
+def read_chunks(source, chunksize, dtypes):
+    yield from pd.read_csv(source, chunksize=chunksize, dtype=dtypes)
+
+
+def preprocess_chunks(chunks, unknown_reports):
+    for chunk in chunks:
+        unknown_report = {}
+        yield prepare_columns(preprocess_raw(chunk, unknown_report=unknown_report))
+        unknown_reports.append(unknown_report)
+
+
+def staging_schema(read_dtypes, columns):
+    # arrow type of every prepared column which does not depend on the values of a chunk
+    fields = []
+    for col in columns:
+        if col == 'INCIDENT_YEAR':
+            fields.append(pa.field(col, pa.timestamp('ns')))
+        elif col in TEXT_FIELDS_TO_STRIP or col in REMAPPING_REGISTRY or read_dtypes[col] == object:
+            fields.append(pa.field(col, pa.string()))
+        else:
+            fields.append(pa.field(col, pa.from_numpy_dtype(read_dtypes[col])))
+    return pa.schema(fields)
+
+
+def to_staging_batch(df, schema):
+    arrays = []
+    for field in schema:
+        series = df[field.name]
+        if pa.types.is_string(field.type) and isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        arrays.append(pa.array(series.to_numpy(), type=field.type, from_pandas=True))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def add_chunk_aggregates(totals, chunk_aggregates):
+    # counts and sums of the chunks are added up per group
+    for name, (group_columns, _) in AGGREGATE_SPECS.items():
+        aggregate = chunk_aggregates[name]
+        for col in group_columns:
+            if isinstance(aggregate[col].dtype, pd.CategoricalDtype):
+                aggregate[col] = aggregate[col].astype(object)
+        if name in totals:
+            aggregate = pd.concat([totals[name], aggregate], ignore_index=True)
+        aggregations = {col: CELL_AGGREGATIONS.get(col, 'sum') for col in aggregate.columns if col not in group_columns}
+        totals[name] = aggregate.groupby(group_columns, dropna=False, sort=False).agg(aggregations).reset_index()
+    return totals
+
+
+def add_chunk_correlation(total, chunk):
+    # the statistics of the cells of the chunks are added up, TIME_OF_DAY is not typed yet
+    if total is not None:
+        cells = pd.concat([total['cells'], chunk['cells']], ignore_index=True)
+        statistics = {name: np.concatenate([total['statistics'][name], chunk['statistics'][name]]) for name in total['statistics']}
+        chunk = dict(chunk, cells=cells, statistics=statistics)
+    cells, statistics = sum_cells(chunk['cells'].astype({'TIME_OF_DAY': object}), chunk['statistics'])
+    return dict(chunk, cells=cells, statistics=statistics)
+
+
+def finish_correlation(total, dtypes):
+    # in the order of the cells of the typed artifact
+    cells, statistics = sum_cells(total['cells'].astype({'TIME_OF_DAY': dtypes['TIME_OF_DAY']}), total['statistics'])
+    return dict(total, cells=cells, statistics=statistics)
+
+
+def finish_aggregates(totals, dtypes):
+    finished = {}
+    for name, (group_columns, _) in AGGREGATE_SPECS.items():
+        aggregate = totals[name]
+        for col in group_columns:
+            if col != 'INCIDENT_YEAR':
+                aggregate[col] = aggregate[col].astype(dtypes[col])
+        finished[name] = sort_aggregate(aggregate, group_columns)
+    return finished
+
+
+def run_streaming(source=DATA_PATH, artifact=ARTIFACT_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    '''
+    Same outputs as run_etl, but no stage holds more than one chunk of rows (plus the
+    distinct values of the categorical columns, the aggregates and the record keys).
+    '''
+    paths = default_output_paths(artifact)
+    staging_path = '{}.staging-{}'.format(artifact, os.getpid())
+    timings = {}
+
+    start = time.perf_counter()
+    fingerprint = file_fingerprint(source)
+    read_dtypes = scan_csv_dtypes(source, chunksize)
+    timings['scan'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats, totals, unknown_reports, rows_raw, keys = None, {}, [], 0, []
+    schema, writer, correlation, missingness = None, None, None, None
+    # the staged chunks go next to the artifact, write_artifact is not used here
+    os.makedirs(os.path.dirname(artifact) or '.', exist_ok=True)
+    try:
+        for df in preprocess_chunks(read_chunks(source, chunksize, read_dtypes), unknown_reports):
+            if writer is None:
+                schema = staging_schema(read_dtypes, df.columns)
+                writer = pa.ipc.new_file(staging_path, schema)
+            writer.write_batch(to_staging_batch(df, schema))
+            stats = merge_stats(stats, collect_stats(df))
+            totals = add_chunk_aggregates(totals, compute_aggregates(df))
+            correlation = add_chunk_correlation(correlation, compute_correlation(df))
+            missingness = add_statistics(missingness, missingness_statistics(df))
+            rows_raw += len(df)
+            keys.append(df['INDX_NR'].to_numpy())
+    finally:
+        if writer is not None:
+            writer.close()
+    timings['preprocess'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dtypes = resolve_dtypes(stats)
+    artifact_writer = None
+    tmp_path = '{}.tmp-{}'.format(artifact, os.getpid())
+    try:
+        with pa.memory_map(staging_path, 'r') as staged:
+            reader = pa.ipc.open_file(staged)
+            for i in range(reader.num_record_batches):
+                typed = cast_columns(reader.get_batch(i).to_pandas(), dtypes)
+                table = pa.Table.from_pandas(typed, preserve_index=False)
+                if artifact_writer is None:
+                    final_schema = table.schema.with_metadata(artifact_metadata(table.schema.metadata, fingerprint))
+                    artifact_writer = pa.ipc.new_file(tmp_path, final_schema)
+                artifact_writer.write_table(table.replace_schema_metadata(final_schema.metadata))
+    finally:
+        if artifact_writer is not None:
+            artifact_writer.close()
+        os.remove(staging_path)
+    os.replace(tmp_path, artifact)
+    timings['write_artifact'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    aggregates = finish_aggregates(totals, dtypes)
+    write_cube(aggregates, artifact)
+    write_correlation_statistics(finish_correlation(correlation, dtypes), artifact)
+    write_missingness(missingness, artifact)
+    timings['aggregates'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    keys = np.concatenate(keys)
+    hashes = []
+    for text in pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunksize):
+        hashes.append(pd.util.hash_pandas_object(text, index=False).to_numpy())
+    feather.write_feather(pd.DataFrame({'INDX_NR': keys, 'ROW_HASH': np.concatenate(hashes)}), paths['record_hashes'])
+    timings['record_hashes'] = time.perf_counter() - start
+
+    rows_per_year = aggregates['size'].groupby('INCIDENT_YEAR', dropna=False)['counts'].sum()
+    report = {
+        'rows_raw': rows_raw,
+        'rows_output': rows_raw,
+        'rows_per_partition': {str(year): int(rows) for year, rows in rows_per_year.items()},
+        'duplicate_indx_nr': int(pd.Index(keys).duplicated().sum()),
+        'schema_columns_missing': sorted(c for c in SCHEMA if c not in read_dtypes),
+        'unknown_columns': sorted(c for c in read_dtypes if c not in SCHEMA),
+        'unknown_labels': merge_unknown_reports(unknown_reports),
+        'null_rates': {col: round(s['nulls'] / s['rows'], 6) if s['rows'] else 0.0 for col, s in stats.items()},
+        'dtypes': {col: str(dtype) for col, dtype in dtypes.items()},
+        'timings_seconds': timings,
+        'chunksize': chunksize,
+    }
+    write_report(report, paths['report'])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the data artifacts of the dashboard.')
+    parser.add_argument('--source', default=DATA_PATH, help='raw FAA export (csv)')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH, help='typed dataset to write (feather)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the cpu count')
+    parser.add_argument('--incremental', action='store_true', help='only process new and changed records')
+    parser.add_argument('--chunksize', type=int, default=None, help='stream the export in chunks of this many rows')
+    parser.add_argument('--shared', action='store_true', help='also write the shared copy of the artifact')
+    args = parser.parse_args()
+
+    if args.incremental:
+        report = run_incremental(args.source, args.artifact, args.workers)
+        print('inserted : {inserted}, updated : {updated}, unchanged : {unchanged}'.format(**report['ingest']))
+    elif args.chunksize:
+        report = run_streaming(args.source, args.artifact, args.chunksize)
+    else:
+        report = run_etl(args.source, args.artifact, args.workers)
+    print('rows : {}, partitions : {}, unknown labels : {}'.format(
+        report['rows_output'], len(report['rows_per_partition']), report['unknown_labels']
+    ))
+    for stage, seconds in report['timings_seconds'].items():
+        print('{} : {:.2f}s'.format(stage, seconds))
+    if 'memory_bytes' in report:
+        total = report['memory_bytes']['TOTAL']
+        print('memory : {:.1f} MB -> {:.1f} MB'.format(total['bytes_before'] / 1024 ** 2, total['bytes_after'] / 1024 ** 2))
+    if args.shared:
+        print('shared copy : {}'.format(write_shared(args.artifact)))
+
+
+if __name__ == '__main__':
+    main()
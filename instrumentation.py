@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Timers and memory counters around the stages of the application (importing, loading,
+# filtering, every tab and chart). A run is a dict with the filter state of one run of the
+# script and its stage records, every record is logged as a json line and summed into
+# process wide metrics which can be written as a prometheus text file. Only the standard
+# library is imported here (pandas and state_cache where they are used), so the imports
+# of the application can be timed as a stage.
+
+# log a json line per stage, the environment variables of the same names override these
+INSTRUMENTATION_LOG = os.environ.get('INSTRUMENTATION_LOG', '1') == '1'
+# trace the allocations to get the peak memory of every stage, slows every allocation
+# down so it is off by default. Peaks are process wide, overlapping sessions add up
+TRACE_MEMORY = os.environ.get('TRACE_MEMORY', '0') == '1'
+# the metrics are written here after every run of the script when set
+METRICS_PATH = os.environ.get('METRICS_PATH')
+# show the stages of the run in the sidebar, also with ?debug=1 in the url
+DEBUG_PANEL = os.environ.get('DEBUG_PANEL', '0') == '1'
+
+# selections kept as labels of the metrics, the year range and times of day have too
+# many values for labels and only go to the log lines
+METRIC_LABELS = ('analysis', 'jointplot')
+
+# (stage, labels) -> counters, shared by every session of the process
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+# open stages of the current thread, to give the peaks of nested stages to their parents
+_OPEN_STAGES = threading.local()
+
+if TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def new_run(state=()):
+    # state is a state_cache.filter_state, the later stages can be given another one
+    return {'state': state, 'start': time.perf_counter(), 'stages': []}
+
+
+def open_stages():
+    if not hasattr(_OPEN_STAGES, 'stack'):
+        _OPEN_STAGES.stack = []
+    return _OPEN_STAGES.stack
+
+
+def start_peak():
+    # the peak so far goes to the stage which is open, the stage starting gets a fresh one
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    stack = open_stages()
+    if stack:
+        stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+    tracemalloc.reset_peak()
+    entry = {'start': current, 'peak': 0}
+    stack.append(entry)
+    return entry
+
+
+def stop_peak(entry):
+    # bytes allocated on top of what was in use when the stage started, at most
+    if entry is None:
+        return None
+    peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+    stack = open_stages()
+    stack.pop()
+    if stack:
+        stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+    return max(peak - entry['start'], 0)
+
+
+def instrument(run, stage, function, state=None):
+    '''
+    Returns function(), its wall time, peak memory (when TRACE_MEMORY) and the memory the
+    result holds (memory_usage(deep=True) for frames) go to run as a record of stage.
+    '''
+    from state_cache import value_bytes
+
+    entry = start_peak()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = stop_peak(entry)
+    add_record(run, stage, seconds, peak_bytes, None if result is None else value_bytes(result), state)
+    return result
+
+
+@contextmanager
+def timed_stage(run, stage, state=None):
+    '''
+    Records the body of the with statement as stage of run, like instrument, for code which
+    can not be a function (the imports of the application). There is no result to measure.
+    '''
+    entry = start_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = stop_peak(entry)
+    add_record(run, stage, seconds, peak_bytes, None, state)
+
+
+def add_record(run, stage, seconds, peak_bytes, result_bytes, state=None):
+    record = {
+        'stage': stage,
+        'seconds': seconds,
+        'peak_bytes': peak_bytes,
+        'result_bytes': result_bytes,
+        'state': run['state'] if state is None else state,
+    }
+    run['stages'].append(record)
+    add_to_metrics(record)
+    if INSTRUMENTATION_LOG:
+        print(log_line(record))
+    return record
+
+
+def state_dict(state):
+    return {key: list(value) if isinstance(value, tuple) else value for key, value in state}
+
+
+def log_line(record):
+    return json.dumps(dict(record, event='stage', state=state_dict(record['state'])), sort_keys=True, default=str)
+
+
+def metric_labels(record):
+    labels = {'stage': record['stage']}
+    labels.update({key: str(value) for key, value in record['state'] if key in METRIC_LABELS})
+    return tuple(sorted(labels.items()))
+
+
+def add_to_metrics(record):
+    key = metric_labels(record)
+    with _METRICS_LOCK:
+        metrics = _METRICS.setdefault(key, {'count': 0, 'seconds_sum': 0.0, 'seconds_max': 0.0, 'peak_bytes_max': None, 'result_bytes': None})
+        metrics['count'] += 1
+        metrics['seconds_sum'] += record['seconds']
+        metrics['seconds_max'] = max(metrics['seconds_max'], record['seconds'])
+        if record['peak_bytes'] is not None:
+            metrics['peak_bytes_max'] = max(metrics['peak_bytes_max'] or 0, record['peak_bytes'])
+        if record['result_bytes'] is not None:
+            metrics['result_bytes'] = record['result_bytes']
+
+
+def clear_metrics():
+    with _METRICS_LOCK:
+        _METRICS.clear()
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+
+# metric -> (prometheus type, help, counter of _METRICS)
+PROMETHEUS_METRICS = {
+    'dashboard_stage_seconds_sum': ('counter', 'Wall time spent in the stage.', 'seconds_sum'),
+    'dashboard_stage_runs_total': ('counter', 'Runs of the stage.', 'count'),
+    'dashboard_stage_seconds_max': ('gauge', 'Slowest run of the stage.', 'seconds_max'),
+    'dashboard_stage_peak_bytes_max': ('gauge', 'Largest peak of traced memory of the stage.', 'peak_bytes_max'),
+    'dashboard_stage_result_bytes': ('gauge', 'Memory held by the last result of the stage.', 'result_bytes'),
+}
+
+
+def prometheus_text(caches=None):
+    '''
+    The metrics in the prometheus text format, caches is a dict of name ->
+    state_cache.cache_stats whose counters are added as gauges.
+    '''
+    with _METRICS_LOCK:
+        metrics = {key: dict(value) for key, value in _METRICS.items()}
+    lines = []
+    for name, (kind, description, counter) in PROMETHEUS_METRICS.items():
+        lines += ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, kind)]
+        for labels, values in sorted(metrics.items()):
+            if values[counter] is not None:
+                lines.append('{}{{{}}} {}'.format(name, format_labels(labels), values[counter]))
+    for cache, stats in sorted((caches or {}).items()):
+        for counter, value in stats.items():
+            name = 'dashboard_cache_{}'.format(counter)
+            lines += ['# TYPE {} gauge'.format(name), '{}{{cache="{}"}} {}'.format(name, cache, value)]
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path=METRICS_PATH, caches=None):
+    # written next to the target and renamed so a scraper never reads a half written file
+    if not path:
+        return None
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '{}.tmp-{}-{}'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text(caches))
+    os.replace(tmp_path, path)
+    return path
+
+
+def finish_run(run, caches=None, path=METRICS_PATH):
+    # logs the total of the run and writes the metrics file
+    seconds = time.perf_counter() - run['start']
+    if INSTRUMENTATION_LOG:
+        print(json.dumps({'event': 'run', 'seconds': seconds, 'stages': len(run['stages']), 'state': state_dict(run['state'])}, sort_keys=True, default=str))
+    write_metrics(path, caches)
+    return seconds
+
+
+def run_table(run):
+    # the stages of the run, for the debug panel
+    import pandas as pd
+
+    table = pd.DataFrame(run['stages'], columns=['stage', 'seconds', 'peak_bytes', 'result_bytes'])
+    for col in ['peak_bytes', 'result_bytes']:
+        table[col.replace('bytes', 'mb')] = pd.to_numeric(table.pop(col)) / 1024 ** 2
+    return table
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from data_loader import ARTIFACT_PATH, load_columns, load_derived, read_stored, write_stored
+
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def null_bitmap(series):
+    # one bit per row, set where the value is missing
+    return np.packbits(series.isna().to_numpy())
+
+
+def popcount(bitmaps):
+    # set bits per bitmap (along the last axis)
+    return POPCOUNT[bitmaps].sum(axis=-1, dtype=np.int64)
+
+
+def missingness_statistics(df, year_column='INCIDENT_YEAR'):
+    '''
+    Missing values of every column of df: the rows and the null count of every column per
+    year (the rows without a year under NaN) and the number of rows where two columns are
+    both missing. Every column is reduced to a packed null bitmap first, the rest are
+    bitwise ANDs and popcounts on the bitmaps. These are counts, the statistics of two sets
+    of rows with the same columns are put together with add_statistics.
+    '''
+    columns = list(df.columns)
+    bitmaps = np.stack([null_bitmap(df[col]) for col in columns])
+    null_counts = popcount(bitmaps)
+
+    years = df[year_column].dt.year if pd.api.types.is_datetime64_any_dtype(df[year_column]) else df[year_column]
+    codes, uniques = pd.factorize(years, sort=True)
+    year_values = np.asarray(uniques, dtype=np.float64)
+    if (codes < 0).any():
+        year_values = np.append(year_values, np.nan)
+        codes = np.where(codes < 0, len(uniques), codes)
+    rows = np.bincount(codes, minlength=len(year_values)).astype(np.int64)
+    per_year = np.zeros((len(year_values), len(columns)), dtype=np.int64)
+    for code in range(len(year_values)):
+        per_year[code] = popcount(bitmaps & np.packbits(codes == code))
+
+    # only the columns with missing values can be missing together
+    joint = np.zeros((len(columns), len(columns)), dtype=np.int64)
+    with_nulls = np.flatnonzero(null_counts)
+    for position, i in enumerate(with_nulls):
+        others = with_nulls[position:]
+        joint[i, others] = popcount(bitmaps[i] & bitmaps[others])
+        joint[others, i] = joint[i, others]
+
+    return {'columns': columns, 'years': year_values, 'rows': rows, 'null_counts': per_year, 'co_missing': joint}
+
+
+def add_statistics(first, second):
+    # the statistics of the rows of first and second (missingness_statistics of the same columns)
+    if first is None:
+        return second
+    years = np.concatenate([first['years'], second['years']])
+    codes, uniques = pd.factorize(pd.Series(years), sort=True, use_na_sentinel=False)
+    rows = np.zeros(len(uniques), dtype=np.int64)
+    null_counts = np.zeros((len(uniques), len(first['columns'])), dtype=np.int64)
+    np.add.at(rows, codes, np.concatenate([first['rows'], second['rows']]))
+    np.add.at(null_counts, codes, np.concatenate([first['null_counts'], second['null_counts']]))
+    return dict(
+        first, years=np.asarray(uniques, dtype=np.float64), rows=rows, null_counts=null_counts,
+        co_missing=first['co_missing'] + second['co_missing'],
+    )
+
+
+def missingness_summary(statistics, year_column='INCIDENT_YEAR'):
+    '''
+    The missing values over all the rows from missingness_statistics: the null count and
+    rate per column, the null rate per year and the number of rows where two columns are
+    both missing.
+    '''
+    columns = statistics['columns']
+    rows = int(statistics['rows'].sum())
+    null_counts = statistics['null_counts'].sum(axis=0)
+    has_year = ~np.isnan(statistics['years'])
+    per_year = statistics['null_counts'][has_year] / statistics['rows'][has_year, None]
+    years = pd.Index(statistics['years'][has_year].astype(np.int64), name=year_column)
+    return {
+        'rows': rows,
+        'null_counts': pd.Series(null_counts, index=columns),
+        'null_rate': pd.Series(null_counts / max(rows, 1), index=columns),
+        'null_rate_per_year': pd.DataFrame(per_year, index=years, columns=columns),
+        'co_missing': pd.DataFrame(statistics['co_missing'], index=columns, columns=columns),
+    }
+
+
+def co_missing_table(summary):
+    # pairs of columns with missing values and the share of the rows missing either
+    # which miss both (jaccard index of their null bitmaps)
+    joint = summary['co_missing']
+    counts = summary['null_counts']
+    columns = list(counts[counts > 0].index)
+    table = joint.loc[columns, columns].stack().rename('both_missing').reset_index()
+    table.columns = ['column', 'column2', 'both_missing']
+    either = counts[table['column']].to_numpy() + counts[table['column2']].to_numpy() - table['both_missing'].to_numpy()
+    table['jaccard'] = table['both_missing'] / either
+    return table
+
+
+def null_rate_per_year_table(summary):
+    # long form of the null rate per year, only for the columns with missing values
+    counts = summary['null_counts']
+    per_year = summary['null_rate_per_year'][list(counts[counts > 0].index)]
+    return per_year.reset_index().melt(id_vars=per_year.index.name, var_name='column', value_name='null_rate')
+
+
+def write_missingness(statistics, path=ARTIFACT_PATH):
+    # the per year counts (one fixed size list of null counts per year) and the co-missing counts
+    size = len(statistics['columns'])
+    per_year = pa.table({
+        'INCIDENT_YEAR': pa.array(statistics['years'], from_pandas=True),
+        'rows': pa.array(statistics['rows']),
+        'null_counts': pa.FixedSizeListArray.from_arrays(pa.array(statistics['null_counts'].reshape(-1)), size),
+    })
+    metadata = {'columns': statistics['columns']}
+    write_stored(pa.table({'co_missing': pa.array(statistics['co_missing'].reshape(-1))}), 'co_missing', path, metadata)
+    return write_stored(per_year, 'missingness', path, metadata)
+
+
+def read_missingness(path=ARTIFACT_PATH):
+    # the statistics etl.py stored for the current version of the artifact, None when there are none
+    per_year, co_missing = read_stored('missingness', path), read_stored('co_missing', path)
+    if per_year is None or co_missing is None:
+        return None
+    table, metadata = per_year
+    size = len(metadata['columns'])
+    return {
+        'columns': metadata['columns'],
+        'years': table.column('INCIDENT_YEAR').to_numpy(zero_copy_only=False).astype(np.float64),
+        'rows': table.column('rows').to_numpy(),
+        'null_counts': table.column('null_counts').combine_chunks().flatten().to_numpy().reshape(-1, size),
+        'co_missing': co_missing[0].column('co_missing').to_numpy().reshape(size, size),
+    }
+
+
+def compute_missingness(path=ARTIFACT_PATH):
+    return missingness_statistics(load_columns(None, path)[0])
+
+
+def build_missingness(path=ARTIFACT_PATH):
+    # the stored statistics, computed from the rows of the artifact only when there are none
+    statistics = read_missingness(path)
+    return missingness_summary(compute_missingness(path) if statistics is None else statistics)
+
+
+def load_missingness(path=ARTIFACT_PATH):
+    # read once per artifact version and shared by every session
+    return load_derived('missingness', build_missingness, path)
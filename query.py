@@ -0,0 +1,387 @@
+'''
+Analyses written once as declarative queries and run by a backend: pandas on the memory
+mapped columns of the artifact, or DuckDB straight over a parquet copy of it, which
+pushes the filters and the columns down into the scan and runs on every core.
+
+Every analysis gives the numbers of a chart of the application. Every analysis on both
+backends, checked to give identical results and the numbers of the application, with timings:
+    python query.py
+    python query.py --years 1990 2022 --time-of-day Day Night --repeat 5
+'''
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from aggregates import cube_cells, strikes_per_year, sum_per_group
+from bitmap_index import bitmap_rows, filter_bitmap, load_bitmap_index
+from chart_data import DAMAGE_LEVEL_LINES, chart_counts, damage_level_trends, top_airport_counts, top_cost
+from data_loader import ARTIFACT_PATH, file_fingerprint, host_lock, load_columns, load_derived
+from defaults import DEFAULT_TIMES_OF_DAY, DEFAULT_YEAR_RANGE
+from ranking import load_ranking_indexes
+
+
+# A query is a dict of
+#   group_by   : columns grouped by
+#   aggregates : output column -> ('count', None) or ('sum', column), sums of a group
+#                without any value are 0 like pandas sums
+#   dropna     : the groups with a missing group_by value are left out like groupby does,
+#                otherwise they are a group of their own like vega-lite and Counter make them
+#   not_null   : rows with a missing value in any of these columns are left out
+#   exclude    : column -> values whose rows are left out
+#   order_by   : (column, descending) pairs, ties are broken by first occurrence (the
+#                first row of the group) like Counter.most_common and the rankings do
+#   limit      : number of groups kept
+# Queries without order_by give the groups in the order of the group_by columns, by
+# category code with the missing values last, like the aggregates of the application.
+# On top of it every query is filtered by the year range (inclusive) and the times of day
+# it is run with. INCIDENT_YEAR is always the year as an integer.
+def query(group_by, aggregates=None, dropna=True, not_null=(), exclude=None, order_by=(), limit=None):
+    return {
+        'group_by': list(group_by),
+        'aggregates': aggregates or {'counts': ('count', None)},
+        'dropna': dropna,
+        'not_null': list(not_null),
+        'exclude': exclude or {},
+        'order_by': list(order_by),
+        'limit': limit,
+    }
+
+
+# every analysis gives the numbers of the chart of the application it is named after
+COST_OF_REPAIRS = {'Cost_of_Repairs': ('sum', 'COST_REPAIRS')}
+PHASE_OF_FLIGHT_COLUMNS = ['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL']
+PRECIPITATION_COLUMNS = ['PRECIPITATION', 'WARNED', 'DAMAGE_LEVEL']
+ANALYSES = {
+    # chart_1
+    'strikes_per_year': query(['INCIDENT_YEAR']),
+    # chart_5, the ranking of top_k keeps the missing airport and drops UNKNOWN
+    'top_airports_by_strikes': query(
+        ['AIRPORT'], dropna=False, exclude={'AIRPORT': ['UNKNOWN']}, order_by=[('counts', True)], limit=100
+    ),
+    # chart_8_1 and chart_8_2, cost_per_entity keeps UNKNOWN and drops the missing entity
+    'top_airports_by_cost': query(['AIRPORT'], COST_OF_REPAIRS, order_by=[('Cost_of_Repairs', True)], limit=100),
+    'top_operators_by_cost': query(['OPERATOR'], COST_OF_REPAIRS, order_by=[('Cost_of_Repairs', True)], limit=100),
+    # chart_8_3
+    'cost_per_year': query(['INCIDENT_YEAR'], COST_OF_REPAIRS),
+    # chart_8, the years without strikes of a damage level have no row, the chart draws a 0
+    'damage_level_per_year': query(['INCIDENT_YEAR', 'DAMAGE_LEVEL']),
+    # chart_11, chart_12 and chart_13
+    'phase_of_flight': query(PHASE_OF_FLIGHT_COLUMNS, not_null=PHASE_OF_FLIGHT_COLUMNS),
+    'precipitation_and_warned': query(PRECIPITATION_COLUMNS, not_null=PRECIPITATION_COLUMNS),
+    'sky_and_warned': query(['SKY', 'WARNED', 'DAMAGE_LEVEL'], dropna=False, not_null=PRECIPITATION_COLUMNS),
+}
+
+# position of the row in the artifact, the first row of a group breaks the ties
+ROW_COLUMN = '__row__'
+
+BACKENDS = ('pandas', 'duckdb')
+# backend of run_query, the environment variable of the same name overrides it
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+# threads of duckdb, all the cores when None
+DUCKDB_THREADS = int(os.environ['DUCKDB_THREADS']) if os.environ.get('DUCKDB_THREADS') else None
+
+
+def query_columns(q):
+    columns = q['group_by'] + q['not_null'] + list(q['exclude'])
+    columns += [column for _, column in q['aggregates'].values() if column]
+    return list(dict.fromkeys(columns))
+
+
+def complete_columns(q):
+    # the columns whose missing rows are left out
+    return list(dict.fromkeys(q['not_null'] + (q['group_by'] if q['dropna'] else [])))
+
+
+def sort_codes(values, categories=None):
+    # the sort key of the group values, category codes (or the values) with the missing last
+    if categories is not None:
+        codes = pd.Categorical(values, categories=categories).codes.astype(np.int64)
+        return np.where(codes < 0, len(categories), codes)
+    values = pd.Series(values)
+    return values.rank(method='dense', na_option='bottom').to_numpy()
+
+
+def finish(result, q, categories):
+    # the same types and order whichever backend computed result, categories holds the
+    # categories of the categorical group_by columns
+    for col in q['group_by']:
+        if col == 'INCIDENT_YEAR':
+            result[col] = result[col].astype(np.int64)
+    for name, (function, _) in q['aggregates'].items():
+        result[name] = result[name].astype(np.int64 if function == 'count' else np.float64)
+    if q['order_by']:
+        keys = {col: result[col] for col, _ in q['order_by']}
+        keys[ROW_COLUMN] = result[ROW_COLUMN]
+        ascending = [not descending for _, descending in q['order_by']] + [True]
+    else:
+        keys = {col: sort_codes(result[col], categories.get(col)) for col in q['group_by']}
+        ascending = True
+    order = pd.DataFrame(keys).sort_values(list(keys), ascending=ascending, kind='stable').index
+    result = result.iloc[order[:q['limit']]].reset_index(drop=True)
+    for col in q['group_by']:
+        if col != 'INCIDENT_YEAR':
+            result[col] = result[col].astype(object).where(result[col].notna(), None)
+    return result[q['group_by'] + list(q['aggregates'])]
+
+
+def pandas_query(q, year_range=None, times_of_day=None, path=ARTIFACT_PATH):
+    # the year and time of day filters come from the bitmap index, only the rows they
+    # select and the columns of the query are copied
+    index = load_bitmap_index(path)
+    rows = bitmap_rows(index, filter_bitmap(index, year_range, times_of_day))
+    df = load_columns(query_columns(q), path)[0].take(rows).assign(**{ROW_COLUMN: rows})
+    if complete_columns(q):
+        df = df.dropna(subset=complete_columns(q))
+    for col, values in q['exclude'].items():
+        df = df[~df[col].isin(values)]
+    # categories are grouped by their codes, groupby drops a missing category even with dropna=False
+    categorical = [col for col in q['group_by'] if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    keys = [
+        df[col].dt.year if col == 'INCIDENT_YEAR' else df[col].cat.codes.rename(col) if col in categorical else df[col]
+        for col in q['group_by']
+    ]
+    grouped = df.groupby(keys, dropna=False, sort=False)
+    result = pd.DataFrame(dict(
+        {
+            name: grouped.size() if function == 'count' else grouped[column].sum()
+            for name, (function, column) in q['aggregates'].items()
+        },
+        **{ROW_COLUMN: grouped[ROW_COLUMN].min()}
+    )).reset_index()
+    for col in categorical:
+        result[col] = pd.Categorical.from_codes(result[col], dtype=df[col].dtype)
+    return finish(result, q, {col: df[col].cat.categories for col in categorical})
+
+
+def parquet_path(path=ARTIFACT_PATH):
+    return '{}.parquet'.format(os.path.splitext(path)[0])
+
+
+def parquet_metadata(path=ARTIFACT_PATH):
+    return pq.read_schema(parquet_path(path)).metadata or {}
+
+
+def parquet_is_current(path=ARTIFACT_PATH):
+    if not os.path.exists(parquet_path(path)):
+        return False
+    metadata = parquet_metadata(path)
+    # copies written before the categories were recorded are rewritten too
+    return (
+        b'categories' in metadata
+        and json.loads(metadata.get(b'artifact_fingerprint', b'null')) == file_fingerprint(path)
+    )
+
+
+def write_parquet(path=ARTIFACT_PATH):
+    # the artifact as parquet with the row positions, the fingerprint of the artifact to
+    # detect a stale copy and the categories of its categorical columns (parquet reads
+    # them back as strings) in the metadata
+    fingerprint = file_fingerprint(path)
+    table = feather.read_table(path, memory_map=True).unify_dictionaries()
+    categories = {
+        field.name: table.column(field.name).chunk(0).dictionary.to_pylist() if table.column(field.name).num_chunks else []
+        for field in table.schema if pa.types.is_dictionary(field.type)
+    }
+    table = table.append_column(ROW_COLUMN, pa.array(np.arange(table.num_rows, dtype=np.int64)))
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'artifact_fingerprint'] = json.dumps(fingerprint).encode()
+    metadata[b'categories'] = json.dumps(categories).encode()
+    target = parquet_path(path)
+    tmp_path = '{}.tmp-{}'.format(target, os.getpid())
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, target)
+    return target
+
+
+def ensure_parquet(path=ARTIFACT_PATH):
+    # (re)writes the parquet copy when it is missing or older than the artifact, once per host
+    if not parquet_is_current(path):
+        with host_lock('{}.lock'.format(parquet_path(path))):
+            if not parquet_is_current(path):
+                write_parquet(path)
+    return parquet_path(path)
+
+
+def parquet_categories(path=ARTIFACT_PATH):
+    # the categories recorded in the parquet copy, written first when needed
+    ensure_parquet(path)
+    return json.loads(parquet_metadata(path)[b'categories'])
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def column_sql(col):
+    return 'CAST(year("INCIDENT_YEAR") AS BIGINT)' if col == 'INCIDENT_YEAR' else quote(col)
+
+
+def query_sql(q, year_range=None, times_of_day=None):
+    '''
+    The sql of the query over the table source and its parameters. The names come from
+    the query, the values (years, times of day, excluded values) are parameters.
+    '''
+    conditions, parameters = [], []
+    if year_range is not None:
+        conditions.append('year("INCIDENT_YEAR") BETWEEN ? AND ?')
+        parameters += [int(year_range[0]), int(year_range[1])]
+    if times_of_day is not None:
+        # like isin, an empty list selects nothing and the missing times of day never match
+        conditions.append('"TIME_OF_DAY" IN ({})'.format(', '.join('?' * len(times_of_day))) if times_of_day else 'FALSE')
+        parameters += list(times_of_day)
+    conditions += ['{} IS NOT NULL'.format(quote(col)) for col in complete_columns(q)]
+    for col, values in q['exclude'].items():
+        # missing values are not excluded, like ~isin
+        conditions.append('({0} IS NULL OR {0} NOT IN ({1}))'.format(quote(col), ', '.join('?' * len(values))))
+        parameters += list(values)
+    aggregates = [
+        ('COUNT(*)' if function == 'count' else 'COALESCE(SUM({}), 0)'.format(quote(column))) + ' AS ' + quote(name)
+        for name, (function, column) in q['aggregates'].items()
+    ]
+    aggregates.append('MIN({0}) AS {0}'.format(quote(ROW_COLUMN)))
+    keys = [column_sql(col) for col in q['group_by']]
+    sql = 'SELECT {} FROM source'.format(', '.join(
+        ['{} AS {}'.format(key, quote(col)) for key, col in zip(keys, q['group_by'])] + aggregates
+    ))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if keys:
+        sql += ' GROUP BY ' + ', '.join(keys)
+    return sql, parameters
+
+
+# one connection per process, every query runs on a cursor of its own (thread safe)
+_DUCKDB = {'connection': None}
+_DUCKDB_LOCK = threading.Lock()
+
+
+def duckdb_cursor():
+    import duckdb
+
+    with _DUCKDB_LOCK:
+        if _DUCKDB['connection'] is None:
+            _DUCKDB['connection'] = duckdb.connect()
+            if DUCKDB_THREADS:
+                _DUCKDB['connection'].execute('SET threads TO {}'.format(int(DUCKDB_THREADS)))
+        return _DUCKDB['connection'].cursor()
+
+
+def duckdb_query(q, year_range=None, times_of_day=None, path=ARTIFACT_PATH):
+    # the copy is checked (and the categories read) once per version of the artifact
+    categories = load_derived('parquet_categories', parquet_categories, path)
+    sql, parameters = query_sql(q, year_range, times_of_day)
+    source = parquet_path(path).replace("'", "''")
+    sql = "WITH source AS (SELECT * FROM read_parquet('{}')) {}".format(source, sql)
+    cursor = duckdb_cursor()
+    try:
+        result = cursor.execute(sql, parameters).df()
+    finally:
+        cursor.close()
+    return finish(result, q, {col: categories[col] for col in q['group_by'] if col in categories})
+
+
+def run_query(q, year_range=None, times_of_day=None, backend=QUERY_BACKEND, path=ARTIFACT_PATH):
+    if backend not in BACKENDS:
+        raise ValueError('backend must be one of {}, got {!r}'.format(BACKENDS, backend))
+    run = pandas_query if backend == 'pandas' else duckdb_query
+    return run(q, year_range, times_of_day, path)
+
+
+def run_analysis(name, year_range=None, times_of_day=None, backend=QUERY_BACKEND, path=ARTIFACT_PATH):
+    return run_query(ANALYSES[name], year_range, times_of_day, backend, path)
+
+
+def damage_levels_long(cells):
+    # chart_8 with the damage levels as values, without its 0 counts
+    levels = list(DAMAGE_LEVEL_LINES.values())
+    table = damage_level_trends(cells['airport']).rename(columns={'variable': 'DAMAGE_LEVEL', 'value': 'counts'})
+    table['DAMAGE_LEVEL'] = table['DAMAGE_LEVEL'].map(DAMAGE_LEVEL_LINES)
+    table = table[table['counts'] > 0]
+    codes = table['DAMAGE_LEVEL'].map({level: code for code, level in enumerate(levels)})
+    return table.assign(code=codes).sort_values(['INCIDENT_YEAR', 'code'])
+
+
+# analysis -> table of the chart of the application, from cells (cube_cells) and the ranking
+# indexes, the ranking functions take the filters themselves. The tables are built by the
+# functions the application draws its charts from, only the shape of the result differs
+DASHBOARD_TABLES = {
+    'strikes_per_year': lambda cells, ranking, years, tod: strikes_per_year(cells['size']),
+    'top_airports_by_strikes': top_airport_counts,
+    'top_airports_by_cost': lambda cells, ranking, years, tod: top_cost(ranking['AIRPORT'], years, tod),
+    'top_operators_by_cost': lambda cells, ranking, years, tod: top_cost(ranking['OPERATOR'], years, tod),
+    'cost_per_year': lambda cells, ranking, years, tod: sum_per_group(
+        cells['airport'], 'INCIDENT_YEAR', 'COST_REPAIRS', 'Cost_of_Repairs'
+    ),
+    'damage_level_per_year': lambda cells, ranking, years, tod: damage_levels_long(cells),
+    'phase_of_flight': lambda cells, ranking, years, tod: chart_counts('chart_11', cells['phase_of_flight']),
+    'precipitation_and_warned': lambda cells, ranking, years, tod: chart_counts('chart_12', cells['precipitation_and_sky']),
+    'sky_and_warned': lambda cells, ranking, years, tod: chart_counts('chart_13', cells['precipitation_and_sky']),
+}
+
+
+def dashboard_result(name, year_range=None, times_of_day=None, path=ARTIFACT_PATH):
+    '''
+    The numbers the application shows for analysis name, computed by its own functions
+    (cube and ranking indexes) and given the columns, types and order of the result of
+    the analysis.
+    '''
+    q = ANALYSES[name]
+    cells = cube_cells(year_range, times_of_day, path)
+    table = DASHBOARD_TABLES[name](cells, load_ranking_indexes(path), year_range, times_of_day)
+    result = pd.DataFrame(index=range(len(table)))
+    for col in q['group_by']:
+        values = table[col].reset_index(drop=True)
+        if col == 'INCIDENT_YEAR':
+            result[col] = values.dt.year.astype(np.int64)
+        else:
+            result[col] = values.astype(object).where(values.notna(), None)
+    for result_name, (function, _) in q['aggregates'].items():
+        result[result_name] = table[result_name].to_numpy().astype(np.int64 if function == 'count' else np.float64)
+    return result
+
+
+def compare_backends(year_range=DEFAULT_YEAR_RANGE, times_of_day=tuple(DEFAULT_TIMES_OF_DAY), repeat=3, path=ARTIFACT_PATH):
+    '''
+    Best time of repeat runs of every analysis on both backends, raises when the results
+    differ from each other or from the numbers of the application. The parquet copy, the
+    columns and the index are prepared before timing.
+    '''
+    ensure_parquet(path)
+    report = {}
+    for name, q in ANALYSES.items():
+        row, results = {}, {}
+        for backend in BACKENDS:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                results[backend] = run_query(q, year_range, list(times_of_day), backend, path)
+                timings.append(time.perf_counter() - start)
+            row['{}_ms'.format(backend)] = min(timings) * 1e3
+        pd.testing.assert_frame_equal(results['pandas'], results['duckdb'], check_exact=True)
+        pd.testing.assert_frame_equal(
+            results['pandas'], dashboard_result(name, year_range, list(times_of_day), path), check_exact=True
+        )
+        report[name] = dict(row, groups=len(results['pandas']))
+    return pd.DataFrame(report).T.astype({'groups': np.int64})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The analyses on the pandas and duckdb backends.')
+    parser.add_argument('--artifact', default=ARTIFACT_PATH)
+    parser.add_argument('--years', type=int, nargs=2, default=list(DEFAULT_YEAR_RANGE))
+    parser.add_argument('--time-of-day', nargs='*', default=DEFAULT_TIMES_OF_DAY)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(compare_backends(tuple(args.years), args.time_of_day, args.repeat, args.artifact).round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
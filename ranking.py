@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from aggregates import load_cube
+from data_loader import ARTIFACT_PATH, load_derived
+
+
+# Ranking index of the airports and operators. For every TIME_OF_DAY x DAMAGE_LEVEL x
+# entity it keeps the strike count and the cost of repairs cumulated over the years, so
+# the totals of any year range are the difference of two slices. Missing values have
+# their own slot (the last one) on every axis. The first row of every year is kept too,
+# ties are broken by first occurrence like Counter.most_common does.
+
+# entity -> (cuboid of the cube it is built from, column it is split by)
+RANKING_SPECS = {
+    'AIRPORT': ('airport', 'DAMAGE_LEVEL'),
+    'OPERATOR': ('operator', None),
+}
+NO_ROW = np.iinfo(np.int64).max
+
+
+def slot_codes(series):
+    # category codes with missing values in the last slot
+    codes = series.cat.codes.to_numpy().astype(np.int64)
+    return np.where(codes < 0, len(series.cat.categories), codes)
+
+
+def build_ranking_index(cuboid, entity, split=None):
+    years = np.sort(cuboid['INCIDENT_YEAR'].dropna().unique()).astype(np.int64)
+    axes = [cuboid['TIME_OF_DAY'], cuboid[split] if split else None, cuboid[entity]]
+    shape = [len(axis.cat.categories) + 1 if axis is not None else 1 for axis in axes] + [len(years)]
+    position = tuple(
+        [slot_codes(axis) if axis is not None else np.zeros(len(cuboid), dtype=np.int64) for axis in axes]
+        + [np.searchsorted(years, cuboid['INCIDENT_YEAR'].to_numpy())]
+    )
+    counts = np.zeros(shape, dtype=np.int64)
+    costs = np.zeros(shape, dtype=np.float64)
+    first_row = np.full(shape, NO_ROW, dtype=np.int64)
+    np.add.at(counts, position, cuboid['counts'].to_numpy())
+    np.add.at(costs, position, cuboid['COST_REPAIRS'].to_numpy())
+    np.minimum.at(first_row, position, cuboid['first_row'].to_numpy())
+    # a leading 0 so the totals of years [i, j) are cumulative[..., j] - cumulative[..., i]
+    pad = [(0, 0)] * 3 + [(1, 0)]
+    return {
+        'entity': entity,
+        'split': split,
+        'years': years,
+        'times_of_day': cuboid['TIME_OF_DAY'].cat.categories,
+        'split_values': cuboid[split].cat.categories if split else None,
+        'labels': cuboid[entity].cat.categories,
+        'dtype': cuboid[entity].dtype,
+        'counts': np.pad(np.cumsum(counts, axis=-1), pad),
+        'costs': np.pad(np.cumsum(costs, axis=-1), pad),
+        'first_row': first_row,
+    }
+
+
+def build_ranking_indexes(path=ARTIFACT_PATH):
+    cube = load_cube(path)
+    return {
+        entity: build_ranking_index(cube[cuboid], entity, split)
+        for entity, (cuboid, split) in RANKING_SPECS.items()
+    }
+
+
+def load_ranking_indexes(path=ARTIFACT_PATH):
+    # built once per artifact version and shared by every session
+    return load_derived('ranking', build_ranking_indexes, path)
+
+
+def selected_slots(categories, values):
+    # slots of the given values (isin, never the missing slot), None selects every slot
+    if values is None:
+        return slice(None)
+    return np.flatnonzero(categories.isin(values))
+
+
+def range_totals(index, year_range=None, times_of_day=None, split_values=None):
+    '''
+    Strike count, cost of repairs and first row of every entity (missing last) for the
+    selected years (inclusive), times of day and values of the split column.
+    '''
+    years = index['years']
+    if year_range is None:
+        start, stop = 0, len(years)
+    else:
+        start = np.searchsorted(years, year_range[0], side='left')
+        stop = np.searchsorted(years, year_range[1], side='right')
+    tod = selected_slots(index['times_of_day'], times_of_day)
+    split = selected_slots(index['split_values'], split_values) if index['split'] else slice(None)
+
+    def selected(array):
+        return array[tod][:, split]
+
+    counts = (selected(index['counts'])[..., stop] - selected(index['counts'])[..., start]).sum(axis=(0, 1))
+    costs = (selected(index['costs'])[..., stop] - selected(index['costs'])[..., start]).sum(axis=(0, 1))
+    first_row = selected(index['first_row'])[..., start:stop]
+    first_row = first_row.min(axis=(0, 1, 3)) if first_row.size else np.full(len(counts), NO_ROW)
+    return counts, costs, first_row
+
+
+def labels_at(index, positions):
+    # the entities at the given slots, the last slot is the missing value
+    return pd.Categorical.from_codes(
+        np.where(positions == len(index['labels']), -1, positions), dtype=index['dtype']
+    )
+
+
+def top_k(index, year_range=None, times_of_day=None, split_values=None, k=100, exclude=('UNKNOWN',)):
+    '''
+    The k entities with most strikes, ties broken by first occurrence, same as
+    Counter(rows[entity].to_list()).most_common(k) on the rows without the excluded values.
+    '''
+    counts, _, first_row = range_totals(index, year_range, times_of_day, split_values)
+    counts = counts.copy()
+    counts[np.flatnonzero(index['labels'].isin(exclude))] = 0
+    candidates = np.flatnonzero(counts)
+    if len(candidates) > k:
+        # only the entities counting at least as much as the k-th can make it
+        kth = -np.partition(-counts[candidates], k - 1)[k - 1]
+        candidates = candidates[counts[candidates] >= kth]
+    order = np.lexsort((first_row[candidates], -counts[candidates]))[:k]
+    return list(labels_at(index, candidates[order]))
+
+
+def cost_per_entity(index, year_range=None, times_of_day=None, name='Cost_of_Repairs'):
+    # cost of repairs of every entity with strikes in the selection, in order of first
+    # appearance like df.groupby(entity, observed=True).agg(name=('COST_REPAIRS', 'sum'))
+    counts, costs, first_row = range_totals(index, year_range, times_of_day)
+    observed = np.flatnonzero(counts[:len(index['labels'])])
+    observed = observed[np.argsort(first_row[observed], kind='stable')]
+    return pd.DataFrame({index['entity']: labels_at(index, observed), name: costs[observed]})
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+
+from utilities import (
+    CONTINUOUS_COLUMNS, NOMINAL_COLUMNS, ORDINAL_COLUMNS, TEXT_COLUMNS,
+    BOOLEAN_COLUMNS, DATETIME_COLUMNS,
+)
+
+
+# order of the classes of the ordinal columns (after remapping), labels which are
+# not listed here are kept and placed after the known ones
+ORDERED_CATEGORIES = {
+    'DAMAGE_LEVEL': ['No_Damage', 'Minor', 'Substantial', 'Destroyed'],
+    'SIZE': ['Small', 'Medium', 'Large'],
+    'NUM_SEEN': ['1', '2-10', '11-100', 'More than 100'],
+    'NUM_STRUCK': ['1', '2-10', '11-100', 'More than 100'],
+}
+
+# continuous columns which are summed in the charts, kept as float64 so the sums do
+# not change with the downcast
+FLOAT64_COLUMNS = [
+    'COST_REPAIRS', 'COST_OTHER', 'COST_REPAIRS_INFL_ADJ', 'COST_OTHER_INFL_ADJ',
+]
+
+# text columns only become categorical when they repeat enough
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def build_schema():
+    # column name -> kind of dtype it gets in apply_schema
+    schema = {}
+    for col in CONTINUOUS_COLUMNS:
+        schema[col] = 'float64' if col in FLOAT64_COLUMNS else 'numeric'
+    for col in NOMINAL_COLUMNS:
+        schema[col] = 'category'
+    for col in TEXT_COLUMNS:
+        schema[col] = 'text'
+    for col in ORDINAL_COLUMNS:
+        schema[col] = 'ordered_category'
+    for col in BOOLEAN_COLUMNS:
+        schema[col] = 'flag'
+    for col in DATETIME_COLUMNS:
+        # the column lists have had stray spaces in the names before
+        schema[col.strip()] = 'datetime'
+    return schema
+
+
+SCHEMA = build_schema()
+
+
+# apply_schema works in two steps, it collects a few statistics per column and then
+# decides the dtypes from them. The statistics of two sets of rows can be merged, so the
+# same dtypes can be decided for data which is processed chunk by chunk.
+
+# kinds of columns whose distinct values are needed to decide the dtype
+VALUE_KINDS = ('category', 'ordered_category', 'flag', 'datetime', 'text')
+
+
+def is_numeric_dtype(dtype):
+    return isinstance(dtype, np.dtype) and dtype.kind in 'iuf'
+
+
+def column_stats(series, kind=None):
+    stats = {'dtype': series.dtype, 'rows': len(series)}
+    if kind in VALUE_KINDS and series.dtype == object:
+        # a single hashing pass gives the nulls and the distinct values in order of appearance
+        codes, uniques = pd.factorize(series)
+        stats['nulls'] = int((codes == -1).sum())
+        stats['values'] = dict.fromkeys(uniques)
+        stats['sorted_values'] = False
+        return stats
+
+    stats['nulls'] = int(series.isna().sum())
+    if is_numeric_dtype(series.dtype):
+        values = series.to_numpy()
+        if series.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+        stats['min'] = values.min() if values.size else None
+        stats['max'] = values.max() if values.size else None
+        stats['integral'] = bool(np.array_equal(values, np.round(values)))
+        stats['float32_exact'] = bool(np.array_equal(values.astype(np.float32).astype(np.float64), values))
+    if kind in VALUE_KINDS:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # categoricals (the remapped columns) keep their categories, which are sorted
+            stats['values'] = dict.fromkeys(series.cat.categories)
+            stats['sorted_values'] = True
+        elif not pd.api.types.is_datetime64_any_dtype(series):
+            # distinct values in order of appearance
+            stats['values'] = dict.fromkeys(pd.unique(series.dropna()))
+            stats['sorted_values'] = False
+    return stats
+
+
+def merge_column_stats(first, second):
+    # statistics of the rows of first followed by the rows of second, a set of rows
+    # without any value (which pandas may have read with another dtype) adds only its counts
+    rows, nulls = first['rows'] + second['rows'], first['nulls'] + second['nulls']
+    if second['rows'] == second['nulls']:
+        return dict(first, rows=rows, nulls=nulls)
+    if first['rows'] == first['nulls']:
+        return dict(second, rows=rows, nulls=nulls)
+    # the remapped columns are categoricals with the labels of their own rows
+    both_categorical = isinstance(first['dtype'], pd.CategoricalDtype) and isinstance(second['dtype'], pd.CategoricalDtype)
+    if first['dtype'] != second['dtype'] and not both_categorical:
+        raise ValueError('can not merge statistics of {} and {} columns'.format(first['dtype'], second['dtype']))
+
+    merged = dict(first, rows=rows, nulls=nulls)
+    if 'min' in first:
+        merged['min'] = min(first['min'], second['min'])
+        merged['max'] = max(first['max'], second['max'])
+        merged['integral'] = first['integral'] and second['integral']
+        merged['float32_exact'] = first['float32_exact'] and second['float32_exact']
+    if 'values' in first:
+        merged['values'] = dict(first['values'])
+        merged['values'].update(second['values'])
+    if both_categorical:
+        merged['dtype'] = pd.CategoricalDtype(list(merged['values']))
+    return merged
+
+
+def collect_stats(df, schema=SCHEMA):
+    return {col: column_stats(df[col], schema.get(col)) for col in df.columns}
+
+
+def merge_stats(first, second):
+    if first is None:
+        return second
+    return {col: merge_column_stats(first[col], second[col]) for col in first}
+
+
+def smallest_int_dtype(low, high):
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def numeric_dtype(stats):
+    # smallest integer type for integer columns (and float columns holding only whole
+    # numbers and no nulls), float32 for the rest only when every value survives the round trip
+    dtype = stats['dtype']
+    if dtype.kind in 'iu' or (not stats['nulls'] and stats['integral'] and stats['min'] is not None):
+        if stats['min'] is None:
+            return np.dtype(np.int8)
+        return smallest_int_dtype(stats['min'], stats['max'])
+    if stats['float32_exact']:
+        return np.dtype(np.float32)
+    return dtype
+
+
+def category_dtype(stats, order=None):
+    # categories are sorted like astype('category') does, ordered ones follow the given
+    # order with the other observed labels (in order of appearance) after it
+    values = list(stats['values'])
+    if order is None or stats['sorted_values']:
+        try:
+            values = sorted(values)
+        except TypeError:
+            # mixed types, left in order of appearance
+            pass
+    if order is not None:
+        return pd.CategoricalDtype(list(order) + [c for c in values if c not in order], ordered=True)
+    if not values:
+        return pd.CategoricalDtype(pd.Index([], dtype=stats['dtype'] if is_numeric_dtype(stats['dtype']) else object))
+    return pd.CategoricalDtype(values)
+
+
+def resolve_dtype(kind, stats, order=()):
+    dtype = stats['dtype']
+    if kind == 'numeric' and is_numeric_dtype(dtype):
+        return numeric_dtype(stats)
+    if kind == 'category':
+        return category_dtype(stats)
+    if kind == 'ordered_category':
+        return category_dtype(stats, order)
+    if kind == 'flag':
+        # the STR_*/DAM_* style 0/1 columns, int8 when complete and nullable Int8 otherwise,
+        # Yes/No style flags (WARNED) become categories
+        if not pd.api.types.is_numeric_dtype(dtype):
+            return category_dtype(stats)
+        return pd.Int8Dtype() if stats['nulls'] else np.dtype(np.int8)
+    if kind == 'datetime':
+        # already parsed columns stay as they are, numbers are downcast and the
+        # date/time strings become categories (few distinct values, no parsing ambiguity)
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return dtype
+        if is_numeric_dtype(dtype):
+            return numeric_dtype(stats)
+        return category_dtype(stats)
+    if kind == 'text' and stats['rows'] and len(stats['values']) <= CATEGORY_MAX_UNIQUE_RATIO * stats['rows']:
+        return category_dtype(stats)
+    return dtype
+
+
+def resolve_dtypes(stats, schema=SCHEMA):
+    return {
+        col: resolve_dtype(schema.get(col), col_stats, ORDERED_CATEGORIES.get(col, ()))
+        for col, col_stats in stats.items()
+    }
+
+
+def cast_columns(df, dtypes):
+    return pd.DataFrame(
+        {col: df[col] if df[col].dtype == dtypes[col] else df[col].astype(dtypes[col]) for col in df.columns},
+        index=df.index,
+    )
+
+
+def apply_schema(df, schema=SCHEMA):
+    '''
+    Converts the columns of df present in the schema to compact dtypes:
+    categories for nominal columns, ordered categories for the ordinal ones,
+    int8 flags, downcast numerics and categorical date/time strings.
+    '''
+    return cast_columns(df, resolve_dtypes(collect_stats(df, schema), schema))
+
+
+def memory_report(before, after):
+    # bytes per column before and after applying the schema
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.reindex(before.columns).astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'bytes_after': after.memory_usage(index=False, deep=True).reindex(before.columns),
+    })
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report.loc['TOTAL'] = [
+        '', '', report['bytes_before'].sum(), report['bytes_after'].sum(), report['bytes_saved'].sum()
+    ]
+    return report
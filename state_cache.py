@@ -0,0 +1,220 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from data_loader import ARTIFACT_PATH, file_fingerprint
+
+
+# Least recently used caches bounded by the bytes of what they hold. A cache is a dict
+# with its entries (key -> (value, bytes)) in order of use and its counters, shared by
+# every session of the process, so the cached values must be treated as read only.
+
+# bytes the filter state and chart caches may hold, the environment variables of the
+# same names override them
+FILTER_CACHE_BYTES = int(os.environ.get('FILTER_CACHE_BYTES', 256 * 1024 ** 2))
+CHART_CACHE_BYTES = int(os.environ.get('CHART_CACHE_BYTES', 128 * 1024 ** 2))
+
+
+def new_cache(budget_bytes):
+    return {
+        'entries': OrderedDict(),
+        'budget_bytes': budget_bytes,
+        'bytes': 0,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'version': None,
+        'lock': threading.Lock(),
+    }
+
+
+def value_bytes(value):
+    # memory held by value, deep for frames and containers
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(value, pd.DataFrame) else int(usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_bytes(k) + value_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def evict(cache, budget_bytes):
+    # drops the least recently used entries until the cache holds at most budget_bytes
+    entries = cache['entries']
+    while entries and cache['bytes'] > budget_bytes:
+        _, (_, nbytes) = entries.popitem(last=False)
+        cache['bytes'] -= nbytes
+        cache['evictions'] += 1
+
+
+def cache_get(cache, key, default=None):
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry is None:
+            cache['misses'] += 1
+            return default
+        cache['entries'].move_to_end(key)
+        cache['hits'] += 1
+        return entry[0]
+
+
+def cache_put(cache, key, value, nbytes=None):
+    # a value larger than the whole budget is not kept
+    nbytes = value_bytes(value) if nbytes is None else nbytes
+    with cache['lock']:
+        previous = cache['entries'].pop(key, None)
+        if previous is not None:
+            cache['bytes'] -= previous[1]
+        if nbytes > cache['budget_bytes']:
+            return value
+        cache['entries'][key] = (value, nbytes)
+        cache['bytes'] += nbytes
+        evict(cache, cache['budget_bytes'])
+    return value
+
+
+def drop_stale(cache, version):
+    # entries are keyed (name, dataset version, state), once the dataset changes the
+    # entries of the other versions can never be hit again
+    with cache['lock']:
+        if cache['version'] == version:
+            return
+        for key in [key for key in cache['entries'] if key[1] != version]:
+            cache['bytes'] -= cache['entries'].pop(key)[1]
+        cache['version'] = version
+
+
+def set_budget(cache, budget_bytes):
+    with cache['lock']:
+        cache['budget_bytes'] = budget_bytes
+        evict(cache, budget_bytes)
+
+
+def clear_cache(cache):
+    with cache['lock']:
+        cache['entries'].clear()
+        cache['bytes'] = 0
+
+
+def cache_stats(cache):
+    with cache['lock']:
+        return {
+            'entries': len(cache['entries']),
+            'bytes': cache['bytes'],
+            'budget_bytes': cache['budget_bytes'],
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'evictions': cache['evictions'],
+        }
+
+
+# selections and tables derived for a filter state, by name and state
+FILTER_CACHE = new_cache(FILTER_CACHE_BYTES)
+# vega-lite json of the charts, by chart and state
+CHART_CACHE = new_cache(CHART_CACHE_BYTES)
+
+
+def filter_state(year_range=None, times_of_day=None, **selections):
+    '''
+    Hashable form of the filters and selections (analysis, modes, ...) of the application.
+    The order the times of day were picked in does not change the rows, so it is dropped.
+    '''
+    state = (
+        ('year_range', None if year_range is None else tuple(int(year) for year in year_range)),
+        ('times_of_day', None if times_of_day is None else tuple(sorted(set(times_of_day)))),
+    )
+    return state + tuple(sorted(selections.items()))
+
+
+def dataset_version(path=ARTIFACT_PATH):
+    return tuple(sorted(file_fingerprint(path).items()))
+
+
+def memoize(name, state, build, path=ARTIFACT_PATH, cache=FILTER_CACHE):
+    '''
+    Returns build(), computed once per name, filter state and version of the artifact
+    while it stays in the cache. Callers must treat the result as read only.
+    '''
+    version = dataset_version(path)
+    drop_stale(cache, version)
+    key = (name, version, state)
+    missing = object()
+    value = cache_get(cache, key, missing)
+    if value is missing:
+        value = cache_put(cache, key, build())
+    return value
+
+
+# attributes holding the subcharts of layered, concatenated, faceted and repeated charts,
+# and those holding the encodings of a chart
+SUBCHART_ATTRIBUTES = ('layer', 'hconcat', 'vconcat', 'concat', 'spec')
+ENCODING_ATTRIBUTES = ('encoding', 'facet')
+
+
+def typed_channels(value, data):
+    # copy of the encodings in value with the types altair infers from the frame data
+    # written out, the inference needs the frame which inline_data takes away
+    if isinstance(value, list):
+        return [typed_channels(item, data) for item in value]
+    if not isinstance(value, alt.SchemaBase):
+        return value
+    value = value.copy(deep=False)
+    for key, item in value._kwds.items():
+        value._kwds[key] = typed_channels(item, data)
+    if isinstance(value, alt.FacetMapping):
+        for key in ('row', 'column'):
+            if isinstance(value._get(key), str):
+                value[key] = alt.FacetFieldDef(**alt.utils.parse_shorthand(value[key], data))
+    shorthand = value._get('shorthand')
+    if isinstance(shorthand, str) and 'type' in value._kwds and value._get('type') is alt.Undefined:
+        inferred = alt.utils.parse_shorthand(shorthand, data).get('type')
+        if inferred is not None:
+            value.type = inferred
+    return value
+
+
+def inline_data(chart, data=None):
+    '''
+    Copy of chart with the frames of it and its subcharts replaced by their values, the
+    way the default data transformer converts them but without its row limit. Lifting
+    the limit with alt.data_transformers.disable_max_rows() would switch the transformer
+    of the whole process, under the charts other sessions are serializing. data is the
+    frame chart inherits from the chart it is part of.
+    '''
+    chart = chart.copy(deep=False)
+    if isinstance(chart._get('data'), pd.DataFrame):
+        data = chart.data
+        chart.data = alt.utils.data.to_values(data)
+    if data is not None:
+        for attribute in ENCODING_ATTRIBUTES:
+            if chart._get(attribute) is not alt.Undefined:
+                chart[attribute] = typed_channels(chart[attribute], data)
+    for attribute in SUBCHART_ATTRIBUTES:
+        subcharts = chart._get(attribute)
+        if isinstance(subcharts, list):
+            chart[attribute] = [inline_data(subchart, data) for subchart in subcharts]
+        elif isinstance(subcharts, alt.TopLevelMixin):
+            chart[attribute] = inline_data(subcharts, data)
+    return chart
+
+
+def chart_json(chart):
+    # the spec streamlit sends, with the data inlined whatever its size
+    return inline_data(chart).to_json(indent=None)
+
+
+def chart_spec(name, state, build, path=ARTIFACT_PATH):
+    '''
+    Vega-lite json of the chart build() returns, built and serialized once per chart,
+    filter state and version of the artifact while it stays in CHART_CACHE.
+    '''
+    return memoize(name, state, lambda: chart_json(build()), path, cache=CHART_CACHE)
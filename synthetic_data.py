@@ -0,0 +1,225 @@
+'''
+Synthetic FAA wildlife strike exports for benchmarking. The columns are the ones of the
+column lists in utilities.py, the remapped columns draw their raw labels from the *_MAPPING
+dicts, so the generated file goes through the same preprocessing as a real export
+(stray whitespace and empty strings included).
+
+    python synthetic_data.py --scale 1 10 100 --output-dir data/synthetic
+
+writes data/synthetic/main_data_x1.csv, ..._x10.csv and ..._x100.csv. The rows are
+written in chunks, so memory does not grow with the scale.
+'''
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utilities import (
+    AC_MASS_MAPPING, BOOLEAN_COLUMNS, CONTINUOUS_COLUMNS, DATETIME_COLUMNS, DAMAGE_LEVEL_MAPPING,
+    EFFECT_MAPPING, NOMINAL_COLUMNS, ORDINAL_COLUMNS, PRECIPITATION_MAPPING, TEXT_COLUMNS,
+    TEXT_FIELDS_TO_STRIP, TYPE_ENGINE_MAPPING, WARNED_MAPPING,
+)
+
+
+# about the number of records of the 1990 - 2022 export the dashboard was built for
+REAL_ROWS = 288810
+SCALES = (1, 10, 100)
+DEFAULT_CHUNKSIZE = 500000
+YEARS = np.arange(1990, 2023)
+# share of the text values written with stray whitespace, and as empty strings
+PADDED_RATE = 0.02
+EMPTY_RATE = 0.01
+
+# column -> (labels, weights, null rate) of the columns with a small known vocabulary
+CHOICE_COLUMNS = {
+    'TIME_OF_DAY': (['Day', 'Night', 'Dusk', 'Dawn'], [0.62, 0.28, 0.05, 0.05], 0.35),
+    'PHASE_OF_FLIGHT': (
+        ['Approach', 'Landing Roll', 'Take-off Run', 'Climb', 'En Route', 'Descent', 'Taxi', 'Parked',
+         'Arrival', 'Departure', 'Local'],
+        [0.33, 0.18, 0.17, 0.14, 0.04, 0.03, 0.01, 0.01, 0.04, 0.04, 0.01], 0.3,
+    ),
+    'SKY': (['No Cloud', 'Some Cloud', 'Overcast'], [0.55, 0.3, 0.15], 0.3),
+    'AC_CLASS': (['A', 'B', 'C', 'J', 'Y'], [0.9, 0.06, 0.02, 0.01, 0.01], 0.25),
+    'FAAREGION': (['AEA', 'AGL', 'ANE', 'ANM', 'ASO', 'ASW', 'AWP', 'ACE', 'AAL', 'FGN'],
+                  [0.13, 0.16, 0.04, 0.1, 0.2, 0.13, 0.12, 0.05, 0.03, 0.04], 0.02),
+    'SIZE': (['Small', 'Medium', 'Large'], [0.6, 0.3, 0.1], 0.2),
+    'NUM_SEEN': (['1', '2-10', '11-100', 'More than 100'], [0.45, 0.4, 0.13, 0.02], 0.6),
+    'NUM_STRUCK': (['1', '2-10', '11-100', 'More than 100'], [0.88, 0.1, 0.019, 0.001], 0.05),
+    # raw labels of the remapped columns, the keys of their mappings
+    'PRECIPITATION': (list(PRECIPITATION_MAPPING), [0.2, 0.08, 0.02, 0.62] + [0.01] * 8, 0.45),
+    'DAMAGE_LEVEL': (list(DAMAGE_LEVEL_MAPPING), [0.86, 0.04, 0.06, 0.03, 0.01], 0.1),
+    'EFFECT': (list(EFFECT_MAPPING), [0.8] + [0.2 / (len(EFFECT_MAPPING) - 1)] * (len(EFFECT_MAPPING) - 1), 0.5),
+    'WARNED': (list(WARNED_MAPPING), [0.25, 0.35, 0.4], 0.3),
+    'TYPE_ENG': (list(TYPE_ENGINE_MAPPING), [0.7, 0.1, 0.02, 0.13, 0.03, 0.01, 0.01], 0.1),
+    'AC_MASS': ([float(key) for key in AC_MASS_MAPPING], [0.15, 0.1, 0.15, 0.55, 0.05], 0.15),
+}
+
+# column -> (label prefix, number of distinct values, null rate) of the columns with many
+# values, drawn from a zipf like distribution so a few values have most of the rows
+ZIPF_COLUMNS = {
+    'AIRPORT': ('AIRPORT', 2200, 0.0),
+    'STATE': ('ST', 60, 0.1),
+    'OPERATOR': ('OPERATOR', 900, 0.05),
+    'AIRCRAFT': ('AIRCRAFT', 600, 0.25),
+    'EMA': ('EMA', 60, 0.35),
+    'EMO': ('EMO', 120, 0.35),
+    'AMA': ('AMA', 100, 0.25),
+    'AMO': ('AMO', 300, 0.25),
+    'SPECIES': ('SPECIES', 700, 0.0),
+    'LOCATION': ('LOCATION', 5000, 0.9),
+    'EFFECT_OTHER': ('EFFECT_OTHER', 400, 0.97),
+}
+# columns which are an id of another one (same value -> same id)
+ID_COLUMNS = {'AIRPORT_ID': ('AIRPORT', 'K'), 'OPID': ('OPERATOR', 'OP'), 'SPECIES_ID': ('SPECIES', 'SP')}
+# share of the strikes at an unknown airport, with the UNKNOWN label of the export
+UNKNOWN_AIRPORT_RATE = 0.1
+
+# strike columns and the chance a part is struck, damaged given it is struck
+STRIKE_RATE = 0.12
+DAMAGE_GIVEN_STRIKE_RATE = 0.08
+
+
+def with_nulls(rng, values, null_rate):
+    values = np.asarray(values, dtype=object)
+    if null_rate:
+        values[rng.random(len(values)) < null_rate] = None
+    return values
+
+
+def choice_column(rng, n, labels, weights, null_rate):
+    weights = np.asarray(weights, dtype=np.float64)
+    return with_nulls(rng, np.asarray(labels, dtype=object)[rng.choice(len(labels), n, p=weights / weights.sum())], null_rate)
+
+
+def zipf_codes(rng, n, cardinality):
+    # ranks 0..cardinality - 1 with probability ~ 1 / (rank + 1)
+    weights = 1.0 / np.arange(1, cardinality + 1)
+    return rng.choice(cardinality, n, p=weights / weights.sum())
+
+
+def labels(prefix, cardinality):
+    return np.array(['{} {}'.format(prefix, i) for i in range(cardinality)], dtype=object)
+
+
+def messy(rng, values):
+    # stray whitespace and empty strings, like the export has
+    values = values.copy()
+    present = np.flatnonzero(values != None)  # noqa: E711, elementwise comparison
+    padded = present[rng.random(len(present)) < PADDED_RATE]
+    values[padded] = [' {} '.format(v) for v in values[padded]]
+    empty = present[rng.random(len(present)) < EMPTY_RATE]
+    values[empty] = ''
+    return values
+
+
+def numeric_column(values, rng, null_rate):
+    values = np.asarray(values, dtype=np.float64)
+    values[rng.random(len(values)) < null_rate] = np.nan
+    return values
+
+
+def generate_chunk(n, seed=0, first_index=0):
+    '''
+    n rows of a synthetic raw export, the columns in the order of the column lists of
+    utilities.py. The same seed and first_index give the same rows.
+    '''
+    rng = np.random.default_rng([seed, first_index])
+    columns = {}
+
+    # when: more strikes in the later years and in the summer months
+    year_weights = np.linspace(1.0, 8.0, len(YEARS))
+    years = YEARS[rng.choice(len(YEARS), n, p=year_weights / year_weights.sum())]
+    month_weights = np.array([2, 2, 3, 5, 7, 7, 10, 11, 10, 8, 5, 3], dtype=np.float64)
+    months = rng.choice(12, n, p=month_weights / month_weights.sum()) + 1
+    days = rng.integers(1, 29, n)
+    columns['INCIDENT_DATE'] = pd.Series(months).astype(str) + '/' + pd.Series(days).astype(str) + '/' + pd.Series(years).astype(str) + ' 0:00'
+    columns['INCIDENT_MONTH'] = months
+    columns['INCIDENT_YEAR'] = years
+    times = pd.Series(rng.integers(0, 24, n)).astype(str).str.zfill(2) + ':' + pd.Series(rng.integers(0, 60, n)).astype(str).str.zfill(2)
+    columns['TIME'] = with_nulls(rng, times.to_numpy(dtype=object), 0.45)
+
+    for col, (column_labels, weights, null_rate) in CHOICE_COLUMNS.items():
+        columns[col] = choice_column(rng, n, column_labels, weights, null_rate)
+    for col, (prefix, cardinality, null_rate) in ZIPF_COLUMNS.items():
+        codes = zipf_codes(rng, n, cardinality)
+        columns[col] = with_nulls(rng, labels(prefix, cardinality)[codes], null_rate)
+        for id_col, (of, id_prefix) in ID_COLUMNS.items():
+            if of == col:
+                ids = np.array(['{}{:04d}'.format(id_prefix, i) for i in range(cardinality)], dtype=object)
+                columns[id_col] = np.where(columns[col] == None, None, ids[codes])  # noqa: E711
+    unknown = rng.random(n) < UNKNOWN_AIRPORT_RATE
+    columns['AIRPORT'][unknown] = 'UNKNOWN'
+    columns['AIRPORT_ID'][unknown] = 'ZZZZ'
+    columns['REG'] = with_nulls(rng, np.array(['N{}'.format(i) for i in rng.integers(0, max(n // 3, 1), n)], dtype=object), 0.4)
+    columns['FLT'] = with_nulls(rng, np.array(['{}'.format(i) for i in rng.integers(0, 9999, n)], dtype=object), 0.6)
+
+    # where and how
+    columns['INDX_NR'] = np.arange(first_index, first_index + n) + 600000
+    columns['LATITUDE'] = numeric_column(rng.uniform(25, 49, n), rng, 0.15)
+    columns['LONGITUDE'] = numeric_column(rng.uniform(-125, -67, n), rng, 0.15)
+    engines = rng.choice([1, 2, 3, 4], n, p=[0.15, 0.78, 0.04, 0.03])
+    columns['NUM_ENGS'] = numeric_column(engines, rng, 0.1)
+    for i in range(1, 5):
+        position = np.where(engines >= i, rng.integers(1, 8, n), np.nan)
+        columns['ENG_{}_POS'.format(i)] = numeric_column(position, rng, 0.1)
+    columns['HEIGHT'] = numeric_column(np.where(rng.random(n) < 0.35, 0, np.minimum(rng.exponential(1500, n), 16000).round(-1)), rng, 0.4)
+    columns['SPEED'] = numeric_column(np.clip(rng.normal(140, 40, n), 0, 340).round(), rng, 0.55)
+    columns['DISTANCE'] = numeric_column(rng.exponential(3, n).round(1), rng, 0.45)
+    columns['AOS'] = numeric_column(rng.exponential(24, n).round(), rng, 0.95)
+    for col in ['COST_REPAIRS', 'COST_OTHER']:
+        columns[col] = numeric_column(rng.lognormal(9, 2, n).round(), rng, 0.97)
+        columns[col + '_INFL_ADJ'] = (columns[col] * rng.uniform(1.0, 1.8, n)).round()
+    columns['NR_INJURIES'] = numeric_column(rng.poisson(0.01, n), rng, 0.95)
+    columns['NR_FATALITIES'] = numeric_column(rng.poisson(0.001, n), rng, 0.98)
+
+    # struck and damaged parts
+    damaged = np.zeros(n, dtype=bool)
+    for col in BOOLEAN_COLUMNS:
+        if col.startswith('STR_'):
+            struck = rng.random(n) < STRIKE_RATE
+            damage = struck & (rng.random(n) < DAMAGE_GIVEN_STRIKE_RATE)
+            columns[col] = struck.astype(np.int64)
+            columns['DAM_' + col[len('STR_'):]] = damage.astype(np.int64)
+            damaged |= damage
+    columns['INDICATED_DAMAGE'] = damaged.astype(np.int64)
+
+    # only the columns the preprocessing strips, AC_MASS is read as a number
+    for col in TEXT_FIELDS_TO_STRIP:
+        if col in ('AC_MASS', 'INCIDENT_DATE', 'TIME'):
+            continue
+        columns[col] = messy(rng, columns[col])
+    order = CONTINUOUS_COLUMNS + NOMINAL_COLUMNS + ORDINAL_COLUMNS + TEXT_COLUMNS + BOOLEAN_COLUMNS + DATETIME_COLUMNS
+    return pd.DataFrame({col: columns[col] for col in dict.fromkeys(order)})
+
+
+def write_synthetic(path, rows, seed=0, chunksize=DEFAULT_CHUNKSIZE):
+    # rows synthetic records as a csv export, written chunk by chunk
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+    for first in range(0, rows, chunksize):
+        chunk = generate_chunk(min(chunksize, rows - first), seed, first)
+        chunk.to_csv(tmp_path, mode='w' if first == 0 else 'a', header=first == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def synthetic_path(output_dir, scale):
+    return os.path.join(output_dir, 'main_data_x{}.csv'.format(scale))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes synthetic FAA wildlife strike exports.')
+    parser.add_argument('--scale', type=int, nargs='*', default=list(SCALES), help='multiples of the real row count')
+    parser.add_argument('--rows', type=int, default=REAL_ROWS, help='rows at scale 1')
+    parser.add_argument('--output-dir', default='data/synthetic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+    for scale in args.scale:
+        path = write_synthetic(synthetic_path(args.output_dir, scale), args.rows * scale, args.seed, args.chunksize)
+        print('wrote {} rows to {}'.format(args.rows * scale, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules of the application sit at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import load_columns, write_artifact  # noqa: E402
+from etl import run_etl  # noqa: E402
+from synthetic_data import write_synthetic  # noqa: E402
+
+
+SYNTHETIC_ROWS = 20000
+# filter states the precomputed results are checked on: the default view, every year,
+# a single year and time of day, no filter at all and an empty time of day selection
+FILTER_STATES = [
+    ((2000, 2010), ['Day', 'Night', 'Dusk', 'Dawn']),
+    ((1990, 2022), ['Day', 'Night']),
+    ((2005, 2005), ['Night']),
+    (None, None),
+    ((1990, 2022), []),
+]
+
+
+@pytest.fixture(scope='session')
+def artifact(tmp_path_factory):
+    # a synthetic export run through the etl, shared by every test
+    directory = tmp_path_factory.mktemp('data')
+    source = write_synthetic(str(directory / 'main_data.csv'), SYNTHETIC_ROWS, seed=0)
+    path = str(directory / 'main_data.feather')
+    run_etl(source, path, workers=1)
+    return path
+
+
+@pytest.fixture(scope='session')
+def rows(artifact):
+    return load_columns(None, artifact)[0]
+
+
+@pytest.fixture
+def nullable_artifact(rows, tmp_path):
+    # the synthetic artifact with nullable flag columns, like the schema gives the 0/1
+    # columns with missing values
+    df = rows.copy()
+    missing = np.arange(len(df)) % 7 == 0
+    df['STR_RAD'] = df['STR_RAD'].astype('Int8').mask(missing)
+    df['DAM_RAD'] = df['DAM_RAD'].astype('Int8')
+    df['WARNED_FLAG'] = pd.array(np.where(missing, None, df['STR_NOSE'] == 1), dtype='boolean')
+    return write_artifact(df, str(tmp_path / 'main_data.feather'))
+
+
+@pytest.fixture(params=FILTER_STATES, ids=lambda state: '{}-{}'.format(*state))
+def filters(request):
+    return request.param
+
+
+@pytest.fixture
+def selection(rows, filters):
+    # the rows of the filter state as a plain boolean mask, what the precomputed results replace
+    year_range, times_of_day = filters
+    mask = pd.Series(True, index=rows.index)
+    if year_range is not None:
+        years = rows['INCIDENT_YEAR'].dt.year
+        mask &= (years >= year_range[0]) & (years <= year_range[1])
+    if times_of_day is not None:
+        mask &= rows['TIME_OF_DAY'].isin(times_of_day)
+    return mask.to_numpy()
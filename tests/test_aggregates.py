@@ -0,0 +1,78 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+import aggregates
+from aggregates import AGGREGATE_SPECS, CUBE_KEYS, build_cube, compute_cube, cube_cells, load_cube, read_cube, rollup
+from data_loader import aggregates_dir, write_artifact
+
+
+def plain_keys(frame, columns):
+    # the group values as strings with a marker for the missing ones, comparable whatever the dtype
+    keys = frame[columns].astype(object)
+    return keys.where(keys.notna(), '<missing>').astype(str)
+
+
+def plain_groupby(rows, columns, sum_columns):
+    # counts (and sums) with a plain groupby of the rows, missing values are a group too
+    frame = rows[columns + sum_columns].assign(INCIDENT_YEAR=rows['INCIDENT_YEAR'].dt.year)
+    grouped = frame.groupby([plain_keys(frame, [col])[col] for col in columns], dropna=False)
+    result = grouped.size().to_frame('counts')
+    for col in sum_columns:
+        result[col] = grouped[col].sum()
+    return result.sort_index()
+
+
+def by_keys(aggregate, columns, sum_columns):
+    result = aggregate[['counts'] + sum_columns].set_index(pd.MultiIndex.from_frame(plain_keys(aggregate, columns)))
+    return result.sort_index()
+
+
+@pytest.mark.parametrize('name', list(AGGREGATE_SPECS))
+def test_cube_gives_the_groupby_counts_of_the_rows(artifact, rows, name):
+    group_columns, sum_columns = AGGREGATE_SPECS[name]
+    expected = plain_groupby(rows, group_columns, sum_columns)
+    pd.testing.assert_frame_equal(
+        by_keys(load_cube(artifact)[name], group_columns, sum_columns), expected, check_exact=True, check_names=False
+    )
+
+
+@pytest.mark.parametrize('name', list(AGGREGATE_SPECS))
+def test_cells_of_a_filter_state_give_the_groupby_counts_of_its_rows(artifact, rows, filters, selection, name):
+    group_columns, sum_columns = AGGREGATE_SPECS[name]
+    by = [col for col in group_columns if col not in CUBE_KEYS]
+    cells = cube_cells(*filters, artifact)[name]
+    expected = plain_groupby(rows[selection], by, sum_columns)
+    result = by_keys(rollup(cells, by, sum_columns, dropna=False), by, sum_columns)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True, check_names=False)
+
+
+@pytest.fixture
+def rewritten_artifact(rows, artifact, tmp_path):
+    # the same rows written as another version of the artifact, next to the aggregates
+    # stored for the session artifact
+    path = write_artifact(rows, str(tmp_path / 'main_data.feather'))
+    shutil.copytree(aggregates_dir(artifact), aggregates_dir(path))
+    return path
+
+
+def test_stored_cube_is_the_cube_of_the_rows(artifact):
+    stored, computed = read_cube(artifact), compute_cube(artifact)
+    assert list(stored) == list(AGGREGATE_SPECS)
+    for name in AGGREGATE_SPECS:
+        pd.testing.assert_frame_equal(stored[name], computed[name], check_exact=True)
+
+
+def test_cube_is_read_without_the_rows(artifact, monkeypatch):
+    def compute(path):
+        raise AssertionError('the cube was computed from the rows')
+    monkeypatch.setattr(aggregates, 'compute_cube', compute)
+    assert list(build_cube(artifact)) == list(AGGREGATE_SPECS)
+
+
+def test_cube_of_another_artifact_version_is_stale(rewritten_artifact):
+    assert read_cube(rewritten_artifact) is None
+    cube, computed = build_cube(rewritten_artifact), compute_cube(rewritten_artifact)
+    for name in AGGREGATE_SPECS:
+        pd.testing.assert_frame_equal(cube[name], computed[name])
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from api import create_app
+from query import ANALYSES, dashboard_result
+
+
+@pytest.fixture(scope='module')
+def client(artifact):
+    return create_app(artifact, 'pandas').test_client()
+
+
+def query_string(year_range, times_of_day):
+    parameters = []
+    if year_range is not None:
+        parameters += [('year_from', year_range[0]), ('year_to', year_range[1])]
+    return parameters + [('time_of_day', value) for value in times_of_day or []]
+
+
+@pytest.mark.parametrize('name', list(ANALYSES))
+def test_responses_give_the_numbers_of_the_dashboard(client, artifact, filters, name):
+    year_range, times_of_day = filters
+    if times_of_day == []:
+        # an empty time of day selection can not be sent, no time_of_day means all of them
+        pytest.skip('not expressible in the query string')
+    response = client.get('/api/{}'.format(name), query_string=query_string(year_range, times_of_day))
+    assert response.status_code == 200
+    body = response.get_json()
+    expected = dashboard_result(name, year_range, times_of_day, artifact)
+    assert body['columns'] == list(expected.columns)
+    result = pd.DataFrame(body['data'], columns=body['columns']).astype(expected.dtypes.to_dict())
+    for col in expected.columns[expected.dtypes == object]:
+        result[col] = result[col].astype(object).where(result[col].notna(), None)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+
+def test_unchanged_responses_are_revalidated(client):
+    response = client.get('/api/strikes_per_year', query_string=[('year_from', 2000), ('year_to', 2010)])
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    revalidated = client.get(
+        '/api/strikes_per_year', query_string=[('year_from', 2000), ('year_to', 2010)],
+        headers={'If-None-Match': etag},
+    )
+    assert revalidated.status_code == 304
+    assert client.get('/api/strikes_per_year', headers={'If-Modified-Since': last_modified}).status_code == 304
+    # another filter state is another resource
+    other = client.get('/api/strikes_per_year', query_string=[('year_from', 2001), ('year_to', 2010)])
+    assert other.headers['ETag'] != etag
+
+
+def test_bad_requests(client):
+    assert client.get('/api/unknown').status_code == 404
+    assert client.get('/api/strikes_per_year', query_string=[('year_from', 2000)]).status_code == 400
+    assert client.get('/api/strikes_per_year', query_string=[('year_from', 'x'), ('year_to', 2010)]).status_code == 400
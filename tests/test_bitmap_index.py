@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from bitmap_index import (
+    NOT_NULL_COLUMNS, VALUE_COLUMNS, bitmap_count, bitmap_rows, filter_bitmap, isin_bitmap, load_bitmap_index,
+    not_null_bitmap,
+)
+
+
+def test_filter_gives_the_rows_of_the_boolean_mask(artifact, filters, selection):
+    index = load_bitmap_index(artifact)
+    bitmap = filter_bitmap(index, *filters)
+    np.testing.assert_array_equal(bitmap_rows(index, bitmap), np.flatnonzero(selection))
+    assert bitmap_count(bitmap) == selection.sum()
+
+
+@pytest.mark.parametrize('complete', [[col] for col in NOT_NULL_COLUMNS] + [['PHASE_OF_FLIGHT', 'NUM_STRUCK', 'DAMAGE_LEVEL']])
+def test_not_null_gives_the_rows_dropna_keeps(artifact, rows, filters, selection, complete):
+    index = load_bitmap_index(artifact)
+    rows_kept = bitmap_rows(index, filter_bitmap(index, *filters) & not_null_bitmap(index, complete))
+    expected = rows[selection].dropna(subset=complete).index.to_numpy()
+    np.testing.assert_array_equal(rows_kept, expected)
+
+
+@pytest.mark.parametrize('column', [col for col in VALUE_COLUMNS if col != 'INCIDENT_YEAR'])
+def test_isin_gives_the_rows_of_isin(artifact, rows, column):
+    index = load_bitmap_index(artifact)
+    values = list(rows[column].dropna().unique()[:2])
+    expected = np.flatnonzero(rows[column].isin(values).to_numpy())
+    np.testing.assert_array_equal(bitmap_rows(index, isin_bitmap(index, column, values)), expected)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import cube_cells
+from chart_data import BOX_CHARTS, BOXPLOT_EXTENT, box_stats
+
+
+def plain_box_stats(rows, by, value):
+    # quartiles with Series.quantile and whiskers, counts and outliers from the rows of every group
+    rows = rows.dropna(subset=list(by) + [value])
+    summaries = []
+    for key, group in rows.groupby(by[0] if len(by) == 1 else list(by), observed=True):
+        values = group[value].astype(np.float64)
+        lower_box, mid_box, upper_box = (values.quantile(q) for q in (0.25, 0.5, 0.75))
+        iqr = upper_box - lower_box
+        inside = values.between(lower_box - BOXPLOT_EXTENT * iqr, upper_box + BOXPLOT_EXTENT * iqr)
+        summaries.append(dict(
+            zip(by, key if isinstance(key, tuple) else (key,)),
+            lower_whisker=values[inside].min(), lower_box=lower_box, mid_box=mid_box, upper_box=upper_box,
+            upper_whisker=values[inside].max(), count=len(values), outliers=sorted(values[~inside]),
+        ))
+    return pd.DataFrame(summaries, columns=list(by) + [
+        'lower_whisker', 'lower_box', 'mid_box', 'upper_box', 'upper_whisker', 'count', 'outliers',
+    ])
+
+
+@pytest.mark.parametrize('name', list(BOX_CHARTS))
+def test_box_stats_give_the_quantiles_of_the_rows(artifact, rows, filters, selection, name):
+    cuboid, by, value = BOX_CHARTS[name]
+    summary, outliers = box_stats(cube_cells(*filters, artifact)[cuboid], by, value)
+    expected = plain_box_stats(rows[selection], by, value)
+
+    # the groups in the same order on both sides, the chart does not depend on it
+    result = summary.astype({col: str for col in by}).astype({'count': np.int64}).sort_values(by, ignore_index=True)
+    expected = expected.astype({col: str for col in by}).astype({'count': np.int64}).sort_values(by, ignore_index=True)
+    columns = list(by) + ['lower_whisker', 'lower_box', 'mid_box', 'upper_box', 'upper_whisker', 'count']
+    pd.testing.assert_frame_equal(result[columns], expected[columns], check_exact=True)
+    # the outliers of every group, one per outlying row
+    outliers = outliers.astype({col: str for col in by})
+    for (_, row), expected_outliers in zip(result.iterrows(), expected['outliers']):
+        mask = np.logical_and.reduce([outliers[col] == row[col] for col in by])
+        assert sorted(outliers.loc[mask, value].astype(np.float64)) == expected_outliers
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+import correlation
+from correlation import (
+    build_correlation_statistics, compute_correlation_statistics, correlation_matrix, load_correlation_statistics,
+    read_correlation_statistics,
+)
+from data_loader import load_columns
+
+
+def test_correlation_from_statistics_gives_dataframe_corr(artifact, rows, filters, selection):
+    engine = load_correlation_statistics(artifact)
+    columns = engine['columns']
+    assert columns
+    result = correlation_matrix(engine, columns, *filters)
+    expected = rows.loc[selection, columns].astype(np.float64).corr()
+    # the same pairs are undefined (no variation) on both sides, the others only differ by
+    # the rounding of the sums the statistics add up
+    pd.testing.assert_frame_equal(result.isna(), expected.isna())
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9, atol=1e-12)
+
+
+def test_pairs_are_correlated_over_the_rows_where_both_are_present(nullable_artifact):
+    engine = load_correlation_statistics(nullable_artifact)
+    columns = ['STR_RAD', 'DAM_RAD', 'STR_NOSE', 'DAM_NOSE']
+    rows = load_columns(columns, nullable_artifact)[0]
+    assert rows['STR_RAD'].isna().any()
+    expected = rows.astype(np.float64).corr()
+    pd.testing.assert_frame_equal(
+        correlation_matrix(engine, columns), expected, check_exact=False, rtol=1e-9, atol=1e-12
+    )
+
+
+def assert_same_statistics(result, expected):
+    assert result['columns'] == expected['columns']
+    pd.testing.assert_frame_equal(result['cells'], expected['cells'])
+    for name, matrices in expected['statistics'].items():
+        np.testing.assert_allclose(result['statistics'][name], matrices, rtol=1e-12)
+
+
+def test_stored_statistics_are_the_statistics_of_the_rows(artifact, monkeypatch):
+    expected = compute_correlation_statistics(artifact)
+
+    def compute(path):
+        raise AssertionError('the statistics were computed from the rows')
+    monkeypatch.setattr(correlation, 'compute_correlation_statistics', compute)
+    assert_same_statistics(read_correlation_statistics(artifact), expected)
+    assert_same_statistics(build_correlation_statistics(artifact), expected)
+
+
+def test_statistics_are_computed_without_stored_ones(nullable_artifact):
+    assert read_correlation_statistics(nullable_artifact) is None
+    assert_same_statistics(build_correlation_statistics(nullable_artifact), compute_correlation_statistics(nullable_artifact))
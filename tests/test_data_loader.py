@@ -0,0 +1,57 @@
+import os
+
+import pandas as pd
+import pytest
+
+import data_loader
+from data_loader import clear_column_cache, load_columns, load_rows, sample_rows
+
+
+def load_both(path, monkeypatch):
+    clear_column_cache()
+    plain, _ = load_columns(None, path)
+    clear_column_cache()
+    monkeypatch.setattr(data_loader, 'SHARED_DATASET', True)
+    shared, _ = load_columns(None, path)
+    clear_column_cache()
+    return plain, shared
+
+
+@pytest.mark.parametrize('which', ['artifact', 'nullable_artifact'])
+def test_shared_copy_gives_the_frames_of_the_artifact(which, request, monkeypatch):
+    plain, shared = load_both(request.getfixturevalue(which), monkeypatch)
+    assert shared.dtypes.to_dict() == plain.dtypes.to_dict()
+    assert shared.equals(plain)
+    assert shared.memory_usage(deep=True).sum() == plain.memory_usage(deep=True).sum()
+
+
+def test_shared_copy_is_written_without_fcntl(artifact, rows, monkeypatch):
+    # windows has no fcntl, the copy is written without the lock of the host
+    monkeypatch.setattr(data_loader, 'fcntl', None)
+    for suffix in ('', '.lock'):
+        path = data_loader.shared_path(artifact) + suffix
+        if os.path.exists(path):
+            os.remove(path)
+    plain, shared = load_both(artifact, monkeypatch)
+    assert shared.equals(plain)
+
+
+def test_nullable_columns_keep_their_missing_values(nullable_artifact, monkeypatch):
+    plain, shared = load_both(nullable_artifact, monkeypatch)
+    assert str(shared['STR_RAD'].dtype) == 'Int8'
+    assert shared['STR_RAD'].isna().sum() == plain['STR_RAD'].isna().sum() > 0
+    assert str(shared['WARNED_FLAG'].dtype) == 'boolean'
+
+
+def test_load_rows_gives_the_rows_of_the_frame(artifact, rows):
+    positions = [5, 0, 19999, 123]
+    pd.testing.assert_frame_equal(load_rows(positions, path=artifact), rows.iloc[positions])
+    pd.testing.assert_frame_equal(
+        load_rows(positions, ['AIRPORT', 'SPEED'], artifact), rows.iloc[positions][['AIRPORT', 'SPEED']]
+    )
+
+
+def test_sample_rows_gives_distinct_rows_of_the_frame(artifact, rows):
+    sample = sample_rows(10, path=artifact, seed=0)
+    assert len(sample) == 10 and sample.index.is_unique
+    pd.testing.assert_frame_equal(sample, rows.loc[sample.index])
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import pytest
+
+from aggregates import AGGREGATE_SPECS, read_cube
+from correlation import read_correlation_statistics
+from data_loader import load_columns
+from etl import run_etl, run_incremental, run_streaming
+from missingness import read_missingness
+from synthetic_data import generate_chunk
+
+
+def read_report(artifact):
+    with open(os.path.join(os.path.dirname(artifact), 'validation_report.json')) as f:
+        return json.load(f)
+
+
+def test_report_has_the_memory_of_every_column_before_and_after_the_schema(artifact):
+    memory = read_report(artifact)['memory_bytes']
+    rows = load_columns(None, artifact)[0]
+    assert set(memory) == set(rows.columns) | {'TOTAL'}
+    assert memory['TOTAL']['bytes_after'] == rows.memory_usage(index=False, deep=True).sum()
+    assert memory['TOTAL']['bytes_after'] < memory['TOTAL']['bytes_before']
+    assert memory['AIRPORT']['dtype_before'] == 'object' and memory['AIRPORT']['dtype_after'] == 'category'
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    # an export and the next release of it: a few records changed in place (one of them
+    # moved to another year, one at a new airport) and new records appended
+    directory = tmp_path_factory.mktemp('exports')
+    old = generate_chunk(4000, seed=5)
+    new = old.copy()
+    changed = np.arange(0, 4000, 131)
+    new.loc[changed, 'SPEED'] = new.loc[changed, 'SPEED'].fillna(0) + 7
+    new.loc[changed[0], 'INCIDENT_YEAR'] = 1990 if new.loc[changed[0], 'INCIDENT_YEAR'] != 1990 else 2022
+    new.loc[changed[1], 'AIRPORT'] = 'AIRPORT NEW'
+    new = pd.concat([new, generate_chunk(500, seed=5, first_index=4000)], ignore_index=True)
+    paths = {'old': str(directory / 'old.csv'), 'new': str(directory / 'new.csv')}
+    old.to_csv(paths['old'], index=False)
+    new.to_csv(paths['new'], index=False)
+    return paths, len(changed)
+
+
+def assert_same_outputs(path, expected_path):
+    # the artifact and everything stored next to it
+    pd.testing.assert_frame_equal(feather.read_feather(path), feather.read_feather(expected_path))
+    cube, expected_cube = read_cube(path), read_cube(expected_path)
+    for name in AGGREGATE_SPECS:
+        pd.testing.assert_frame_equal(cube[name], expected_cube[name], check_exact=True)
+    statistics, expected_statistics = read_correlation_statistics(path), read_correlation_statistics(expected_path)
+    assert statistics['columns'] == expected_statistics['columns']
+    pd.testing.assert_frame_equal(statistics['cells'], expected_statistics['cells'])
+    for name, matrices in expected_statistics['statistics'].items():
+        np.testing.assert_allclose(statistics['statistics'][name], matrices, rtol=1e-12)
+    missing, expected_missing = read_missingness(path), read_missingness(expected_path)
+    for key, value in expected_missing.items():
+        np.testing.assert_array_equal(missing[key], value)
+
+
+def test_incremental_ingest_gives_the_outputs_of_a_full_run(exports, tmp_path):
+    paths, changed = exports
+    incremental = str(tmp_path / 'incremental' / 'main_data.feather')
+    full = str(tmp_path / 'full' / 'main_data.feather')
+    run_etl(paths['old'], incremental, workers=1)
+    report = run_incremental(paths['new'], incremental, workers=1)
+    run_etl(paths['new'], full, workers=1)
+
+    assert report['ingest']['mode'] == 'incremental'
+    assert (report['ingest']['inserted'], report['ingest']['updated'], report['ingest']['unchanged']) == (
+        500, changed, 4000 - changed
+    )
+    assert_same_outputs(incremental, full)
+    # an export without changes only has unchanged records and keeps the outputs
+    report = run_incremental(paths['new'], incremental, workers=1)
+    assert (report['ingest']['inserted'], report['ingest']['updated'], report['ingest']['unchanged']) == (0, 0, 4500)
+    assert_same_outputs(incremental, full)
+
+
+def test_streaming_gives_the_outputs_of_a_full_run(exports, tmp_path):
+    paths, _ = exports
+    # the artifact directories do not exist yet
+    streamed = str(tmp_path / 'streamed' / 'main_data.feather')
+    full = str(tmp_path / 'full' / 'main_data.feather')
+    report = run_streaming(paths['new'], streamed, chunksize=700)
+    expected = run_etl(paths['new'], full, workers=1)
+    assert_same_outputs(streamed, full)
+    for key in ['rows_output', 'rows_per_partition', 'unknown_labels', 'dtypes']:
+        assert report[key] == expected[key]
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+import missingness
+from data_loader import load_columns
+from missingness import (
+    add_statistics, build_missingness, co_missing_table, missingness_statistics, null_rate_per_year_table,
+    read_missingness,
+)
+
+
+def assert_summary_of_the_rows(summary, rows):
+    # against isna of every row
+    missing = rows.isna()
+    assert summary['rows'] == len(rows)
+    pd.testing.assert_series_equal(summary['null_counts'], missing.sum(), check_dtype=False)
+    pd.testing.assert_series_equal(summary['null_rate'], missing.mean(), check_dtype=False)
+    per_year = missing.groupby(rows['INCIDENT_YEAR'].dt.year.rename('INCIDENT_YEAR')).mean()
+    pd.testing.assert_frame_equal(summary['null_rate_per_year'], per_year, check_dtype=False, check_index_type=False)
+    as_ints = missing.to_numpy(dtype=np.int64)
+    expected = pd.DataFrame(as_ints.T @ as_ints, index=rows.columns, columns=rows.columns)
+    pd.testing.assert_frame_equal(summary['co_missing'], expected)
+
+
+def test_stored_summary_gives_the_missing_values_of_the_rows(artifact, rows, monkeypatch):
+    def compute(path):
+        raise AssertionError('the missing values were counted on the rows')
+    monkeypatch.setattr(missingness, 'compute_missingness', compute)
+    assert read_missingness(artifact) is not None
+    summary = build_missingness(artifact)
+    assert_summary_of_the_rows(summary, rows)
+    # the tables of the charts only have the columns with missing values
+    with_nulls = set(summary['null_counts'][summary['null_counts'] > 0].index)
+    assert set(null_rate_per_year_table(summary)['column']) == with_nulls
+    assert set(co_missing_table(summary)['column']) == with_nulls
+
+
+def test_summary_is_computed_without_stored_statistics(nullable_artifact):
+    assert read_missingness(nullable_artifact) is None
+    assert_summary_of_the_rows(build_missingness(nullable_artifact), load_columns(None, nullable_artifact)[0])
+
+
+def test_statistics_of_two_sets_of_rows_add_up(rows):
+    half = len(rows) // 3
+    combined = add_statistics(missingness_statistics(rows.iloc[:half]), missingness_statistics(rows.iloc[half:]))
+    expected = missingness_statistics(rows)
+    for key in ['years', 'rows', 'null_counts', 'co_missing']:
+        np.testing.assert_array_equal(combined[key], expected[key])
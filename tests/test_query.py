@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from query import ANALYSES, dashboard_result, run_analysis, run_query
+
+
+@pytest.mark.parametrize('name', list(ANALYSES))
+def test_pandas_backend_gives_the_numbers_of_the_dashboard(artifact, filters, name):
+    year_range, times_of_day = filters
+    pd.testing.assert_frame_equal(
+        run_analysis(name, year_range, times_of_day, 'pandas', artifact),
+        dashboard_result(name, year_range, times_of_day, artifact),
+        check_exact=True,
+    )
+
+
+@pytest.mark.parametrize('name', list(ANALYSES))
+def test_duckdb_backend_gives_the_results_of_the_pandas_backend(artifact, filters, name):
+    pytest.importorskip('duckdb')
+    year_range, times_of_day = filters
+    pd.testing.assert_frame_equal(
+        run_analysis(name, year_range, times_of_day, 'duckdb', artifact),
+        run_analysis(name, year_range, times_of_day, 'pandas', artifact),
+        check_exact=True,
+    )
+
+
+def test_ties_at_the_cut_off_are_broken_by_first_occurrence(artifact):
+    everything = run_query(dict(ANALYSES['top_airports_by_strikes'], limit=None), path=artifact)
+    # airports with as many strikes as the 100th one are left out of the top 100
+    assert (everything['counts'].iloc[100:] == everything['counts'].iloc[99]).any()
+    pd.testing.assert_frame_equal(
+        run_analysis('top_airports_by_strikes', path=artifact),
+        dashboard_result('top_airports_by_strikes', path=artifact),
+        check_exact=True,
+    )
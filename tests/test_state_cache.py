@@ -0,0 +1,75 @@
+import altair as alt
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import load_cube, strikes_per_year
+from chart_data import chart_box_stats
+from defaults import DEFAULT_CORRELATION_COLUMNS
+from missingness import load_missingness, null_rate_per_year_table
+from state_cache import chart_json
+from utilities import (
+    altair_boxplot_from_stats, altair_jointplot_speed_and_height, altair_missingness_heatmap, altair_null_rates,
+    get_correlation_graph,
+)
+
+
+def frame(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'SPEED': rng.uniform(0, 300, size=n),
+        'DAMAGE_LEVEL': pd.Categorical(rng.choice(['None', 'Minor', 'Destroyed'], size=n)),
+        'INCIDENT_DATE': pd.date_range('1990-01-01', periods=n, freq='D'),
+    })
+
+
+@pytest.fixture(scope='module')
+def charts(artifact, rows):
+    # more rows than the row limit of the default data transformer in every kind of chart,
+    # with and without the types in the shorthands, and the charts of the application
+    big, small = frame(6000, 0), frame(50, 1)
+    bars = alt.Chart(big).mark_bar().encode(x='DAMAGE_LEVEL', y='count()', tooltip=['DAMAGE_LEVEL', 'mean(SPEED)'])
+    points = alt.Chart(small).mark_point().encode(x='INCIDENT_DATE', y='SPEED:Q')
+    cube = load_cube(artifact)
+    return {
+        'chart': bars,
+        'layer': bars + alt.Chart(big).mark_rule().encode(y='mean(SPEED)'),
+        'concat': alt.vconcat(bars, alt.hconcat(points, bars)),
+        'facet': alt.Chart(big).mark_bar().encode(x='DAMAGE_LEVEL:N', y='count()').facet(column='DAMAGE_LEVEL'),
+        'layer data': alt.layer(alt.Chart().mark_bar().encode(x='DAMAGE_LEVEL', y='count()'), data=big),
+        'strikes per year': alt.Chart(strikes_per_year(cube['size'])).mark_line().encode(
+            alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')), alt.Y('counts'),
+        ),
+        'jointplot': altair_jointplot_speed_and_height(rows, 'DAMAGE_LEVEL', mode='points'),
+        'boxplot': altair_boxplot_from_stats(chart_box_stats('chart_15', cube['speed_by_precipitation']), 'PRECIPITATION', 'SPEED', column='NUM_ENGS:Q'),
+        'null rates': altair_null_rates(load_missingness(artifact)['null_rate']),
+        'missingness heatmap': altair_missingness_heatmap(
+            null_rate_per_year_table(load_missingness(artifact)), 'INCIDENT_YEAR', 'column', 'null_rate'
+        ),
+        'correlation': get_correlation_graph(rows, DEFAULT_CORRELATION_COLUMNS),
+    }
+
+
+CHARTS = [
+    'chart', 'layer', 'concat', 'facet', 'layer data', 'strikes per year', 'jointplot', 'boxplot', 'null rates',
+    'missingness heatmap', 'correlation',
+]
+
+
+@pytest.mark.parametrize('name', CHARTS)
+def test_chart_json_inlines_every_row_without_the_global_transformer(charts, name):
+    chart = charts[name]
+    transformer = alt.data_transformers.active, dict(alt.data_transformers.options)
+    with alt.data_transformers.disable_max_rows():
+        expected = chart.to_json(indent=None)
+    assert chart_json(chart) == expected
+    # the transformer of the process is left as it was and so is the chart
+    assert (alt.data_transformers.active, dict(alt.data_transformers.options)) == transformer
+    with alt.data_transformers.disable_max_rows():
+        assert chart.to_json(indent=None) == expected
+
+
+def test_chart_json_keeps_the_row_limit_of_the_other_serializations(charts):
+    chart_json(charts['chart'])
+    with pytest.raises(alt.MaxRowsError):
+        charts['chart'].to_json()
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from defaults import SPEED_COLUMNS
+from utilities import (
+    HEIGHT_DOMAIN, JOINTPLOT_MODES, PYTHON_WHITESPACE, REMAPPING_REGISTRY, SPEED_DOMAIN, TEXT_FIELDS_TO_STRIP,
+    UNKNOWN_LABEL_POLICIES, allocate_budget, altair_jointplot_speed_and_height, density_table, histogram_table,
+    preprocess_text_fields, remap_column, remapping_function, stratified_sample, text_preprocess_helper_func,
+    vega_bin_edges,
+)
+
+
+# raw values of the text columns: clean, padded with ascii and non ascii whitespace, empty,
+# whitespace only and missing
+RAW_LABELS = ['Day', ' Night', 'Dusk  ', '\tDawn\n', '\xa0KJFK\u3000', '', ' ', '\x1c', '\x85\x85', 'K J F K', None, np.nan]
+
+
+def baseline_preprocess_text_fields(df):
+    # the per cell implementation preprocess_text_fields replaced
+    for col in TEXT_FIELDS_TO_STRIP:
+        df[col] = df[col].apply(text_preprocess_helper_func)
+    for col in TEXT_FIELDS_TO_STRIP:
+        df.loc[df[col] == '', col] = np.nan
+    return df
+
+
+@pytest.fixture
+def raw():
+    rng = np.random.default_rng(1)
+    labels = np.array(RAW_LABELS, dtype=object)
+    df = pd.DataFrame({col: labels[rng.integers(len(labels), size=2000)] for col in TEXT_FIELDS_TO_STRIP})
+    df['SPEED'] = rng.uniform(0, 300, size=len(df))
+    df['INDX_NR'] = np.arange(len(df))
+    # all missing, one of them as floats like read_csv gives an empty column
+    df['LOCATION'] = np.nan
+    df['EFFECT_OTHER'] = pd.Series([None] * len(df), dtype=object)
+    # numbers in columns which are stripped as text
+    df['NUM_SEEN'] = np.where(np.arange(len(df)) % 3, 2.0, np.nan)
+    df['FLT'] = np.arange(len(df))
+    return df
+
+
+def test_every_python_whitespace_character_is_trimmed():
+    assert set(PYTHON_WHITESPACE) == {chr(c) for c in range(0x110000) if chr(c).isspace()}
+
+
+def test_preprocess_text_fields_matches_the_per_cell_implementation(raw):
+    expected = baseline_preprocess_text_fields(raw.copy())
+    result = preprocess_text_fields(raw.copy())
+    pd.testing.assert_frame_equal(result, expected)
+    # the columns which are not text are left as they are
+    untouched = [col for col in raw.columns if col not in TEXT_FIELDS_TO_STRIP]
+    pd.testing.assert_frame_equal(result[untouched], raw[untouched])
+
+
+@pytest.fixture
+def labels():
+    # known raw labels of every remapped column, one label the registry does not know (twice)
+    # and missing values
+    return pd.DataFrame({
+        col: list(mapping)[:3] + ['NOT_A_LABEL', 'NOT_A_LABEL', np.nan]
+        for col, mapping in REMAPPING_REGISTRY.items()
+    })
+
+
+def expected_labels(series, mapping, unknown_policy):
+    # the remapping label by label
+    unknown = np.nan if unknown_policy != 'keep' else 'NOT_A_LABEL'
+    return [mapping.get(x, unknown) if x == x else np.nan for x in series]
+
+
+@pytest.mark.parametrize('unknown_policy', UNKNOWN_LABEL_POLICIES)
+@pytest.mark.parametrize('column', list(REMAPPING_REGISTRY))
+def test_remap_column_handles_unknown_labels_as_per_the_policy(labels, column, unknown_policy):
+    mapping = REMAPPING_REGISTRY[column]
+    remapped, unknown_counts = remap_column(labels[column], mapping, unknown_policy=unknown_policy)
+    assert isinstance(remapped.dtype, pd.CategoricalDtype)
+    expected = pd.Series(expected_labels(labels[column], mapping, unknown_policy), dtype=object)
+    pd.testing.assert_series_equal(remapped.astype(object), expected, check_names=False)
+    # the unknown labels are counted whatever the policy
+    assert unknown_counts == {'NOT_A_LABEL': 2}
+
+
+def test_remap_column_rejects_an_unknown_policy(labels):
+    with pytest.raises(ValueError):
+        remap_column(labels['WARNED'], REMAPPING_REGISTRY['WARNED'], unknown_policy='drop')
+
+
+@pytest.mark.parametrize('unknown_policy', UNKNOWN_LABEL_POLICIES)
+def test_unknown_report_counts_the_unknown_labels_of_every_column(labels, unknown_policy):
+    unknown_report = {}
+    result = remapping_function(labels, unknown_policy=unknown_policy, unknown_report=unknown_report)
+    assert unknown_report == {col: {'NOT_A_LABEL': 2} for col in REMAPPING_REGISTRY}
+    for col, mapping in REMAPPING_REGISTRY.items():
+        expected = pd.Series(expected_labels(labels[col], mapping, unknown_policy), dtype=object)
+        pd.testing.assert_series_equal(result[col].astype(object), expected, check_names=False)
+
+
+def test_report_policy_requires_a_report(labels):
+    with pytest.raises(ValueError):
+        remapping_function(labels, unknown_policy='report')
+
+
+@pytest.fixture(scope='module')
+def speed(rows):
+    # the jointplot columns, a few values outside the domains of the axes
+    df = rows[SPEED_COLUMNS].copy()
+    df.loc[df.index[:5], 'SPEED'] = [-10, 400, 1000, 341, 0]
+    df.loc[df.index[5:10], 'HEIGHT'] = [-1, 16501, 30000, 20000, 16500]
+    return df
+
+
+def present_counts(df, color_column, columns):
+    # rows with a color and all the given columns, per color category
+    complete = df.dropna(subset=[color_column] + columns)
+    return complete.groupby(color_column, observed=True).size().sort_index()
+
+
+@pytest.mark.parametrize('color_column', ['DAMAGE_LEVEL', 'WARNED'])
+@pytest.mark.parametrize('field, domain', [('SPEED', SPEED_DOMAIN), ('HEIGHT', HEIGHT_DOMAIN)])
+def test_histogram_counts_every_value(speed, color_column, field, domain):
+    table = histogram_table(speed, field, color_column, vega_bin_edges(domain, 20))
+    counts = table.groupby(color_column, observed=True)['counts'].sum().sort_index()
+    pd.testing.assert_series_equal(counts, present_counts(speed, color_column, [field]), check_names=False)
+
+
+@pytest.mark.parametrize('color_column', ['DAMAGE_LEVEL', 'WARNED'])
+def test_density_counts_every_value(speed, color_column):
+    table = density_table(speed, color_column)
+    counts = table.groupby(color_column, observed=True)['counts'].sum().sort_index()
+    pd.testing.assert_series_equal(counts, present_counts(speed, color_column, ['SPEED', 'HEIGHT']), check_names=False)
+
+
+def test_histogram_counts_only_the_given_rows(speed):
+    rows = np.arange(0, len(speed), 3)
+    edges = vega_bin_edges(SPEED_DOMAIN, 20)
+    pd.testing.assert_frame_equal(
+        histogram_table(speed, 'SPEED', 'DAMAGE_LEVEL', edges, rows).reset_index(drop=True),
+        histogram_table(speed.iloc[rows], 'SPEED', 'DAMAGE_LEVEL', edges).reset_index(drop=True),
+    )
+
+
+@pytest.mark.parametrize('sizes, budget', [
+    ([5, 1000, 20, 3000], 100), ([5, 10], 100), ([50, 50, 50], 100), ([0, 7, 1], 4),
+])
+def test_budget_is_shared_out_without_exceeding_it(sizes, budget):
+    sizes = np.array(sizes)
+    quotas = allocate_budget(sizes, budget)
+    assert quotas.sum() == min(budget, sizes.sum())
+    assert (quotas <= sizes).all()
+    # a category smaller than an equal share keeps all its rows
+    share = budget // len(sizes)
+    assert (quotas[sizes <= share] == sizes[sizes <= share]).all()
+
+
+@pytest.mark.parametrize('budget', [50, 500, 100000])
+def test_stratified_sample_keeps_the_budget_and_every_category(speed, budget):
+    sample = stratified_sample(speed, 'DAMAGE_LEVEL', budget)
+    assert len(sample) == min(budget, len(speed))
+    assert sample.index.is_unique and sample.index.isin(speed.index).all()
+    pd.testing.assert_frame_equal(sample, speed.loc[sample.index])
+    # rare categories (Destroyed) are kept
+    assert set(sample['DAMAGE_LEVEL'].dropna()) == set(speed['DAMAGE_LEVEL'].dropna())
+    # the same rows every time
+    pd.testing.assert_frame_equal(sample, stratified_sample(speed, 'DAMAGE_LEVEL', budget))
+
+
+def test_stratified_sample_only_draws_the_given_rows(speed):
+    rows = np.arange(0, len(speed), 4)
+    sample = stratified_sample(speed, 'DAMAGE_LEVEL', 300, rows=rows)
+    assert len(sample) == 300
+    assert sample.index.isin(speed.index[rows]).all()
+
+
+def chart_tables(chart):
+    # the tables of the points, the top and the right histograms of the jointplot
+    return chart.vconcat[1].hconcat[0].data, chart.vconcat[0].data, chart.vconcat[1].hconcat[1].data
+
+
+@pytest.mark.parametrize('mode', JOINTPLOT_MODES)
+def test_jointplot_modes_draw_the_counts_of_the_rows(speed, mode):
+    rows = np.arange(0, len(speed), 2)
+    drawn = speed.iloc[rows]
+    points, top, right = chart_tables(altair_jointplot_speed_and_height(speed, 'DAMAGE_LEVEL', mode=mode, point_budget=500, rows=rows))
+    # the histograms count every row whatever the mode
+    assert top['counts'].sum() == drawn.dropna(subset=['DAMAGE_LEVEL', 'SPEED']).shape[0]
+    assert right['counts'].sum() == drawn.dropna(subset=['DAMAGE_LEVEL', 'HEIGHT']).shape[0]
+    if mode == 'points':
+        pd.testing.assert_frame_equal(points, drawn[['SPEED', 'HEIGHT', 'DAMAGE_LEVEL']])
+    elif mode == 'sample':
+        assert len(points) == 500
+    else:
+        assert points['counts'].sum() == drawn.dropna(subset=['DAMAGE_LEVEL', 'SPEED', 'HEIGHT']).shape[0]
+
+
+def test_jointplot_rejects_an_unknown_mode(speed):
+    with pytest.raises(ValueError):
+        altair_jointplot_speed_and_height(speed, 'DAMAGE_LEVEL', mode='hexbin')
@@ -0,0 +1,10 @@
+from state_cache import CHART_CACHE, cache_get, chart_json, clear_cache, dataset_version, filter_state
+from warmup import BACKGROUND_STEPS, DEFAULT_CHARTS, FIRST_VIEW_STEPS, run_steps
+
+
+def test_warm_up_caches_the_charts_of_the_default_view(artifact):
+    clear_cache(CHART_CACHE)
+    run_steps(FIRST_VIEW_STEPS + BACKGROUND_STEPS, artifact)
+    for name, build in DEFAULT_CHARTS.items():
+        spec = cache_get(CHART_CACHE, (name, dataset_version(artifact), filter_state()))
+        assert spec == chart_json(build(artifact))
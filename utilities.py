@@ -1,6 +1,8 @@
 import altair as alt
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 
 # column types
@@ -37,7 +39,7 @@ BOOLEAN_COLUMNS = [
 ]
 
 DATETIME_COLUMNS = [
-    'INCIDENT_DATE ', 'INCIDENT_MONTH', 'INCIDENT_YEAR', 'TIME',
+    'INCIDENT_DATE', 'INCIDENT_MONTH', 'INCIDENT_YEAR', 'TIME',
 ]
 
 
@@ -122,79 +124,347 @@ def text_preprocess_helper_func(x):
         return x
 
 
+# every character for which str.isspace() is True, this is exactly the set str.strip() removes
+# so trimming with it in arrow gives the same result as the python helper above
+PYTHON_WHITESPACE = (
+    '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006'
+    '\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+)
+
+TEXT_FIELDS_TO_STRIP = NOMINAL_COLUMNS + TEXT_COLUMNS + ['INCIDENT_DATE', 'TIME', 'NUM_STRUCK', 'NUM_SEEN']
+
+
+def replace_columns(df, new_columns):
+    # builds the frame once instead of assigning the columns one by one, every single
+    # assignment rewrites the whole consolidated object block
+    return pd.DataFrame({col: new_columns.get(col, df[col]) for col in df.columns}, index=df.index)
+
+
+def normalize_text_column(series):
+    # vectorized equivalent of series.apply(text_preprocess_helper_func) followed by
+    # converting the empty strings to NaN, done in a single pass over the column
+    values = series.to_numpy(dtype=object)
+    present = values == values  # NaN never equals itself, same check as the helper
+    if not present.any():
+        return series
+
+    # str() the present values which are not strings yet (numbers in float/int columns)
+    as_strings = values[present]
+    if pd.api.types.infer_dtype(as_strings, skipna=False) != 'string':
+        as_strings = pd.Series(as_strings, dtype=object).astype(str).to_numpy(dtype=object)
+
+    # trim with the arrow string kernel and only bring back the values which changed or
+    # became empty, the untouched ones keep their original python string objects
+    arrow_strings = pa.array(as_strings, type=pa.string())
+    stripped = pc.utf8_trim(arrow_strings, characters=PYTHON_WHITESPACE)
+    stripped_length = pc.binary_length(stripped)
+    changed = pc.or_(
+        pc.not_equal(stripped_length, pc.binary_length(arrow_strings)), pc.equal(stripped_length, 0)
+    ).to_numpy(zero_copy_only=False)
+    if changed.any():
+        changed_values = stripped.filter(pa.array(changed)).to_numpy(zero_copy_only=False).astype(object)
+        changed_values[changed_values == ''] = np.nan
+        as_strings[changed] = changed_values
+
+    result = values.copy()
+    result[present] = as_strings
+    return pd.Series(result, index=series.index, name=series.name, dtype=object)
+
+
 def preprocess_text_fields(df):
-    # print('''
-    # \n\n\n
-    # Preprocessing happening.
-    # \n\n\n
-    # ''')
-    columns_to_be_stripped = NOMINAL_COLUMNS + TEXT_COLUMNS + ['INCIDENT_DATE', 'TIME', 'NUM_STRUCK', 'NUM_SEEN']
-    for col in columns_to_be_stripped:
-        # print(col)
-        df[col] = df[col].apply(text_preprocess_helper_func)
-    
-    # now convertinf empty strings to None values
-    for col in columns_to_be_stripped:
-        df.loc[df[col] == '', col] = np.nan
-    
-    return df
+    # strips the strings and makes empty strings NaN for all the nominal, text and a few
+    # ordinal/datetime columns. Gives the same output as applying text_preprocess_helper_func
+    # on every cell and masking the empty strings afterwards.
+    normalized = {col: normalize_text_column(df[col]) for col in TEXT_FIELDS_TO_STRIP}
+    return replace_columns(df, normalized)
 
 
-# remapping precipitation
-def map_to_provided_labels(x, mapping):
-    if x == x:
-        return mapping[x]
-    else:
-        return x
+# columns which are remapped and the mapping used for each of them
+REMAPPING_REGISTRY = {
+    'PRECIPITATION': PRECIPITATION_MAPPING,
+    'DAMAGE_LEVEL': DAMAGE_LEVEL_MAPPING,
+    'EFFECT': EFFECT_MAPPING,
+    'WARNED': WARNED_MAPPING,
+    'AC_MASS': AC_MASS_MAPPING,
+    'TYPE_ENG': TYPE_ENGINE_MAPPING,
+}
+
+# what to do with labels which are not present in the mapping
+#   keep   : leave the label as it is
+#   nan    : replace the label with NaN
+#   report : replace the label with NaN and count it in the unknown label report
+UNKNOWN_LABEL_POLICIES = ('keep', 'nan', 'report')
+
+
+def remap_column(series, mapping, unknown_policy='keep'):
+    '''
+    Remaps a column through its categories, every distinct label is looked up once and
+    the row codes are translated with a single take. Returns the remapped categorical
+    column and a dict with the number of rows for each label missing from the mapping.
+    '''
+    if unknown_policy not in UNKNOWN_LABEL_POLICIES:
+        raise ValueError('unknown_policy should be one of {}'.format(UNKNOWN_LABEL_POLICIES))
+
+    categorical = series.astype('category')
+    categories = categorical.cat.categories
+    codes = categorical.cat.codes.to_numpy()
+
+    targets = []
+    unknown_positions = []
+    for position, label in enumerate(categories):
+        if label in mapping:
+            targets.append(mapping[label])
+        else:
+            unknown_positions.append(position)
+            targets.append(label if unknown_policy == 'keep' else np.nan)
+
+    new_categories = pd.Index(pd.unique(pd.Series([t for t in targets if t == t], dtype=object)))
+    try:
+        new_categories = new_categories.sort_values()
+    except TypeError:
+        # kept labels of mixed types, leave them in order of appearance
+        pass
+    # the extra -1 at the end keeps the missing values (code -1) missing
+    translation = np.array(
+        [new_categories.get_loc(t) if t == t else -1 for t in targets] + [-1], dtype=np.int64
+    )
+    remapped = pd.Series(
+        pd.Categorical.from_codes(translation[codes], new_categories),
+        index=series.index, name=series.name,
+    )
+
+    unknown_counts = {}
+    if unknown_positions:
+        counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+        unknown_counts = {categories[p]: int(counts[p]) for p in unknown_positions}
+    return remapped, unknown_counts
+
+
+def remapping_function(df, unknown_policy='keep', unknown_report=None):
+    # remaps all the columns in REMAPPING_REGISTRY, labels missing from a mapping are
+    # handled as per unknown_policy and counted per column in unknown_report (if a dict is given)
+    if unknown_policy == 'report' and unknown_report is None:
+        raise ValueError('unknown_report dict is required with the report policy')
+    remapped = {}
+    for col, mapping in REMAPPING_REGISTRY.items():
+        remapped[col], unknown_counts = remap_column(df[col], mapping, unknown_policy=unknown_policy)
+        if unknown_counts and unknown_report is not None:
+            unknown_report[col] = unknown_counts
+    return replace_columns(df, remapped)
+
+
+# fixed domains of the speed and height jointplot, the histograms are binned over them
+SPEED_DOMAIN = (0.0, 340.0)
+HEIGHT_DOMAIN = (0.0, 16500.0)
+# 'points' draws every row, 'sample' at most point_budget rows (every category keeps
+# its share) and 'density' the number of rows per cell of a 2-D grid
+JOINTPLOT_MODES = ('points', 'sample', 'density')
+
+
+def vega_bin_edges(extent, maxbins, base=10, divide=(5, 2)):
+    # the bin boundaries vega chooses for alt.Bin(maxbins=maxbins, extent=extent)
+    start, stop = extent
+    span = stop - start
+    level = np.ceil(np.log(maxbins) / np.log(base))
+    step = base ** (np.round(np.log(span) / np.log(base)) - level)
+    while np.ceil(span / step) > maxbins:
+        step *= base
+    for d in divide:
+        if span / (step / d) <= maxbins:
+            step /= d
+    precision = 0 if np.log(step) >= 0 else int(-np.log(step) / np.log(base)) + 1
+    nice_start = np.floor(start / step + base ** (-precision - 1)) * step
+    start = nice_start - step if start < nice_start else nice_start
+    stop = np.ceil(stop / step) * step
+    return start + step * np.arange(int(round((stop - start) / step)) + 1)
+
 
-def remapping_function(df):
-    df['PRECIPITATION'] = df.PRECIPITATION.apply(lambda x : map_to_provided_labels(x, PRECIPITATION_MAPPING))
-    df['DAMAGE_LEVEL'] = df.DAMAGE_LEVEL.apply(lambda x : map_to_provided_labels(x, DAMAGE_LEVEL_MAPPING))
-    df['EFFECT'] = df.EFFECT.apply(lambda x : map_to_provided_labels(x, EFFECT_MAPPING))
-    df['WARNED'] = df.WARNED.apply(lambda x : map_to_provided_labels(x, WARNED_MAPPING))
-    df['AC_MASS'] = df.AC_MASS.apply(lambda x : map_to_provided_labels(x, AC_MASS_MAPPING))
-    df['TYPE_ENG'] = df.TYPE_ENG.apply(lambda x : map_to_provided_labels(x, TYPE_ENGINE_MAPPING))
-    return df
+def category_tables(tables, dtype, columns):
+    # the non empty rows of the per category tables, the category column gets its dtype back
+    table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
+    table[columns[0]] = table[columns[0]].astype(dtype)
+    return table[table['counts'] > 0]
 
 
-def altair_jointplot_speed_and_height(df, color_column, opacity=0.3):
-    base = alt.Chart(df)
-    xscale = alt.Scale(domain=(0.0, 340.0))
-    yscale = alt.Scale(domain=(0.0, 16500.0))
+def category_groups(df, color_column, rows=None):
+    # (category, row positions) of every category present in the rows (all when None),
+    # in the order of the categories like groupby(color_column, observed=True)
+    codes = df[color_column].cat.codes.to_numpy()
+    positions = np.arange(len(df)) if rows is None else np.asarray(rows)
+    codes = codes[positions]
+    categories = df[color_column].cat.categories
+    return [(categories[code], positions[codes == code]) for code in np.unique(codes[codes >= 0])]
+
+
+def column_values(df, column, rows):
+    # float values of column at the given row positions, without copying the frame
+    return df[column].to_numpy(dtype=np.float64, na_value=np.nan)[rows]
+
+
+def binned_values(df, column, rows, edges):
+    # values outside the bins are counted in the first or last bin like vega does with an
+    # extent, np.histogram would leave them out
+    return np.clip(column_values(df, column, rows), edges[0], edges[-1])
+
+
+def histogram_table(df, field, color_column, edges, rows=None):
+    # rows per bin of field and color category, for bars with bin='binned'. rows are
+    # the row positions to count (all when None), e.g. from bitmap_index.bitmap_rows
+    tables = []
+    for category, positions in category_groups(df, color_column, rows):
+        counts, _ = np.histogram(binned_values(df, field, positions, edges), bins=edges)
+        tables.append(pd.DataFrame({
+            color_column: category, 'bin_start': edges[:-1], 'bin_end': edges[1:], 'counts': counts,
+        }))
+    return category_tables(tables, df[color_column].dtype, [color_column, 'bin_start', 'bin_end', 'counts'])
+
+
+def density_table(df, color_column, maxbins=40, rows=None):
+    # rows per cell of a speed x height grid and color category, placed at the cell centers
+    speed_edges = vega_bin_edges(SPEED_DOMAIN, maxbins)
+    height_edges = vega_bin_edges(HEIGHT_DOMAIN, maxbins)
+    speed_centers, height_centers = np.meshgrid(
+        (speed_edges[:-1] + speed_edges[1:]) / 2, (height_edges[:-1] + height_edges[1:]) / 2, indexing='ij'
+    )
+    tables = []
+    for category, positions in category_groups(df, color_column, rows):
+        counts, _, _ = np.histogram2d(
+            binned_values(df, 'SPEED', positions, speed_edges), binned_values(df, 'HEIGHT', positions, height_edges),
+            bins=[speed_edges, height_edges],
+        )
+        tables.append(pd.DataFrame({
+            color_column: category, 'SPEED': speed_centers.ravel(), 'HEIGHT': height_centers.ravel(),
+            'counts': counts.ravel().astype(np.int64),
+        }))
+    return category_tables(tables, df[color_column].dtype, [color_column, 'SPEED', 'HEIGHT', 'counts'])
+
+
+def allocate_budget(sizes, budget):
+    # points per category, categories smaller than an equal share keep all their rows
+    # and what they leave goes to the larger ones
+    quotas = np.zeros(len(sizes), dtype=np.int64)
+    remaining = budget
+    for i, position in enumerate(np.argsort(sizes, kind='stable')):
+        quotas[position] = min(sizes[position], remaining // (len(sizes) - i))
+        remaining -= quotas[position]
+    return quotas
+
+
+def stratified_sample(df, column, budget, seed=0, rows=None):
+    # at most budget rows, sampled per category of column so rare categories stay visible,
+    # the same rows are drawn on every rerun. rows restricts the sample to these positions
+    if rows is not None:
+        rows = np.asarray(rows)
+        if len(rows) <= budget:
+            return df.iloc[rows]
+    elif len(df) <= budget:
+        return df
+    codes = df[column].cat.codes.to_numpy() if isinstance(df[column].dtype, pd.CategoricalDtype) else pd.factorize(df[column])[0]
+    if rows is not None:
+        codes = codes[rows]
+    categories = np.unique(codes)
+    quotas = allocate_budget(np.array([(codes == c).sum() for c in categories]), budget)
+    rng = np.random.default_rng(seed)
+    keep = np.concatenate([
+        rng.choice(np.flatnonzero(codes == c), size=quota, replace=False) for c, quota in zip(categories, quotas)
+    ])
+    keep = np.sort(keep)
+    return df.iloc[keep if rows is None else rows[keep]]
+
+
+def altair_jointplot_speed_and_height(df, color_column, opacity=0.3, mode='points', point_budget=5000, rows=None):
+    # rows are the row positions of df to draw (all when None), only the drawn points are copied
+    if mode not in JOINTPLOT_MODES:
+        raise ValueError('mode must be one of {}, got {!r}'.format(JOINTPLOT_MODES, mode))
+    xscale = alt.Scale(domain=SPEED_DOMAIN)
+    yscale = alt.Scale(domain=HEIGHT_DOMAIN)
     bar_args = {'opacity': opacity, 'binSpacing': 0}
-    points = base.mark_circle().encode(
-        alt.X('SPEED', scale=xscale),
-        alt.Y('HEIGHT', scale=yscale),
-        color=color_column,
-    ).interactive()
+    if mode == 'density':
+        points = alt.Chart(density_table(df, color_column, rows=rows)).mark_circle(opacity=opacity).encode(
+            alt.X('SPEED', scale=xscale),
+            alt.Y('HEIGHT', scale=yscale),
+            color=color_column,
+            size=alt.Size('counts:Q', title='count'),
+        ).interactive()
+    else:
+        if mode == 'sample':
+            drawn = stratified_sample(df, color_column, point_budget, rows=rows)
+        else:
+            drawn = df if rows is None else df.iloc[rows]
+        points = alt.Chart(drawn[['SPEED', 'HEIGHT', color_column]]).mark_circle().encode(
+            alt.X('SPEED', scale=xscale),
+            alt.Y('HEIGHT', scale=yscale),
+            color=color_column,
+        ).interactive()
 
-    top_hist = base.mark_bar(**bar_args).encode(
-        alt.X('SPEED:Q',
-            # when using bins, the axis scale is set through
-            # the bin extent, so we do not specify the scale here
-            # (which would be ignored anyway)
-            bin=alt.Bin(maxbins=20, extent=xscale.domain),
-            stack=None,
-            title=''
-            ),
-        alt.Y('count()', stack=None, title=''),
+    # the histograms are binned here like alt.Bin(maxbins=20, extent=domain) would
+    top_hist = alt.Chart(histogram_table(df, 'SPEED', color_column, vega_bin_edges(SPEED_DOMAIN, 20), rows)).mark_bar(**bar_args).encode(
+        alt.X('bin_start:Q', bin='binned', title=''),
+        alt.X2('bin_end:Q'),
+        alt.Y('counts:Q', stack=None, title=''),
         alt.Color('{}:N'.format(color_column)),
     ).properties(height=60).interactive()
 
-    right_hist = base.mark_bar(**bar_args).encode(
-        alt.Y('HEIGHT:Q',
-            bin=alt.Bin(maxbins=20, extent=yscale.domain),
-            stack=None,
-            title='',
-            ),
-        alt.X('count()', stack=None, title=''),
+    right_hist = alt.Chart(histogram_table(df, 'HEIGHT', color_column, vega_bin_edges(HEIGHT_DOMAIN, 20), rows)).mark_bar(**bar_args).encode(
+        alt.Y('bin_start:Q', bin='binned', title=''),
+        alt.Y2('bin_end:Q'),
+        alt.X('counts:Q', stack=None, title=''),
         alt.Color('{}:N'.format(color_column)),
     ).properties(width=60).interactive()
     return top_hist & (points | right_hist)
 
 
+def altair_boxplot_from_stats(df, x, value, column=None, size=14):
+    # draws what mark_boxplot draws, from the summary and outlier rows of
+    # chart_data.box_stats instead of every value. column is a shorthand with its type
+    base = alt.Chart()
+    x = alt.X('{}:N'.format(x))
+    y_title = {'title': value}
+    outliers = base.mark_point().encode(x, alt.Y('{}:Q'.format(value), **y_title))
+    whiskers = base.mark_rule().encode(x, alt.Y('lower_whisker:Q', **y_title), alt.Y2('upper_whisker:Q'))
+    box = base.mark_bar(size=size).encode(x, alt.Y('lower_box:Q', **y_title), alt.Y2('upper_box:Q'))
+    median = base.mark_tick(color='white', size=size).encode(x, alt.Y('mid_box:Q', **y_title))
+    chart = alt.layer(outliers, whiskers, box, median, data=df).interactive()
+    if column is not None:
+        chart = chart.facet(column=column)
+    return chart
+
+
+def altair_strikes_per_year(counts):
+    # strikes per year line, from aggregates.strikes_per_year
+    return alt.Chart(counts).mark_line().encode(
+        alt.X('INCIDENT_YEAR', axis=alt.Axis(format='%Y')),
+        alt.Y('counts'),
+    )
+
+
+def altair_null_rates(null_rate):
+    # share of missing values per column, from missingness.missingness_summary
+    data = null_rate.rename('null_rate').rename_axis('column').reset_index()
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X('column:N', sort='-y'),
+        y=alt.Y('null_rate:Q', axis=alt.Axis(format='%')),
+        tooltip=['column', alt.Tooltip('null_rate:Q', format='.2%')],
+    )
+
+
+def altair_missingness_heatmap(data, x, y, value, value_format='.2%'):
+    # long form table (missingness.null_rate_per_year_table / co_missing_table) as a heatmap
+    return alt.Chart(data).mark_rect().encode(
+        x='{}:O'.format(x),
+        y='{}:N'.format(y),
+        color=alt.Color('{}:Q'.format(value), scale=alt.Scale(scheme='viridis')),
+        tooltip=[x, y, alt.Tooltip('{}:Q'.format(value), format=value_format)],
+    )
+
+
 def get_correlation_graph(df, col_list):
-    cor_data = (df[col_list]).corr().stack().reset_index().rename(columns={0: 'correlation', 'level_0': 'variable', 'level_1': 'variable2'})
+    return correlation_heatmap(df[col_list].corr())
+
+
+def correlation_heatmap(corr):
+    # corr is a correlation matrix like df.corr() returns
+    cor_data = corr.stack().reset_index().rename(columns={0: 'correlation', 'level_0': 'variable', 'level_1': 'variable2'})
     cor_data['correlation_label'] = cor_data['correlation'].map('{:.2f}'.format)  # Round to 2 decimal
     cor_data.head()
     base = alt.Chart(cor_data).encode(
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from aggregates import cube_cells, load_cube, strikes_per_year
+from bitmap_index import load_bitmap_index
+from correlation import load_correlation_statistics
+from data_loader import ARTIFACT_PATH, ensure_artifact, load_columns
+from defaults import DEFAULT_TIMES_OF_DAY, DEFAULT_YEAR_RANGE
+from instrumentation import instrument, new_run
+from missingness import load_missingness
+from ranking import load_ranking_indexes
+from state_cache import chart_spec, filter_state, memoize
+from utilities import altair_null_rates, altair_strikes_per_year
+
+
+# Everything the first page view needs, prepared on a background thread when the process
+# serves its first session so the page renders right away. Each step only fills the
+# process wide caches the application reads from, a session reaching a step before the
+# thread just computes it itself (the caches are locked).
+
+FILTER_COLUMNS = ['INCIDENT_YEAR', 'TIME_OF_DAY']
+
+
+def prepare_artifact(path=ARTIFACT_PATH):
+    # the artifact is built at deploy time by etl.py, the csv is only preprocessed here
+    # when it is missing
+    if not os.path.exists(path):
+        ensure_artifact(path=path)
+    return path
+
+
+def default_cells(path=ARTIFACT_PATH):
+    state = filter_state(DEFAULT_YEAR_RANGE, DEFAULT_TIMES_OF_DAY)
+    return memoize('cells', state, lambda: cube_cells(DEFAULT_YEAR_RANGE, DEFAULT_TIMES_OF_DAY, path), path)
+
+
+def chart_1(path=ARTIFACT_PATH):
+    return altair_strikes_per_year(strikes_per_year(load_cube(path)['size']))
+
+
+def chart_null_rates(path=ARTIFACT_PATH):
+    return altair_null_rates(load_missingness(path)['null_rate'])
+
+
+# the charts the page shows before any widget is touched (the first tab of every group of
+# tabs), the application draws them with the same builders so the warmed json is the one
+# a session would cache
+DEFAULT_CHARTS = {
+    'chart_1': chart_1,
+    'chart_null_rates': chart_null_rates,
+}
+
+
+def default_chart(name, path=ARTIFACT_PATH):
+    return chart_spec(name, filter_state(), lambda: DEFAULT_CHARTS[name](path), path)
+
+
+# in order, the later steps read what the earlier ones load. The first view needs the
+# steps of FIRST_VIEW_STEPS, the others (analyses the user has to pick and the summaries
+# read from the tables etl.py stored) keep running after it
+FIRST_VIEW_STEPS = [
+    ('artifact', prepare_artifact),
+    ('filter columns', lambda path: load_columns(FILTER_COLUMNS, path)),
+    ('cube', load_cube),
+    ('default cells', default_cells),
+    ('bitmap index', load_bitmap_index),
+    ('default charts', lambda path: default_chart('chart_1', path)),
+]
+BACKGROUND_STEPS = [
+    ('missingness', load_missingness),
+    ('missingness charts', lambda path: default_chart('chart_null_rates', path)),
+    ('ranking', load_ranking_indexes),
+    ('correlation', load_correlation_statistics),
+]
+
+_WARM_UP = {
+    'thread': None, 'ready': threading.Event(), 'done': threading.Event(), 'timings': {}, 'error': None,
+    'run': new_run(),
+}
+_WARM_UP_LOCK = threading.Lock()
+
+
+def run_steps(steps, path):
+    for name, step in steps:
+        instrument(_WARM_UP['run'], 'warm up: {}'.format(name), lambda: step(path))
+        _WARM_UP['timings'][name] = _WARM_UP['run']['stages'][-1]['seconds']
+        print('warm up : {} took {:.2f}s'.format(name, _WARM_UP['timings'][name]))
+
+
+def warm_up(path=ARTIFACT_PATH):
+    # runs the steps and logs how long each one took, stops at the first failure
+    start = time.perf_counter()
+    try:
+        run_steps(FIRST_VIEW_STEPS, path)
+        print('warm up : first view ready in {:.2f}s'.format(time.perf_counter() - start))
+        _WARM_UP['ready'].set()
+        run_steps(BACKGROUND_STEPS, path)
+        print('warm up : done in {:.2f}s'.format(time.perf_counter() - start))
+    except Exception as error:
+        _WARM_UP['error'] = error
+        print('warm up : failed after {:.2f}s, {!r}'.format(time.perf_counter() - start, error))
+    finally:
+        _WARM_UP['ready'].set()
+        _WARM_UP['done'].set()
+
+
+def start_warm_up(path=ARTIFACT_PATH):
+    # starts the warm up once per process, the later calls do nothing
+    with _WARM_UP_LOCK:
+        if _WARM_UP['thread'] is None:
+            _WARM_UP['thread'] = threading.Thread(target=warm_up, args=(path,), name='warm-up', daemon=True)
+            _WARM_UP['thread'].start()
+    return _WARM_UP['thread']
+
+
+def warm_up_ready():
+    return _WARM_UP['ready'].is_set()
+
+
+def wait_for_warm_up(timeout=None):
+    # True once the first view is ready (also when the warm up failed, see warm_up_status)
+    return _WARM_UP['ready'].wait(timeout)
+
+
+def warm_up_status():
+    return {
+        'started': _WARM_UP['thread'] is not None,
+        'ready': warm_up_ready(),
+        'done': _WARM_UP['done'].is_set(),
+        'timings': dict(_WARM_UP['timings']),
+        'error': _WARM_UP['error'],
+    }